@@ -75,6 +75,70 @@ def get_local_client(
         return LocalClient(mopts=opts, skip_perm_errors=skip_perm_errors)
 
 
+class JobProgress(object):
+    '''
+    Keep track of the minions a job is still waiting on
+
+    The outstanding minions are updated as the returns come in, so checking
+    whether a job is complete does not depend on the number of minions.
+    '''
+    def __init__(self, jid, minions=()):
+        self.jid = jid
+        self.start = time.time()
+        self.minions = set()
+        self.found = set()
+        self.outstanding = set()
+        self.unexpected = 0
+        self.find_job = 0
+        self.add_minions(minions)
+
+    @property
+    def done(self):
+        '''
+        True once every expected minion has returned
+        '''
+        return not self.outstanding
+
+    def add_minions(self, minions):
+        '''
+        Add minions the job is expected to return from
+        '''
+        for minion in minions:
+            if minion in self.minions:
+                continue
+            self.minions.add(minion)
+            if minion in self.found:
+                # This one returned before being announced
+                self.unexpected -= 1
+            else:
+                self.outstanding.add(minion)
+
+    def add_return(self, minion):
+        '''
+        Record a return, returns False if the minion already returned
+        '''
+        if minion in self.found:
+            return False
+        self.found.add(minion)
+        if minion in self.outstanding:
+            self.outstanding.remove(minion)
+        else:
+            self.unexpected += 1
+        return True
+
+    def counters(self):
+        '''
+        Return the progress counters of the job
+        '''
+        return {'jid': self.jid,
+                'expected': len(self.minions),
+                'returned': len(self.found),
+                'outstanding': len(self.outstanding),
+                'unexpected': self.unexpected,
+                'find_job': self.find_job,
+                'duration': time.time() - self.start}
+
+
 class LocalClient(object):
     '''
     The interface used by the :command:`salt` CLI tool on the Salt Master
@@ -120,6 +184,8 @@ class LocalClient(object):
                 listen=not self.opts.get('__worker', False))
 
         self.returners = salt.loader.returners(self.opts, {})
+        # The progress of the jobs whose returns are being collected
+        self.progress = {}
 
     def __read_master_key(self):
         '''
@@ -778,6 +844,15 @@ class LocalClient(object):
             if len(found.intersection(minions)) >= len(minions):
                 raise StopIteration()
 
+    def job_progress(self, jid):
+        '''
+        Return the progress counters of a job whose returns are being
+        collected, or an empty dict
+        '''
+        if jid not in self.progress:
+            return {}
+        return self.progress[jid].counters()
+
     def get_iter_returns(
             self,
             jid,
@@ -790,25 +865,25 @@ class LocalClient(object):
         '''
         Watch the event system and return job data as it comes in
 
+        The progress of the job can be read with :py:meth:`job_progress`
+        while the returns are collected.
+
         :returns: all of the information for the JID
         '''
-        if not isinstance(minions, set):
-            if isinstance(minions, string_types):
-                minions = set([minions])
-            elif isinstance(minions, (list, tuple)):
-                minions = set(list(minions))
+        if isinstance(minions, string_types):
+            minions = [minions]
 
         if timeout is None:
             timeout = self.opts['timeout']
-        start = int(time.time())
-        timeout_at = start + timeout
-        found = set()
+        timeout_at = time.time() + timeout
         # Check to see if the jid is real, if not return the empty dict
         if not self.returners['{0}.get_load'.format(self.opts['master_job_cache'])](jid) != {}:
             log.warning('jid does not exist')
             yield {}
             # stop the iteration, since the jid is invalid
             raise StopIteration()
+        progress = JobProgress(jid, minions)
+        self.progress[jid] = progress
         # Wait for the hosts to check in
         syndic_wait = 0
         last_time = False
@@ -817,94 +892,93 @@ class LocalClient(object):
                 jid, minions, datetime.fromtimestamp(timeout_at).time()
             )
         )
-        while True:
-            # Process events until timeout is reached or all minions have returned
-            time_left = timeout_at - int(time.time())
-            # Wait 0 == forever, use a minimum of 1s
-            wait = max(1, time_left)
-            raw = None
-            # Look for events if we haven't yet found all the minions or if we are still waiting for
-            # the syndics to report on how many minions they have forwarded the command to
-            if (len(found.intersection(minions)) < len(minions) or
-                    (self.opts['order_masters'] and syndic_wait < self.opts.get('syndic_wait', 1))):
-                raw = self.event.get_event(wait, jid)
-            if raw is not None:
-                if 'minions' in raw.get('data', {}):
-                    minions.update(raw['data']['minions'])
-                    continue
-                if 'syndic' in raw:
-                    minions.update(raw['syndic'])
-                    continue
-                if 'return' not in raw:
-                    continue
-                if kwargs.get('raw', False):
-                    found.add(raw['id'])
-                    yield raw
-                else:
-                    found.add(raw['id'])
-                    ret = {raw['id']: {'ret': raw['return']}}
-                    if 'out' in raw:
-                        ret[raw['id']]['out'] = raw['out']
-                    log.debug('jid {0} return from {1}'.format(jid, raw['id']))
-                    yield ret
-                if len(found.intersection(minions)) >= len(minions):
+        try:
+            while True:
+                # Process events until timeout is reached or all minions have returned
+                raw = None
+                waiting_syndics = (self.opts['order_masters'] and
+                                   syndic_wait < self.opts.get('syndic_wait', 1))
+                # Look for events if we haven't yet found all the minions or if we are still waiting for
+                # the syndics to report on how many minions they have forwarded the command to
+                if not progress.done or waiting_syndics:
+                    wait = timeout_at - time.time()
+                    if last_time:
+                        # Collect the returns which came in while find_job
+                        # ran, use a minimum of 1s
+                        wait = max(1, wait)
+                    # Wait 0 == forever, only block until the deadline
+                    if wait > 0:
+                        raw = self.event.get_event(wait, jid)
+                if raw is not None:
+                    if 'minions' in raw.get('data', {}):
+                        progress.add_minions(raw['data']['minions'])
+                        continue
+                    if 'syndic' in raw:
+                        progress.add_minions(raw['syndic'])
+                        continue
+                    if 'return' not in raw:
+                        continue
+                    progress.add_return(raw['id'])
+                    if kwargs.get('raw', False):
+                        yield raw
+                    else:
+                        ret = {raw['id']: {'ret': raw['return']}}
+                        if 'out' in raw:
+                            ret[raw['id']]['out'] = raw['out']
+                        log.debug('jid {0} return from {1}'.format(jid, raw['id']))
+                        yield ret
+                    if not progress.done:
+                        continue
+                if progress.done:
                     # All minions have returned, break out of the loop
-                    log.debug('jid {0} found all minions {1}'.format(jid, found))
-                    if self.opts['order_masters']:
-                        if syndic_wait < self.opts.get('syndic_wait', 1):
-                            syndic_wait += 1
-                            timeout_at = int(time.time()) + 1
-                            log.debug('jid {0} syndic_wait {1} will now timeout at {2}'.format(
-                                      jid, syndic_wait, datetime.fromtimestamp(timeout_at).time()))
-                            continue
-                    break
-                continue
-            # Then event system timeout was reached and nothing was returned
-            if len(found.intersection(minions)) >= len(minions):
-                # All minions have returned, break out of the loop
-                log.debug('jid {0} found all minions {1}'.format(jid, found))
-                if self.opts['order_masters']:
-                    if syndic_wait < self.opts.get('syndic_wait', 1):
+                    log.debug('jid {0} found all minions {1}'.format(jid, progress.found))
+                    if waiting_syndics:
                         syndic_wait += 1
-                        timeout_at = int(time.time()) + 1
+                        timeout_at = time.time() + 1
                         log.debug(
                             'jid {0} syndic_wait {1} will now timeout at {2}'.format(
                                 jid, syndic_wait, datetime.fromtimestamp(timeout_at).time()
                             )
                         )
                         continue
-                break
-            if last_time:
-                if len(found) < len(minions):
+                    break
+                # Then event system timeout was reached and nothing was returned
+                if last_time:
                     log.info(
                         'jid {0} minions {1} did not return in time'.format(
-                            jid, (minions - found)
+                            jid, progress.outstanding
                         )
                     )
-                if expect_minions:
-                    for minion in list((minions - found)):
-                        yield {minion: {'failed': True}}
-                break
-            if int(time.time()) > timeout_at:
-                # The timeout has been reached, check the jid to see if the
-                # timeout needs to be increased
-                jinfo = self.gather_job_info(jid, tgt, tgt_type, minions - found, **kwargs)
-                still_running = [id_ for id_, jdat in jinfo.iteritems()
-                                 if jdat
-                                 ]
-                if still_running:
-                    timeout_at = int(time.time()) + timeout
-                    log.debug(
-                        'jid {0} still running on {1} will now timeout at {2}'.format(
-                            jid, still_running, datetime.fromtimestamp(timeout_at).time()
+                    if expect_minions:
+                        for minion in sorted(progress.outstanding):
+                            yield {minion: {'failed': True}}
+                    break
+                if time.time() > timeout_at:
+                    # The timeout has been reached, check the jid to see if the
+                    # timeout needs to be increased. A single find_job is sent
+                    # to the minions which did not return yet.
+                    progress.find_job += 1
+                    outstanding = sorted(progress.outstanding)
+                    jinfo = self.gather_job_info(
+                            jid, outstanding, 'list', set(outstanding), **kwargs)
+                    still_running = [id_ for id_, jdat in jinfo.iteritems()
+                                     if jdat
+                                     ]
+                    if still_running:
+                        timeout_at = time.time() + timeout
+                        log.debug(
+                            'jid {0} still running on {1} will now timeout at {2}'.format(
+                                jid, still_running, datetime.fromtimestamp(timeout_at).time()
+                            )
                         )
-                    )
-                    continue
-                else:
-                    last_time = True
-                    log.debug('jid {0} not running on any minions last time'.format(jid))
-                    continue
-            time.sleep(0.01)
+                        continue
+                    else:
+                        last_time = True
+                        log.debug('jid {0} not running on any minions last time'.format(jid))
+                        continue
+        finally:
+            log.debug('jid {0} progress {1}'.format(jid, progress.counters()))
+            self.progress.pop(jid, None)
 
     def get_returns(
             self,
@@ -915,50 +989,40 @@ class LocalClient(object):
         '''
         Get the returns for the command line interface via the event system
         '''
-        minions = set(minions)
         if timeout is None:
             timeout = self.opts['timeout']
-        start = int(time.time())
-        timeout_at = start + timeout
+        timeout_at = time.time() + timeout
         log.debug(
             'get_returns for jid {0} sent to {1} will timeout at {2}'.format(
                 jid, minions, datetime.fromtimestamp(timeout_at).time()
             )
         )
 
-        found = set()
         ret = {}
         # Check to see if the jid is real, if not return the empty dict
         if not self.returners['{0}.get_load'.format(self.opts['master_job_cache'])](jid) != {}:
             log.warning('jid does not exist')
             return ret
 
+        progress = JobProgress(jid, minions)
         # Wait for the hosts to check in
-        while True:
-            time_left = timeout_at - int(time.time())
-            wait = max(1, time_left)
-            raw = self.event.get_event(wait, jid)
+        while not progress.done:
+            # Past the deadline the returns already received, pending ones
+            # included, are still collected, use a minimum of 1s
+            wait = max(1, timeout_at - time.time())
+            raw = self.event.get_event(wait, jid, pending_tags=pending_tags)
             if raw is not None and 'return' in raw:
-                found.add(raw['id'])
+                progress.add_return(raw['id'])
                 ret[raw['id']] = raw['return']
-                if len(found.intersection(minions)) >= len(minions):
-                    # All minions have returned, break out of the loop
-                    log.debug('jid {0} found all minions'.format(jid))
-                    break
-                continue
-            # Then event system timeout was reached and nothing was returned
-            if len(found.intersection(minions)) >= len(minions):
-                # All minions have returned, break out of the loop
-                log.debug('jid {0} found all minions'.format(jid))
-                break
-            if int(time.time()) > timeout_at:
+            elif raw is None and time.time() > timeout_at:
                 log.info(
                     'jid {0} minions {1} did not return in time'.format(
-                        jid, (minions - found)
+                        jid, progress.outstanding
                     )
                 )
                 break
-            time.sleep(0.01)
+        else:
+            log.debug('jid {0} found all minions'.format(jid))
         return ret
 
     def get_full_returns(self, jid, minions, timeout=None):
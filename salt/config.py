@@ -99,6 +99,11 @@ VALID_OPTS = {
     'ipc_mode': str,
     'ipv6': bool,
     'file_buffer_size': int,
+    'file_transfer_window': int,
+    'fileserver_handle_cache': int,
+    'fileserver_mmap': bool,
+    'fileserver_hash_index': bool,
+    'fileserver_inotify': bool,
     'tcp_pub_port': int,
     'tcp_pull_port': int,
     'log_file': str,
@@ -110,14 +115,19 @@ VALID_OPTS = {
     'log_fmt_logfile': tuple,
     'log_granular_levels': dict,
     'max_event_size': int,
+    'max_pending_events': int,
     'test': bool,
     'cython_enable': bool,
+    'virtual_index': bool,
     'show_timeout': bool,
     'show_jid': bool,
     'state_verbose': bool,
     'state_output': str,
     'state_auto_order': bool,
     'state_events': bool,
+    'state_workers': int,
+    'state_compile_cache': bool,
+    'state_prefetch_files': int,
     'acceptance_wait_time': float,
     'acceptance_wait_time_max': float,
     'rejected_retry': bool,
@@ -145,8 +155,12 @@ VALID_OPTS = {
     'pub_hwm': int,
     'rep_hwm': int,
     'worker_threads': int,
+    'pillar_workers': int,
+    'pillar_queue_depth': int,
+    'pillar_pool_timeout': int,
     'ret_port': int,
     'keep_jobs': int,
+    'keep_jobs_reap_limit': int,
     'master_roots': dict,
     'gitfs_remotes': list,
     'gitfs_mountpoint': str,
@@ -180,9 +194,17 @@ VALID_OPTS = {
     'minionfs_whitelist': list,
     'minionfs_blacklist': list,
     'ext_pillar': list,
+    'ext_pillar_threads': int,
+    'ext_pillar_timeout': int,
+    'ext_pillar_interface_timeout': dict,
+    'ext_pillar_cache_ttl': int,
+    'ext_pillar_interface_ttl': dict,
     'pillar_version': int,
     'pillar_opts': bool,
     'pillar_source_merging_strategy': str,
+    'pillar_opts_compact': bool,
+    'pillar_top_cache': bool,
+    'pillar_render_cache': bool,
     'peer': dict,
     'syndic_master': str,
     'runner_dirs': list,
@@ -207,6 +229,12 @@ VALID_OPTS = {
     'ext_job_cache': str,
     'master_job_cache': str,
     'minion_data_cache': bool,
+    'minion_data_cache_backend': str,
+    'minion_data_cache_batch_size': int,
+    'minion_data_cache_batch_interval': float,
+    'minion_data_index': bool,
+    'minion_data_index_interval': int,
+    'mine_get_cache_ttl': int,
     'publish_session': int,
     'reactor': list,
     'reactor_refresh_interval': int,
@@ -220,6 +248,10 @@ VALID_OPTS = {
     'win_gitrepos': list,
     'modules_max_memory': int,
     'grains_refresh_every': int,
+    'grains_threads': int,
+    'grains_timeout': int,
+    'grains_provider_timeout': dict,
+    'grains_provider_ttl': dict,
     'enable_lspci': bool,
     'syndic_wait': int,
     'jinja_lstrip_blocks': bool,
@@ -275,6 +307,10 @@ DEFAULT_MINION_OPTS = {
     'cache_jobs': False,
     'grains_cache': False,
     'grains_cache_expiration': 300,
+    'grains_threads': 0,
+    'grains_timeout': 0,
+    'grains_provider_timeout': {},
+    'grains_provider_ttl': {},
     'conf_file': os.path.join(salt.syspaths.CONFIG_DIR, 'minion'),
     'sock_dir': os.path.join(salt.syspaths.SOCK_DIR, 'minion'),
     'backup_mode': '',
@@ -315,6 +351,7 @@ DEFAULT_MINION_OPTS = {
     'ipc_mode': 'ipc',
     'ipv6': False,
     'file_buffer_size': 262144,
+    'file_transfer_window': 4,
     'tcp_pub_port': 4510,
     'tcp_pull_port': 4511,
     'log_file': os.path.join(salt.syspaths.LOGS_DIR, 'minion'),
@@ -326,14 +363,19 @@ DEFAULT_MINION_OPTS = {
     'log_fmt_logfile': _DFLT_LOG_FMT_LOGFILE,
     'log_granular_levels': {},
     'max_event_size': 1048576,
+    'max_pending_events': 10000,
     'test': False,
     'ext_job_cache': '',
     'cython_enable': False,
+    'virtual_index': False,
     'state_verbose': True,
     'state_output': 'full',
     'state_auto_order': True,
     'state_events': False,
     'state_aggregate': False,
+    'state_workers': 0,
+    'state_compile_cache': False,
+    'state_prefetch_files': 0,
     'acceptance_wait_time': 10,
     'acceptance_wait_time_max': 0,
     'rejected_retry': False,
@@ -384,10 +426,14 @@ DEFAULT_MASTER_OPTS = {
     'auth_mode': 1,
     'user': 'root',
     'worker_threads': 5,
+    'pillar_workers': 0,
+    'pillar_queue_depth': 2,
+    'pillar_pool_timeout': 0,
     'sock_dir': os.path.join(salt.syspaths.SOCK_DIR, 'master'),
     'ret_port': '4506',
     'timeout': 5,
     'keep_jobs': 24,
+    'keep_jobs_reap_limit': 10000,
     'root_dir': salt.syspaths.ROOT_DIR,
     'pki_dir': os.path.join(salt.syspaths.CONFIG_DIR, 'pki', 'master'),
     'cachedir': os.path.join(salt.syspaths.CACHE_DIR, 'master'),
@@ -430,14 +476,23 @@ DEFAULT_MASTER_OPTS = {
     'svnfs_env_whitelist': [],
     'svnfs_env_blacklist': [],
     'max_event_size': 1048576,
+    'max_pending_events': 10000,
     'minionfs_env': 'base',
     'minionfs_mountpoint': '',
     'minionfs_whitelist': [],
     'minionfs_blacklist': [],
     'ext_pillar': [],
+    'ext_pillar_threads': 0,
+    'ext_pillar_timeout': 0,
+    'ext_pillar_interface_timeout': {},
+    'ext_pillar_cache_ttl': 0,
+    'ext_pillar_interface_ttl': {},
     'pillar_version': 2,
     'pillar_opts': True,
+    'pillar_opts_compact': False,
     'pillar_source_merging_strategy': 'smart',
+    'pillar_top_cache': False,
+    'pillar_render_cache': False,
     'peer': {},
     'syndic_master': '',
     'runner_dirs': [],
@@ -449,6 +504,11 @@ DEFAULT_MASTER_OPTS = {
     'file_recv': False,
     'file_recv_max_size': 100,
     'file_buffer_size': 1048576,
+    'file_transfer_window': 4,
+    'fileserver_handle_cache': 32,
+    'fileserver_mmap': False,
+    'fileserver_hash_index': False,
+    'fileserver_inotify': False,
     'file_ignore_regex': None,
     'file_ignore_glob': None,
     'fileserver_backend': ['roots'],
@@ -469,7 +529,13 @@ DEFAULT_MASTER_OPTS = {
     'ext_job_cache': '',
     'master_job_cache': 'local_cache',
     'minion_data_cache': True,
+    'minion_data_cache_backend': 'files',
+    'minion_data_cache_batch_size': 64,
+    'minion_data_cache_batch_interval': 1.0,
+    'minion_data_index': False,
+    'minion_data_index_interval': 30,
     'enforce_mine_cache': False,
+    'mine_get_cache_ttl': 0,
     'ipv6': False,
     'log_file': os.path.join(salt.syspaths.LOGS_DIR, 'master'),
     'log_level': None,
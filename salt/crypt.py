@@ -36,6 +36,22 @@ from salt.exceptions import (
 
 log = logging.getLogger(__name__)
 
+try:
+    # Constant time comparison implemented in C, new in python 2.7.7
+    from hmac import compare_digest
+except ImportError:
+    def compare_digest(a, b):
+        '''
+        Compare two strings in a time which does not depend on where they
+        differ
+        '''
+        if len(a) != len(b):
+            return False
+        result = 0
+        for zipped_x, zipped_y in zip(a, b):
+            result |= ord(zipped_x) ^ ord(zipped_y)
+        return result == 0
+
 
 def dropfile(cachedir, user=None):
     '''
@@ -666,57 +682,70 @@ class Crypticle(object):
         assert len(key) == key_size / 8 + cls.SIG_SIZE, 'invalid key'
         return key[:-cls.SIG_SIZE], key[-cls.SIG_SIZE:]
 
-    def encrypt(self, data):
+    def _encrypt(self, parts):
         '''
-        encrypt data with AES-CBC and sign it with HMAC-SHA256
+        Encrypt the concatenation of the parts, the parts and the padding are
+        joined with a single copy
         '''
         aes_key, hmac_key = self.keys
-        pad = self.AES_BLOCK_SIZE - len(data) % self.AES_BLOCK_SIZE
-        data = data + pad * chr(pad)
+        size = sum(len(part) for part in parts)
+        pad = self.AES_BLOCK_SIZE - size % self.AES_BLOCK_SIZE
+        data = ''.join(list(parts) + [pad * chr(pad)])
         iv_bytes = os.urandom(self.AES_BLOCK_SIZE)
         cypher = AES.new(aes_key, AES.MODE_CBC, iv_bytes)
-        data = iv_bytes + cypher.encrypt(data)
-        sig = hmac.new(hmac_key, data, hashlib.sha256).digest()
-        return data + sig
+        data = cypher.encrypt(data)
+        mac = hmac.new(hmac_key, iv_bytes, hashlib.sha256)
+        mac.update(data)
+        return ''.join((iv_bytes, data, mac.digest()))
 
-    def decrypt(self, data):
+    def _decrypt(self, data):
         '''
-        verify HMAC-SHA256 signature and decrypt data with AES-CBC
+        Verify and decrypt data, returns the padded plain text and the length
+        of the data it holds. The signed and encrypted parts of the message
+        are read through buffers instead of being sliced out.
         '''
         aes_key, hmac_key = self.keys
-        sig = data[-self.SIG_SIZE:]
-        data = data[:-self.SIG_SIZE]
-        mac_bytes = hmac.new(hmac_key, data, hashlib.sha256).digest()
-        if len(mac_bytes) != len(sig):
+        end = len(data) - self.SIG_SIZE
+        if end < self.AES_BLOCK_SIZE:
             log.debug('Failed to authenticate message')
             raise AuthenticationError('message authentication failed')
-        result = 0
-        for zipped_x, zipped_y in zip(mac_bytes, sig):
-            result |= ord(zipped_x) ^ ord(zipped_y)
-        if result != 0:
+        mac_bytes = hmac.new(hmac_key, buffer(data, 0, end), hashlib.sha256).digest()
+        if not compare_digest(mac_bytes, data[end:]):
             log.debug('Failed to authenticate message')
             raise AuthenticationError('message authentication failed')
-        iv_bytes = data[:self.AES_BLOCK_SIZE]
-        data = data[self.AES_BLOCK_SIZE:]
-        cypher = AES.new(aes_key, AES.MODE_CBC, iv_bytes)
-        data = cypher.decrypt(data)
-        return data[:-ord(data[-1])]
+        cypher = AES.new(aes_key, AES.MODE_CBC, data[:self.AES_BLOCK_SIZE])
+        data = cypher.decrypt(
+                buffer(data, self.AES_BLOCK_SIZE, end - self.AES_BLOCK_SIZE))
+        return data, len(data) - ord(data[-1])
+
+    def encrypt(self, data):
+        '''
+        encrypt data with AES-CBC and sign it with HMAC-SHA256
+        '''
+        return self._encrypt((data,))
+
+    def decrypt(self, data):
+        '''
+        verify HMAC-SHA256 signature and decrypt data with AES-CBC
+        '''
+        data, end = self._decrypt(data)
+        return data[:end]
 
     def dumps(self, obj):
         '''
         Serialize and encrypt a python object
         '''
-        return self.encrypt(self.PICKLE_PAD + self.serial.dumps(obj))
+        return self._encrypt((self.PICKLE_PAD, self.serial.dumps(obj)))
 
     def loads(self, data):
         '''
         Decrypt and un-serialize a python object
         '''
-        data = self.decrypt(data)
+        data, end = self._decrypt(data)
         # simple integrity check to verify that we got meaningful data
         if not data.startswith(self.PICKLE_PAD):
             return {}
-        return self.serial.loads(data[len(self.PICKLE_PAD):])
+        return self.serial.loads(data[len(self.PICKLE_PAD):end])
 
 
 class SAuth(Auth):
@@ -36,13 +36,21 @@ import salt.utils.atomicfile
 import salt.utils.event
 import salt.utils.verify
 import salt.utils.minions
+import salt.utils.minion_data
 import salt.utils.gzip_util
 from salt.pillar import git_pillar
 from salt.utils.event import tagify
+from salt.utils.odict import OrderedDict
 from salt.exceptions import SaltMasterError
 
 log = logging.getLogger(__name__)
 
+# Returns of mine.get, by target, target type and function, with the time
+# they were read
+_MINE_GET_CACHE = OrderedDict()
+# The number of mine.get returns kept
+MINE_GET_CACHE_SIZE = 256
+
 # Things to do in lower layers:
 # only accept valid minion ids
 
@@ -139,7 +147,8 @@ def clean_expired_tokens(opts):
 
 def clean_old_jobs(opts):
     '''
-    Clean out the old jobs from the job cache
+    Clean out the old jobs from the job cache, returns whatever the master job
+    cache's clean_old_jobs returns
     '''
     # TODO: better way to not require creating the masterminion every time?
     mminion = salt.minion.MasterMinion(
@@ -150,7 +159,7 @@ def clean_old_jobs(opts):
     # If the master job cache has a clean_old_jobs, call it
     fstr = '{0}.clean_old_jobs'.format(opts['master_job_cache'])
     if fstr in mminion.returners:
-        mminion.returners[fstr]()
+        return mminion.returners[fstr]()
 
 
 def access_keys(opts):
@@ -377,6 +386,8 @@ class RemoteFuncs(object):
         fs_ = salt.fileserver.Fileserver(self.opts)
         self._serve_file = fs_.serve_file
         self._file_hash = fs_.file_hash
+        self._file_hashes = fs_.file_hashes
+        self._file_manifest = fs_.file_manifest
         self._file_list = fs_.file_list
         self._file_list_emptydirs = fs_.file_list_emptydirs
         self._dir_list = fs_.dir_list
@@ -500,26 +511,41 @@ class RemoteFuncs(object):
         ret = {}
         if not salt.utils.verify.valid_id(self.opts, load['id']):
             return ret
+        ttl = self.opts.get('mine_get_cache_ttl', 0)
+        tgt = load['tgt']
+        if isinstance(tgt, list):
+            # A list target, keep the memo key hashable
+            tgt = tuple(tgt)
+        key = (tgt, load.get('expr_form', 'glob'), load['fun'])
+        if ttl > 0:
+            cached = _MINE_GET_CACHE.get(key)
+            if cached is not None and time.time() - cached[0] < ttl:
+                return dict(cached[1])
         checker = salt.utils.minions.CkMinions(self.opts)
         minions = checker.check_minions(
                 load['tgt'],
                 load.get('expr_form', 'glob')
                 )
-        for minion in minions:
-            mine = os.path.join(
-                    self.opts['cachedir'],
-                    'minions',
-                    minion,
-                    'mine.p')
-            try:
-                with salt.utils.fopen(mine, 'rb') as fp_:
-                    fdata = self.serial.load(fp_).get(load['fun'])
-                    if fdata:
-                        ret[minion] = fdata
-            except Exception:
-                continue
+        ret = salt.utils.minion_data.store(self.opts).mine_get(
+                load['fun'], minions)
+        if ttl > 0:
+            _MINE_GET_CACHE.pop(key, None)
+            _MINE_GET_CACHE[key] = (time.time(), ret)
+            while len(_MINE_GET_CACHE) > MINE_GET_CACHE_SIZE:
+                _MINE_GET_CACHE.popitem(last=False)
+            ret = dict(ret)
         return ret
 
+    @staticmethod
+    def _mine_get_expire(funs=None):
+        '''
+        Drop the cached mine.get returns of the functions, of every function
+        if funs is None
+        '''
+        for key in list(_MINE_GET_CACHE):
+            if funs is None or key[2] in funs:
+                del _MINE_GET_CACHE[key]
+
     def _mine(self, load, skip_verify=False):
         '''
         Return the mine data
@@ -528,19 +554,10 @@ class RemoteFuncs(object):
             if 'id' not in load or 'data' not in load:
                 return False
         if self.opts.get('minion_data_cache', False) or self.opts.get('enforce_mine_cache', False):
-            cdir = os.path.join(self.opts['cachedir'], 'minions', load['id'])
-            if not os.path.isdir(cdir):
-                os.makedirs(cdir)
-            datap = os.path.join(cdir, 'mine.p')
-            if not load.get('clear', False):
-                if os.path.isfile(datap):
-                    with salt.utils.fopen(datap, 'rb') as fp_:
-                        new = self.serial.load(fp_)
-                    if isinstance(new, dict):
-                        new.update(load['data'])
-                        load['data'] = new
-            with salt.utils.fopen(datap, 'w+b') as fp_:
-                fp_.write(self.serial.dumps(load['data']))
+            salt.utils.minion_data.store(self.opts).mine_update(
+                    load['id'], load['data'], load.get('clear', False))
+            self._mine_get_expire(
+                    None if load.get('clear', False) else load['data'])
         return True
 
     def _mine_delete(self, load):
@@ -550,20 +567,12 @@ class RemoteFuncs(object):
         if 'id' not in load or 'fun' not in load:
             return False
         if self.opts.get('minion_data_cache', False) or self.opts.get('enforce_mine_cache', False):
-            cdir = os.path.join(self.opts['cachedir'], 'minions', load['id'])
-            if not os.path.isdir(cdir):
-                return True
-            datap = os.path.join(cdir, 'mine.p')
-            if os.path.isfile(datap):
-                try:
-                    with salt.utils.fopen(datap, 'rb') as fp_:
-                        mine_data = self.serial.load(fp_)
-                    if isinstance(mine_data, dict):
-                        if mine_data.pop(load['fun'], False):
-                            with salt.utils.fopen(datap, 'w+b') as fp_:
-                                fp_.write(self.serial.dumps(mine_data))
-                except OSError:
-                    return False
+            try:
+                salt.utils.minion_data.store(self.opts).mine_delete(
+                        load['id'], load['fun'])
+            except (IOError, OSError):
+                return False
+            self._mine_get_expire([load['fun']])
         return True
 
     def _mine_flush(self, load, skip_verify=False):
@@ -573,15 +582,11 @@ class RemoteFuncs(object):
         if not skip_verify and 'id' not in load:
             return False
         if self.opts.get('minion_data_cache', False) or self.opts.get('enforce_mine_cache', False):
-            cdir = os.path.join(self.opts['cachedir'], 'minions', load['id'])
-            if not os.path.isdir(cdir):
-                return True
-            datap = os.path.join(cdir, 'mine.p')
-            if os.path.isfile(datap):
-                try:
-                    os.remove(datap)
-                except OSError:
-                    return False
+            try:
+                salt.utils.minion_data.store(self.opts).mine_flush(load['id'])
+            except (IOError, OSError):
+                return False
+            self._mine_get_expire()
         return True
 
     def _file_recv(self, load):
@@ -648,19 +653,27 @@ class RemoteFuncs(object):
                 self.mminion.functions)
         pillar_dirs = {}
         data = pillar.compile_pillar(pillar_dirs=pillar_dirs)
+        if self.opts.get('pillar_opts_compact', False) \
+                and load.get('opts_ref', False):
+            salt.pillar.compact_master_opts(self.opts, data)
         if self.opts.get('minion_data_cache', False):
-            cdir = os.path.join(self.opts['cachedir'], 'minions', load['id'])
-            if not os.path.isdir(cdir):
-                os.makedirs(cdir)
-            datap = os.path.join(cdir, 'data.p')
-            with salt.utils.fopen(datap, 'w+b') as fp_:
-                fp_.write(
-                        self.serial.dumps(
-                            {'grains': load['grains'],
-                             'pillar': data})
-                            )
+            mtime = salt.utils.minion_data.store(self.opts).store(
+                    load['id'], load['grains'], data)
+            if self.opts.get('minion_data_index', False):
+                salt.utils.minions.minion_data_index(self.opts).update(
+                        load['id'], load['grains'], data, mtime)
         return data
 
+    def _pillar_opts(self, load):
+        '''
+        Return the master opts referenced by a compacted pillar
+        '''
+        if any(key not in load for key in ('id', 'opts_hash')):
+            return False
+        if not salt.utils.verify.valid_id(self.opts, load['id']):
+            return False
+        return salt.pillar.get_master_opts(self.opts, load['opts_hash'])
+
     def _minion_event(self, load):
         '''
         Receive an event from the minion and fire it on the master event
@@ -1548,7 +1561,8 @@ class LocalFuncs(object):
                     **load
                 )
             )
-        log.debug('Published command details {0}'.format(pub_load))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('Published command details {0}'.format(pub_load))
 
         return {'ret': {
                     'jid': load['jid'],
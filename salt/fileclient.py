@@ -31,6 +31,14 @@ from salt.utils.openstack.swift import SaltSwift
 
 log = logging.getLogger(__name__)
 
+# The sets of (saltenv, path) tuples recording the salt:// files fetched by
+# the file clients of this process, see record_files()
+_RECORDS = []
+
+# The hashes of salt:// files by (saltenv, path) which the file clients of
+# this process use instead of hashing the files again, see known_hashes()
+_HASHES = []
+
 
 def get_file_client(opts):
     '''
@@ -43,6 +51,64 @@ def get_file_client(opts):
     }.get(opts['file_client'], RemoteClient)(opts)
 
 
+@contextlib.contextmanager
+def record_files():
+    '''
+    Record the salt:// files fetched by any file client of this process while
+    the block runs, yields the set of their (saltenv, path) tuples
+    '''
+    files = set()
+    _RECORDS.append(files)
+    try:
+        yield files
+    finally:
+        _RECORDS.remove(files)
+
+
+def _record_file(path, saltenv):
+    '''
+    Add a fetched salt:// file to the active records
+    '''
+    for files in _RECORDS:
+        files.add((saltenv, path))
+
+
+@contextlib.contextmanager
+def known_hashes(hashes):
+    '''
+    Use the hashes of salt:// files of the given dict, keyed by (saltenv,
+    path) tuples, instead of hashing the files again while the block runs
+    '''
+    _HASHES.append(hashes)
+    try:
+        yield
+    finally:
+        _HASHES.remove(hashes)
+
+
+def manifest_hashes(manifest, saltenv, proto='salt://'):
+    '''
+    Return the hashes of a file manifest as a dict for known_hashes(), the
+    paths are prefixed with proto
+    '''
+    hashes = {}
+    for path, info in manifest.items():
+        if info.get('hsum'):
+            hashes[(saltenv, proto + path)] = {'hsum': info['hsum'],
+                                               'hash_type': info['hash_type']}
+    return hashes
+
+
+def _known_hash(path, saltenv):
+    '''
+    Return the known hash of a salt:// file, or None
+    '''
+    for hashes in reversed(_HASHES):
+        if (saltenv, path) in hashes:
+            return dict(hashes[(saltenv, path)])
+    return None
+
+
 class Client(object):
     '''
     Base class for Salt file interactions
@@ -161,8 +227,24 @@ class Client(object):
         ret = []
         if isinstance(paths, str):
             paths = paths.split(',')
+        rel_paths = [path[7:] for path in paths
+                     if path.startswith('salt://') and '?' not in path]
+        if rel_paths:
+            manifest = self.file_manifest(saltenv, paths=rel_paths)
+        else:
+            manifest = {}
+        with known_hashes(manifest_hashes(manifest, saltenv)):
+            for path in paths:
+                ret.append(self.cache_file(path, saltenv))
+        return ret
+
+    def hash_files(self, paths, saltenv='base'):
+        '''
+        Return the hashes of a list of salt:// files by path
+        '''
+        ret = {}
         for path in paths:
-            ret.append(self.cache_file(path, saltenv))
+            ret[path] = self.hash_file(path, saltenv)
         return ret
 
     def cache_master(self, saltenv='base', env=None):
@@ -213,12 +295,15 @@ class Client(object):
             )
         )
         # go through the list of all files finding ones that are in
-        # the target directory and caching them
-        for fn_ in self.file_list(saltenv):
-            if fn_.strip() and fn_.startswith(path):
-                if salt.utils.check_include_exclude(
-                        fn_, include_pat, exclude_pat):
-                    ret.append(self.cache_file('salt://' + fn_, saltenv))
+        # the target directory and caching them, the hashes of the manifest
+        # spare a request to the master for each file already in the cache
+        manifest = self.file_manifest(saltenv, path)
+        with known_hashes(manifest_hashes(manifest, saltenv)):
+            for fn_ in sorted(manifest):
+                if fn_.strip() and fn_.startswith(path):
+                    if salt.utils.check_include_exclude(
+                            fn_, include_pat, exclude_pat):
+                        ret.append(self.cache_file('salt://' + fn_, saltenv))
 
         if include_empty:
             # Break up the path into a list containing the bottom-level
@@ -710,12 +795,34 @@ class LocalClient(Client):
             # Backwards compatibility
             saltenv = env
 
+        _record_file(path, saltenv)
         path = self._check_proto(path)
         fnd = self._find_file(path, saltenv)
         if not fnd['path']:
             return ''
         return fnd['path']
 
+    def file_manifest(self, saltenv='base', prefix='', paths=None, lazy=True):
+        '''
+        Return the hash, the size and the mode of a list of files, or of the
+        files under a prefix, by path. With lazy the files are listed with
+        unknown hashes, the local files are hashed only when they are used
+        '''
+        if paths is None:
+            paths = self.file_list(saltenv, prefix)
+        if lazy:
+            return dict((path, {}) for path in paths)
+        ret = {}
+        for path in paths:
+            fnd = self._find_file(path, saltenv)
+            if not fnd['path']:
+                continue
+            ret[path] = self.hash_file('salt://' + path, saltenv)
+            stat = os.stat(fnd['path'])
+            ret[path]['size'] = stat.st_size
+            ret[path]['mode'] = '{0:04o}'.format(stat.st_mode & 07777)
+        return ret
+
     def file_list(self, saltenv='base', prefix='', env=None):
         '''
         Return a list of files in the given environment
@@ -817,6 +924,9 @@ class LocalClient(Client):
             # Backwards compatibility
             saltenv = env
 
+        hsum = _known_hash(path, saltenv)
+        if hsum is not None:
+            return hsum
         ret = {}
         try:
             path = self._check_proto(path)
@@ -923,6 +1033,7 @@ class RemoteClient(Client):
             # Backwards compatibility
             saltenv = env
 
+        _record_file(path, saltenv)
         # Hash compare local copy with master and skip download
         # if no diference found.
         dest2check = dest
@@ -956,6 +1067,10 @@ class RemoteClient(Client):
         if gzip:
             gzip = int(gzip)
             load['gzip'] = gzip
+        if self.opts.get('file_transfer_window', 1) > 1:
+            # Ask for several chunks per round trip, masters which do not
+            # know about windows send a single chunk
+            load['window'] = self.opts['file_transfer_window']
 
         fn_ = None
         if dest:
@@ -1125,6 +1240,9 @@ class RemoteClient(Client):
             # Backwards compatibility
             saltenv = env
 
+        hsum = _known_hash(path, saltenv)
+        if hsum is not None:
+            return hsum
         try:
             path = self._check_proto(path)
         except MinionError:
@@ -1148,6 +1266,52 @@ class RemoteClient(Client):
         except SaltReqTimeoutError:
             return ''
 
+    def file_manifest(self, saltenv='base', prefix='', paths=None, lazy=True):
+        '''
+        Return the hash, the size and the mode of a list of files, or of the
+        files under a prefix, on the master by path, in one request. The
+        master always sends the hashes, lazy is ignored
+        '''
+        load = {'saltenv': saltenv,
+                'cmd': '_file_manifest'}
+        if paths is None:
+            load['prefix'] = prefix
+        else:
+            load['paths'] = paths
+        try:
+            channel = self._get_channel()
+            manifest = channel.send(load)
+        except SaltReqTimeoutError:
+            manifest = None
+        if isinstance(manifest, dict):
+            return manifest
+        # The master is busy or does not know _file_manifest, the files are
+        # hashed as they are fetched
+        if paths is None:
+            paths = self.file_list(saltenv, prefix)
+        return dict((path, {}) for path in paths)
+
+    def hash_files(self, paths, saltenv='base'):
+        '''
+        Return the hashes of a list of salt:// files by path, in one request
+        to the master
+        '''
+        load = {'paths': [self._check_proto(path) for path in paths],
+                'saltenv': saltenv,
+                'cmd': '_file_hashes'}
+        try:
+            channel = self._get_channel()
+            hashes = channel.send(load)
+        except SaltReqTimeoutError:
+            hashes = None
+        if not isinstance(hashes, dict):
+            # The master is busy or does not know _file_hashes
+            return Client.hash_files(self, paths, saltenv)
+        ret = {}
+        for path in paths:
+            ret[path] = hashes.get(self._check_proto(path), '')
+        return ret
+
     def list_env(self, saltenv='base', env=None):
         '''
         Return a list of the files in the file server's specified environment
@@ -191,14 +191,13 @@ def diff_mtime_map(map1, map2):
     Is there a change to the mtime map? return a boolean
     '''
     # check if the file lists are different
-    if cmp(sorted(map1.keys()), sorted(map2.keys())) != 0:
+    if len(map1) != len(map2):
         #log.debug('diff_mtime_map: the keys are different')
         return True
-
-    # check if the mtimes are the same
-    if cmp(sorted(map1), sorted(map2)) != 0:
-        #log.debug('diff_mtime_map: the maps are different')
-        return True
+    for key in map2:
+        if key not in map1:
+            #log.debug('diff_mtime_map: the keys are different')
+            return True
 
     # we made it, that means we have no changes
     #log.debug('diff_mtime_map: the maps are the same')
@@ -427,6 +426,51 @@ class Fileserver(object):
             return self.servers[fstr](load, fnd)
         return ''
 
+    def file_hashes(self, load):
+        '''
+        Return the hashes of a list of files by path
+        '''
+        if 'paths' not in load or 'saltenv' not in load:
+            return {}
+        ret = {}
+        for path in load['paths']:
+            ret[path] = self.file_hash({'path': path,
+                                        'saltenv': load['saltenv']})
+        return ret
+
+    def file_manifest(self, load):
+        '''
+        Return the hash, the size and the mode of a list of files, or of the
+        files under a prefix, by path
+        '''
+        if 'saltenv' not in load:
+            return {}
+        if 'paths' in load:
+            paths = load['paths']
+        else:
+            paths = self.file_list({'saltenv': load['saltenv'],
+                                    'prefix': load.get('prefix', '')})
+        ret = {}
+        for path in paths:
+            fnd = self.find_file(path, load['saltenv'])
+            if not fnd.get('back'):
+                continue
+            fstr = '{0}.file_hash'.format(fnd['back'])
+            if fstr not in self.servers:
+                continue
+            hsum = self.servers[fstr]({'path': path,
+                                       'saltenv': load['saltenv']}, fnd)
+            if not hsum:
+                continue
+            ret[path] = dict(hsum)
+            try:
+                stat = os.stat(fnd['path'])
+            except OSError:
+                continue
+            ret[path]['size'] = stat.st_size
+            ret[path]['mode'] = '{0:04o}'.format(stat.st_mode & 07777)
+        return ret
+
     def file_list(self, load):
         '''
         Return a list of files from the dominant environment
@@ -8,15 +8,47 @@ option.
 
 # Import python libs
 import os
+import mmap
 import logging
 
+# Import third party libs
+try:
+    import pyinotify
+    HAS_PYINOTIFY = True
+    _WATCH_MASK = (pyinotify.IN_CREATE | pyinotify.IN_DELETE |
+                   pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MODIFY |
+                   pyinotify.IN_ATTRIB | pyinotify.IN_MOVED_FROM |
+                   pyinotify.IN_MOVED_TO | pyinotify.IN_DELETE_SELF)
+except ImportError:
+    HAS_PYINOTIFY = False
+
 # Import salt libs
 import salt.fileserver
+import salt.payload
 import salt.utils
+import salt.utils.atomicfile
+from salt.utils.odict import OrderedDict
 from salt.utils.event import tagify
 
 log = logging.getLogger(__name__)
 
+# The files kept open by this worker to serve chunks from, least recently
+# used first
+_HANDLES = OrderedDict()
+
+# The file hash index database and the journal of the hashes computed by the
+# master workers since it was last written
+HASH_INDEX = 'roots/hash_index.p'
+HASH_JOURNAL = 'roots/hash_index.log'
+
+# The hash index loaded by this worker, it is reloaded when update() rewrites
+# the database
+_HASH_INDEX = {'key': None, 'hashes': {}}
+
+# The inotify tracker of the file_roots, only set up in the process running
+# the fileserver updates
+_TRACKER = {}
+
 
 def find_file(path, saltenv='base', env=None, **kwargs):
     '''
@@ -67,9 +99,49 @@ def envs():
     return __opts__['file_roots'].keys()
 
 
+def _close_handle(handle):
+    '''
+    Close a cached file handle
+    '''
+    if handle['map'] is not None:
+        handle['map'].close()
+    handle['fp'].close()
+
+
+def _get_handle(path):
+    '''
+    Return an open handle on the file at path, reusing the handle cached by
+    this worker as long as the mtime and the size of the file did not change
+    '''
+    stat = os.stat(path)
+    key = (stat.st_mtime, stat.st_size)
+    handle = _HANDLES.pop(path, None)
+    if handle is not None and handle['key'] != key:
+        _close_handle(handle)
+        handle = None
+    if handle is None:
+        handle = {'key': key,
+                  'fp': salt.utils.fopen(path, 'rb'),
+                  'map': None}
+        if __opts__.get('fileserver_mmap', False) and stat.st_size:
+            try:
+                handle['map'] = mmap.mmap(
+                        handle['fp'].fileno(), 0, access=mmap.ACCESS_READ)
+            except (EnvironmentError, ValueError) as exc:
+                log.debug('Unable to map {0}: {1}'.format(path, exc))
+        limit = __opts__.get('fileserver_handle_cache', 32)
+        while _HANDLES and len(_HANDLES) >= limit:
+            _close_handle(_HANDLES.popitem(last=False)[1])
+    _HANDLES[path] = handle
+    return handle
+
+
 def serve_file(load, fnd):
     '''
     Return a chunk from a file based on the data received
+
+    Clients may ask for a window of several chunks with the ``window`` key of
+    the load, it is capped by the :conf_master:`file_transfer_window` option.
     '''
     if 'env' in load:
         salt.utils.warn_until(
@@ -87,20 +159,179 @@ def serve_file(load, fnd):
         return ret
     ret['dest'] = fnd['rel']
     gzip = load.get('gzip', None)
-
-    with salt.utils.fopen(fnd['path'], 'rb') as fp_:
-        fp_.seek(load['loc'])
-        data = fp_.read(__opts__['file_buffer_size'])
-        if gzip and data:
-            data = salt.utils.gzip_util.compress(data, gzip)
-            ret['gzip'] = gzip
-        ret['data'] = data
+    try:
+        window = int(load.get('window', 1))
+    except (TypeError, ValueError):
+        window = 1
+    window = max(1, min(window, __opts__.get('file_transfer_window', 1)))
+    size = __opts__['file_buffer_size'] * window
+
+    if __opts__.get('fileserver_handle_cache', 32) > 0:
+        handle = _get_handle(fnd['path'])
+        if handle['map'] is not None:
+            data = handle['map'][load['loc']:load['loc'] + size]
+        else:
+            handle['fp'].seek(load['loc'])
+            data = handle['fp'].read(size)
+    else:
+        with salt.utils.fopen(fnd['path'], 'rb') as fp_:
+            fp_.seek(load['loc'])
+            data = fp_.read(size)
+    if gzip and data:
+        data = salt.utils.gzip_util.compress(data, gzip)
+        ret['gzip'] = gzip
+    ret['data'] = data
     return ret
 
 
+def _get_tracker():
+    '''
+    Return the inotify tracker of the changes made in the file_roots, or None
+    if the mtime map has to be generated by walking them
+    '''
+    if not __opts__.get('fileserver_inotify', False) or not HAS_PYINOTIFY:
+        return None
+    if _TRACKER.get('disabled'):
+        return None
+    if not _TRACKER:
+        wm_ = pyinotify.WatchManager()
+        _TRACKER.update({'notifier': pyinotify.Notifier(
+                            wm_, default_proc_fun=_track, timeout=0),
+                         'paths': set(),
+                         'overflow': False,
+                         'mtime_map': None})
+        for path_list in __opts__['file_roots'].itervalues():
+            for path in path_list:
+                if not os.path.isdir(path):
+                    continue
+                wds = wm_.add_watch(path, _WATCH_MASK, rec=True, auto_add=True)
+                if [wd_ for wd_ in wds.itervalues() if wd_ < 0]:
+                    log.warning(
+                        'Unable to watch all of {0} with inotify, the '
+                        'file_roots will be walked on every update, raising '
+                        'fs.inotify.max_user_watches may help'.format(path))
+                    _TRACKER['notifier'].stop()
+                    _TRACKER.clear()
+                    _TRACKER['disabled'] = True
+                    return None
+    return _TRACKER
+
+
+def _track(event):
+    '''
+    Record the path of an inotify event
+    '''
+    if event.mask & pyinotify.IN_Q_OVERFLOW:
+        _TRACKER['overflow'] = True
+    else:
+        _TRACKER['paths'].add(event.pathname)
+
+
+def _poll_tracker(tracker):
+    '''
+    Return the paths changed since the last poll, or None if events were lost
+    '''
+    notifier = tracker['notifier']
+    while notifier.check_events(timeout=0):
+        notifier.read_events()
+        notifier.process_events()
+    changed = tracker['paths']
+    tracker['paths'] = set()
+    if tracker['overflow']:
+        log.debug('The inotify event queue overflowed, walking the file_roots')
+        tracker['overflow'] = False
+        return None
+    return changed
+
+
+def _apply_changes(mtime_map, changed):
+    '''
+    Update the mtime map for the changed paths
+    '''
+    for path in changed:
+        if os.path.isfile(path):
+            try:
+                mtime_map[path] = os.path.getmtime(path)
+            except OSError:
+                mtime_map.pop(path, None)
+        elif os.path.isdir(path) and not os.path.islink(path):
+            # A directory created or moved in
+            mtime_map.update(
+                salt.fileserver.generate_mtime_map({'': [path]}))
+        elif mtime_map.pop(path, None) is None:
+            # Not a file, drop what was under the directory
+            prefix = path.rstrip(os.sep) + os.sep
+            for file_path in [file_path for file_path in mtime_map
+                              if file_path.startswith(prefix)]:
+                del mtime_map[file_path]
+
+
+def _update_file_lists(changed):
+    '''
+    Update the file list caches of the environments holding the changed
+    paths. The files added to or removed from directories which still hold
+    other files are patched in, any other change removes the cache of the
+    environment so it is generated again.
+    '''
+    list_cachedir = os.path.join(__opts__['cachedir'], 'file_lists/roots')
+    serial = salt.payload.Serial(__opts__)
+    for saltenv, path_list in __opts__['file_roots'].iteritems():
+        changes = []
+        for path in changed:
+            for root in path_list:
+                prefix = root.rstrip(os.sep) + os.sep
+                if path.startswith(prefix):
+                    changes.append((path, path[len(prefix):]))
+        if not changes:
+            continue
+        list_cache = os.path.join(list_cachedir, '{0}.p'.format(saltenv))
+        w_lock = os.path.join(list_cachedir, '.{0}.w'.format(saltenv))
+        if not os.path.isfile(list_cache) \
+                or not salt.fileserver._lock_cache(w_lock):
+            continue
+        try:
+            with salt.utils.fopen(list_cache, 'rb') as fp_:
+                data = serial.load(fp_)
+            files = set(data['files'])
+            dirs = set(data['dirs'])
+            empty_dirs = set(data['empty_dirs'])
+        except Exception:
+            data = None
+        for path, rel in changes:
+            if data is None:
+                break
+            parent = os.path.dirname(rel) or '.'
+            if os.path.islink(path) or os.path.isdir(path) \
+                    or parent not in dirs or parent in empty_dirs:
+                data = None
+            elif os.path.isfile(path):
+                if not salt.fileserver.is_file_ignored(__opts__, rel):
+                    files.add(rel)
+            elif not os.path.isdir(os.path.dirname(path)) \
+                    or not os.listdir(os.path.dirname(path)):
+                # The directory is now empty or gone
+                data = None
+            elif not [root for root in path_list
+                      if os.path.isfile(os.path.join(root, rel))]:
+                files.discard(rel)
+        if data is None:
+            try:
+                os.remove(list_cache)
+            except OSError:
+                pass
+            salt.fileserver._unlock_cache(w_lock)
+            continue
+        data['files'] = sorted(files)
+        salt.fileserver.write_file_list_cache(__opts__, data, list_cache, w_lock)
+
+
 def update():
     '''
     When we are asked to update (regular interval) lets reap the cache
+
+    With the :conf_master:`fileserver_inotify` option, the mtime map is only
+    generated by walking the file_roots on the first update, the later
+    updates apply the changes reported by inotify.
     '''
     try:
         salt.fileserver.reap_fileserver_cache_dir(
@@ -116,35 +347,57 @@ def update():
     data = {'changed': False,
             'backend': 'roots'}
 
-    old_mtime_map = {}
-    # if you have an old map, load that
-    if os.path.exists(mtime_map_path):
-        with salt.utils.fopen(mtime_map_path, 'rb') as fp_:
-            for line in fp_:
-                try:
-                    file_path, mtime = line.split(':', 1)
-                    old_mtime_map[file_path] = mtime
-                except ValueError:
-                    # Document the invalid entry in the log
-                    log.warning('Skipped invalid cache mtime entry in {0}: {1}'
-                                .format(mtime_map_path, line))
-
-    # generate the new map
-    new_mtime_map = salt.fileserver.generate_mtime_map(__opts__['file_roots'])
-
-    # compare the maps, set changed to the return value
-    data['changed'] = salt.fileserver.diff_mtime_map(old_mtime_map, new_mtime_map)
-
-    # write out the new map
-    mtime_map_path_dir = os.path.dirname(mtime_map_path)
-    if not os.path.exists(mtime_map_path_dir):
-        os.makedirs(mtime_map_path_dir)
-    with salt.utils.fopen(mtime_map_path, 'w') as fp_:
-        for file_path, mtime in new_mtime_map.iteritems():
-            fp_.write('{file_path}:{mtime}\n'.format(file_path=file_path,
-                                                     mtime=mtime))
-
-    if __opts__.get('fileserver_events', False):
+    tracker = _get_tracker()
+    changed = None
+    if tracker is not None and tracker['mtime_map'] is not None:
+        changed = _poll_tracker(tracker)
+
+    if changed is None:
+        old_mtime_map = {}
+        # if you have an old map, load that
+        if os.path.exists(mtime_map_path):
+            with salt.utils.fopen(mtime_map_path, 'rb') as fp_:
+                for line in fp_:
+                    try:
+                        file_path, mtime = line.split(':', 1)
+                        old_mtime_map[file_path] = mtime
+                    except ValueError:
+                        # Document the invalid entry in the log
+                        log.warning('Skipped invalid cache mtime entry in {0}: {1}'
+                                    .format(mtime_map_path, line))
+
+        # generate the new map
+        new_mtime_map = salt.fileserver.generate_mtime_map(__opts__['file_roots'])
+
+        # compare the maps, set changed to the return value
+        data['changed'] = salt.fileserver.diff_mtime_map(old_mtime_map, new_mtime_map)
+        if tracker is not None:
+            tracker['mtime_map'] = new_mtime_map
+    else:
+        new_mtime_map = tracker['mtime_map']
+        _apply_changes(new_mtime_map, changed)
+        _update_file_lists(changed)
+        data['changed'] = bool(changed)
+        data['paths'] = sorted(changed)
+
+    if __opts__.get('fileserver_hash_index', False):
+        # drop the hashes of the files which changed
+        try:
+            _update_hash_index(new_mtime_map)
+        except (IOError, OSError) as exc:
+            log.error('Unable to write the file hash index: {0}'.format(exc))
+
+    if changed is None or changed:
+        # write out the new map
+        mtime_map_path_dir = os.path.dirname(mtime_map_path)
+        if not os.path.exists(mtime_map_path_dir):
+            os.makedirs(mtime_map_path_dir)
+        with salt.utils.fopen(mtime_map_path, 'w') as fp_:
+            for file_path, mtime in new_mtime_map.iteritems():
+                fp_.write('{file_path}:{mtime}\n'.format(file_path=file_path,
+                                                         mtime=mtime))
+
+    if __opts__.get('fileserver_events', False) and (changed is None or changed):
         # if there is a change, fire an event
         event = salt.utils.event.get_event(
                 'master',
@@ -154,6 +407,98 @@ def update():
         event.fire_event(data, tagify(['roots', 'update'], prefix='fileserver'))
 
 
+def _read_hash_index():
+    '''
+    Read the hash index database and the journal, returns a dict mapping the
+    file paths to a (hash, mtime) tuple
+    '''
+    hashes = {}
+    serial = salt.payload.Serial(__opts__)
+    db_path = os.path.join(__opts__['cachedir'], HASH_INDEX)
+    try:
+        with salt.utils.fopen(db_path, 'rb') as fp_:
+            data = serial.load(fp_)
+        if data.get('hash_type') == __opts__['hash_type']:
+            for path, entry in data.get('hashes', {}).iteritems():
+                hashes[path] = tuple(entry)
+    except (IOError, OSError, AttributeError):
+        pass
+    try:
+        with salt.utils.fopen(
+                os.path.join(__opts__['cachedir'], HASH_JOURNAL), 'rb') as fp_:
+            for line in fp_:
+                try:
+                    hash_type, mtime, hsum, path = line.rstrip('\n').split(':', 3)
+                    if hash_type == __opts__['hash_type']:
+                        hashes[path] = (hsum, float(mtime))
+                except ValueError:
+                    # A line being written
+                    continue
+    except (IOError, OSError):
+        pass
+    return hashes
+
+
+def _hash_index():
+    '''
+    Return the hash index of this worker, the database is only read again
+    once update() rewrote it
+    '''
+    try:
+        stat = os.stat(os.path.join(__opts__['cachedir'], HASH_INDEX))
+        key = (stat.st_mtime, stat.st_size, __opts__['hash_type'])
+    except OSError:
+        key = (None, None, __opts__['hash_type'])
+    if _HASH_INDEX['key'] != key:
+        _HASH_INDEX['hashes'] = _read_hash_index()
+        _HASH_INDEX['key'] = key
+    return _HASH_INDEX['hashes']
+
+
+def _journal_hash(path, hsum, mtime):
+    '''
+    Record a computed hash in the journal, so the other workers and the next
+    database written by update() know about it
+    '''
+    journal = os.path.join(__opts__['cachedir'], HASH_JOURNAL)
+    try:
+        if not os.path.isdir(os.path.dirname(journal)):
+            os.makedirs(os.path.dirname(journal))
+        fd_ = os.open(journal, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            os.write(fd_, '{0}:{1!r}:{2}:{3}\n'.format(
+                __opts__['hash_type'], mtime, hsum, path))
+        finally:
+            os.close(fd_)
+    except (IOError, OSError) as exc:
+        log.debug('Unable to write the file hash journal: {0}'.format(exc))
+
+
+def _update_hash_index(mtime_map):
+    '''
+    Rewrite the hash index database, keeping the hashes of the files whose
+    mtime did not change
+    '''
+    hashes = _read_hash_index()
+    valid = dict((path, entry) for path, entry in hashes.iteritems()
+                 if mtime_map.get(path) == entry[1])
+    journal = os.path.join(__opts__['cachedir'], HASH_JOURNAL)
+    if len(valid) == len(hashes) and not os.path.exists(journal) \
+            and os.path.exists(os.path.join(__opts__['cachedir'], HASH_INDEX)):
+        return
+    serial = salt.payload.Serial(__opts__)
+    serial.dump(
+        {'hash_type': __opts__['hash_type'], 'hashes': valid},
+        salt.utils.atomicfile.atomic_open(
+            os.path.join(__opts__['cachedir'], HASH_INDEX), 'w+b'
+        )
+    )
+    try:
+        os.remove(journal)
+    except OSError:
+        pass
+
+
 def file_hash(load, fnd):
     '''
     Return a file hash, the hash type is set in the master config file
@@ -171,6 +516,21 @@ def file_hash(load, fnd):
     path = fnd['path']
     ret = {}
 
+    if path and __opts__.get('fileserver_hash_index', False):
+        # find_file made sure the file exists, answer from the index
+        hashes = _hash_index()
+        if path not in hashes:
+            try:
+                mtime = os.path.getmtime(path)
+                hashes[path] = (salt.utils.get_hash(path, __opts__['hash_type']),
+                                mtime)
+            except (IOError, OSError):
+                return ret
+            _journal_hash(path, hashes[path][0], mtime)
+        ret['hash_type'] = __opts__['hash_type']
+        ret['hsum'] = hashes[path][0]
+        return ret
+
     # if the file doesn't exist, we can't get a hash
     if not path or not os.path.isfile(path):
         return ret
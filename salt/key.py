@@ -18,6 +18,7 @@ import msgpack
 import salt.crypt
 import salt.utils
 import salt.utils.event
+import salt.utils.minion_data
 import salt.daemons.masterapi
 from salt.utils.event import tagify
 
@@ -437,12 +438,14 @@ class Key(object):
         Check the minion cache to make sure that old minion data is cleared
         '''
         m_cache = os.path.join(self.opts['cachedir'], 'minions')
-        if not os.path.isdir(m_cache):
-            return
         keys = self.list_keys()
         minions = []
         for key, val in keys.items():
             minions.extend(val)
+        if self.opts.get('minion_data_cache_backend') == 'sqlite':
+            salt.utils.minion_data.store(self.opts).prune(minions)
+        if not os.path.isdir(m_cache):
+            return
         for minion in os.listdir(m_cache):
             if minion not in minions:
                 shutil.rmtree(os.path.join(m_cache, minion))
@@ -819,6 +822,8 @@ class RaetKey(Key):
         for key, val in keys.items():
             minions.extend(val)
 
+        if self.opts.get('minion_data_cache_backend') == 'sqlite':
+            salt.utils.minion_data.store(self.opts).prune(minions)
         m_cache = os.path.join(self.opts['cachedir'], 'minions')
         if os.path.isdir(m_cache):
             for minion in os.listdir(m_cache):
@@ -9,6 +9,7 @@ import imp
 import sys
 import salt
 import logging
+import hashlib
 import tempfile
 import time
 
@@ -18,6 +19,9 @@ from collections import MutableMapping
 from salt.exceptions import LoaderError
 from salt.template import check_render_pipe_str
 from salt.utils.decorators import Depends
+import salt.utils.atomicfile
+import salt.utils.threadpool
+import salt.version
 
 # Solve the Chicken and egg problem where grains need to run before any
 # of the modules are loaded and are generally available for any usage.
@@ -498,6 +502,229 @@ def in_pack(pack, name):
     return False
 
 
+def _fingerprint_data(data):
+    '''
+    Return a stable string representation of data, dicts are sorted
+    '''
+    if isinstance(data, dict):
+        return '{{{0}}}'.format(', '.join(
+            '{0!r}: {1}'.format(key, _fingerprint_data(data[key]))
+            for key in sorted(data)))
+    if isinstance(data, (list, tuple)):
+        return '[{0}]'.format(', '.join(_fingerprint_data(item) for item in data))
+    return repr(data)
+
+
+class VirtualIndex(object):
+    '''
+    Persistent index of the outcome of the __virtual__ function of the modules
+    found by a Loader, stored in the cachedir.
+
+    Each module file is indexed with its mtime and the virtual name it loaded
+    as, or None if it could not be loaded. The whole index is dropped when the
+    fingerprint of what __virtual__ functions depend on changes: the grains,
+    the salt version and the mtimes of the configuration file and of the
+    directories in the PATH and in sys.path, so editing the configuration or
+    installing a binary or a python library makes the modules be evaluated
+    again.
+    '''
+    def __init__(self, opts, tag, module_dirs, grains):
+        self.opts = opts
+        dirs = hashlib.md5(_fingerprint_data(module_dirs)).hexdigest()[:8]
+        self.path = os.path.join(
+                opts['cachedir'], 'loader', '{0}-{1}.p'.format(tag, dirs))
+        self.fingerprint = self._fingerprint(opts, grains)
+        self.entries = {}
+        self.dirty = False
+        self.load()
+
+    def _fingerprint(self, opts, grains):
+        '''
+        Hash what the __virtual__ functions depend on
+        '''
+        mtimes = {}
+        paths = os.environ.get('PATH', '').split(os.pathsep) + sys.path
+        if opts.get('conf_file'):
+            paths.append(opts['conf_file'])
+            paths.append('{0}.d'.format(os.path.splitext(opts['conf_file'])[0]))
+        for path in paths:
+            try:
+                mtimes[path] = os.path.getmtime(path)
+            except (OSError, TypeError):
+                continue
+        return hashlib.md5(_fingerprint_data(
+            [salt.version.__version__, grains, mtimes])).hexdigest()
+
+    def load(self):
+        '''
+        Read the index from the cachedir
+        '''
+        try:
+            with salt.utils.fopen(self.path, 'rb') as fp_:
+                data = salt.payload.Serial(self.opts).load(fp_)
+        except (IOError, OSError):
+            return
+        if data.get('fingerprint') != self.fingerprint:
+            log.debug('Dropping the stale virtual module index {0}'.format(
+                self.path))
+            self.dirty = True
+            return
+        for path, entry in data.get('entries', {}).iteritems():
+            self.entries[path] = tuple(entry)
+
+    def save(self):
+        '''
+        Write the index to the cachedir if it changed
+        '''
+        if not self.dirty:
+            return
+        try:
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            salt.payload.Serial(self.opts).dump(
+                {'fingerprint': self.fingerprint, 'entries': self.entries},
+                salt.utils.atomicfile.atomic_open(self.path, 'w+b'))
+            self.dirty = False
+        except (IOError, OSError) as exc:
+            log.debug('Unable to write the virtual module index {0}: {1}'.format(
+                self.path, exc))
+
+    def lookup(self, path):
+        '''
+        Return a (known, virtual name) tuple for a module file, the virtual
+        name is None if the module does not load
+        '''
+        entry = self.entries.get(path)
+        if entry is None:
+            return False, None
+        try:
+            if os.path.getmtime(path) != entry[0]:
+                return False, None
+        except OSError:
+            return False, None
+        return True, entry[1]
+
+    def record(self, path, virtual_name):
+        '''
+        Record the outcome of loading a module file
+        '''
+        try:
+            entry = (os.path.getmtime(path), virtual_name)
+        except OSError:
+            return
+        if self.entries.get(path) != entry:
+            self.entries[path] = entry
+            self.dirty = True
+
+    def providers(self, name, paths):
+        '''
+        Return the module files among paths which load as name, or None if
+        some of the files are not indexed
+        '''
+        ret = []
+        for path in paths:
+            known, virtual_name = self.lookup(path)
+            if not known:
+                return None
+            if virtual_name == name:
+                ret.append(path)
+        return ret
+
+
+class GrainsEngine(object):
+    '''
+    Run the grain functions loaded by a Loader and keep the time each of them
+    took. The functions are run concurrently in a pool of grains_threads
+    threads if it is set, a function which does not return within its timeout
+    is left behind in its thread and its grains are not returned.
+
+    The timeouts and cache TTLs are looked up per provider, the grain function
+    such as ``core.hostname``, then its module such as ``core``, in the
+    grains_provider_timeout and grains_provider_ttl options. The defaults are
+    the grains_timeout and grains_cache_expiration options.
+    '''
+    def __init__(self, opts, funcs):
+        self.opts = opts
+        self.funcs = funcs
+        self.timing = {}
+
+    def _setting(self, name, key, default):
+        '''
+        Return the setting of a provider from the dict in the name option
+        '''
+        settings = self.opts.get(name) or {}
+        if key in settings:
+            return settings[key]
+        return settings.get(key.split('.')[0], default)
+
+    def ttl(self, key):
+        '''
+        Return the number of seconds the grains of a provider are cached for
+        '''
+        return self._setting('grains_provider_ttl',
+                             key,
+                             self.opts.get('grains_cache_expiration', 300))
+
+    def timeout(self, key):
+        '''
+        Return the number of seconds a provider may run for, 0 for no limit
+        '''
+        return self._setting('grains_provider_timeout',
+                             key,
+                             self.opts.get('grains_timeout', 0))
+
+    def run(self, keys):
+        '''
+        Run the grain functions, returns a dict of their returns
+        '''
+        funcs = dict((key, self.funcs[key]) for key in keys)
+        timeouts = dict((key, self.timeout(key)) for key in keys)
+        rets = salt.utils.threadpool.run(
+                funcs, self.opts.get('grains_threads', 0), timeouts)
+        ret = {}
+        for key in sorted(keys):
+            if key not in rets:
+                log.warning(
+                    'Grain function {0} did not return within {1} '
+                    'seconds'.format(key, timeouts[key])
+                )
+                continue
+            data, exc_info, self.timing[key] = rets[key]
+            if exc_info is not None:
+                if key.startswith('core.'):
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                log.critical(
+                    'Failed to load grains defined in grain file {0} in '
+                    'function {1}, error:\n'.format(
+                        key, self.funcs[key]
+                    ),
+                    exc_info=exc_info
+                )
+                continue
+            ret[key] = data
+        return ret
+
+    def report(self):
+        '''
+        Log the time each grain function took, slowest first
+        '''
+        for key in sorted(self.timing, key=self.timing.get, reverse=True):
+            log.debug('Grain function {0} took {1:.3f} seconds'.format(
+                key, self.timing[key]))
+
+    @staticmethod
+    def merge(providers):
+        '''
+        Merge the grains cached by provider, the core grains are overridden by
+        the other ones
+        '''
+        grains_data = {}
+        keys = sorted(providers, key=lambda key: (not key.startswith('core.'), key))
+        for key in keys:
+            grains_data.update(providers[key]['data'])
+        return grains_data
+
+
 class Loader(object):
     '''
     Used to load in arbitrary modules from a directory, the Loader can
@@ -527,6 +754,21 @@ class Loader(object):
         self.mod_type_check = mod_type_check or _mod_type
         if self.opts.get('grains_cache', False):
             self.serial = salt.payload.Serial(self.opts)
+        self.virtual_index = None
+        # The file each loaded module was found at, by module name
+        self.mod_paths = {}
+
+    def _get_virtual_index(self):
+        '''
+        Return the virtual module index if it is enabled
+        '''
+        if self.virtual_index is None \
+                and self.opts.get('virtual_index', False) \
+                and self.opts.get('cachedir') \
+                and self.tag != 'grain':
+            self.virtual_index = VirtualIndex(
+                    self.opts, self.tag, self.module_dirs, self.grains)
+        return self.virtual_index
 
     def __prep_mod_opts(self, opts):
         '''
@@ -571,9 +813,12 @@ class Loader(object):
                              'modules.')
         return getattr(mod, fun[fun.rindex('.') + 1:])(*arg)
 
-    def gen_module(self, name, functions, pack=None):
+    def gen_module(self, name, functions, pack=None, virtual_name=None):
         '''
         Load a single module and pack it with the functions passed
+
+        If virtual_name is passed, the __virtual__ function of the module is
+        run and None is returned unless the module loads as virtual_name.
         '''
         full = ''
         mod = None
@@ -664,6 +909,14 @@ class Loader(object):
                     pass
         funcs = {}
         module_name = mod.__name__[mod.__name__.rindex('.') + 1:]
+        if virtual_name is not None:
+            mod.__pillar__ = self.pillar
+            virtual_ret, module_name = self.process_virtual(mod, module_name)
+            if self.virtual_index is not None:
+                self.virtual_index.record(
+                    full, module_name if virtual_ret is True else None)
+            if virtual_ret is not True or module_name != virtual_name:
+                return None
         if getattr(mod, '__load__', False) is not False:
             log.info(
                 'The functions from module {0!r} are being loaded from the '
@@ -703,13 +956,41 @@ class Loader(object):
         mod.__context__ = context
         return funcs
 
+    def gen_virtual_module(self, name, functions, pack=None):
+        '''
+        Load the module which the virtual module index says provides the
+        virtual name. Returns None if the index can not tell, or an empty dict
+        if no module provides the name.
+        '''
+        index = self._get_virtual_index()
+        if index is None:
+            return None
+        names = self._list_modules()[0]
+        providers = index.providers(name, names.values())
+        if providers is None:
+            return None
+        funcs = {}
+        for path in providers:
+            mod_name = os.path.basename(path)
+            if '.' in mod_name:
+                mod_name = mod_name[:mod_name.rindex('.')]
+            funcs = self.gen_module(mod_name, functions, pack, virtual_name=name)
+            if funcs:
+                break
+        index.save()
+        if providers and not funcs:
+            # The index is out of date
+            return None
+        return funcs
+
     def gen_functions(self, pack=None, virtual_enable=True, whitelist=None,
                       provider_overrides=False):
         '''
         Return a dict of functions found in the defined module_dirs
         '''
         funcs = {}
-        self.load_modules()
+        index = self._get_virtual_index() if virtual_enable else None
+        self.load_modules(index)
         for mod in self.modules:
             # If this is a proxy minion then MOST modules cannot work.  Therefore, require that
             # any module that does work with salt-proxy-minion define __proxyenabled__ as a list
@@ -764,6 +1045,9 @@ class Loader(object):
                 # __virtual__() function inside that module and run it.
                 (virtual_ret, virtual_name) = self.process_virtual(mod,
                                                                    module_name)
+                if index is not None and mod.__name__ in self.mod_paths:
+                    index.record(self.mod_paths[mod.__name__],
+                                 virtual_name if virtual_ret is True else None)
 
                 # if process_virtual returned a non-True value then we are
                 # supposed to not process this module
@@ -782,6 +1066,9 @@ class Loader(object):
             # load the functions from the module and update our dict
             funcs.update(self.load_functions(mod, module_name))
 
+        if index is not None:
+            index.save()
+
         # Handle provider overrides
         if provider_overrides and self.opts.get('providers', False):
             if isinstance(self.opts['providers'], dict):
@@ -810,13 +1097,11 @@ class Loader(object):
                 mod.__salt__.update(funcs)
         return funcs
 
-    def load_modules(self):
+    def _list_modules(self):
         '''
-        Loads all of the modules from module_dirs and returns a list of them
+        Return a dict of the module names found in module_dirs and the path
+        they are found at, and whether cython modules are enabled
         '''
-        self.modules = []
-
-        log.trace('loading {0} in {1}'.format(self.tag, self.module_dirs))
         names = {}
         disable = set(self.opts.get('disable_{0}s'.format(self.tag), []))
 
@@ -865,7 +1150,8 @@ class Loader(object):
                         _name = fn_[:extpos]
                     else:
                         _name = fn_
-                    names[_name] = os.path.join(mod_dir, fn_)
+                    # The first module_dir wins, as with imp.find_module
+                    names.setdefault(_name, os.path.join(mod_dir, fn_))
                 else:
                     log.trace(
                         'Skipping {0}, it does not end with an expected '
@@ -873,7 +1159,25 @@ class Loader(object):
                             fn_
                         )
                     )
+        return names, cython_enabled
+
+    def load_modules(self, virtual_index=None):
+        '''
+        Loads all of the modules from module_dirs and returns a list of them
+
+        The modules which the virtual module index says do not load are not
+        imported.
+        '''
+        self.modules = []
+
+        log.trace('loading {0} in {1}'.format(self.tag, self.module_dirs))
+        names, cython_enabled = self._list_modules()
+        if cython_enabled:
+            import pyximport
         for name in names:
+            if virtual_index is not None \
+                    and virtual_index.lookup(names[name]) == (True, None):
+                continue
             try:
                 if names[name].endswith('.pyx'):
                     # If there's a name which ends in .pyx it means the above
@@ -928,6 +1232,8 @@ class Loader(object):
                     ),
                     exc_info=True
                 )
+                if virtual_index is not None:
+                    virtual_index.record(names[name], None)
                 continue
             except Exception:
                 log.error(
@@ -938,6 +1244,7 @@ class Loader(object):
                     exc_info=True
                 )
                 continue
+            self.mod_paths[mod.__name__] = names[name]
             self.modules.append(mod)
 
     def load_functions(self, mod, module_name):
@@ -1174,61 +1481,51 @@ class Loader(object):
         Read the grains directory and execute all of the public callable
         members. Then verify that the returns are python dict's and return
         a dict containing all of the returned values.
+
+        If grains_cache is set the grains are cached by grain function, and
+        only the functions whose cache TTL expired are run again.
         '''
+        refresh = force_refresh or self.opts.get('refresh_grains_cache', False)
+        cache = {}
         if self.opts.get('grains_cache', False):
             cfn = os.path.join(
                 self.opts['cachedir'],
-                '{0}.cache.p'.format('grains')
+                '{0}.cache.p'.format('grains_providers')
             )
-            if os.path.isfile(cfn):
-                grains_cache_age = int(time.time() - os.path.getmtime(cfn))
-                if self.opts.get('grains_cache_expiration', 300) >= grains_cache_age and not \
-                        self.opts.get('refresh_grains_cache', False) and not force_refresh:
+            cache = self._read_grains_cache(cfn)
+            if force_refresh:
+                log.debug('Grains refresh requested. Refreshing grains.')
+            elif cache and not refresh:
+                engine = GrainsEngine(self.opts, {})
+                now = time.time()
+                if all([now - entry['time'] <= engine.ttl(key)
+                        for key, entry in cache.items()]):
                     log.debug('Retrieving grains from cache')
-                    try:
-                        with salt.utils.fopen(cfn, 'rb') as fp_:
-                            cached_grains = self.serial.load(fp_)
-                        return cached_grains
-                    except (IOError, OSError):
-                        pass
-                else:
-                    if force_refresh:
-                        log.debug('Grains refresh requested. Refreshing grains.')
-                    else:
-                        log.debug('Grains cache last modified {0} seconds ago and '
-                                  'cache expiration is set to {1}. '
-                                  'Grains cache expired. Refreshing.'.format(
-                                      grains_cache_age,
-                                      self.opts.get('grains_cache_expiration', 300)
-                                  ))
-            else:
-                log.debug('Grains cache file does not exist.')
-        grains_data = {}
+                    return GrainsEngine.merge(cache)
         funcs = self.gen_functions()
-        for key, fun in funcs.items():
-            if not key.startswith('core.'):
-                continue
-            ret = fun()
-            if not isinstance(ret, dict):
-                continue
-            grains_data.update(ret)
-        for key, fun in funcs.items():
-            if key.startswith('core.'):
-                continue
-            try:
-                ret = fun()
-            except Exception:
-                log.critical(
-                    'Failed to load grains defined in grain file {0} in '
-                    'function {1}, error:\n'.format(
-                        key, fun
-                    ),
-                    exc_info=True
-                )
-                continue
-            if not isinstance(ret, dict):
-                continue
-            grains_data.update(ret)
+        engine = GrainsEngine(self.opts, funcs)
+        now = time.time()
+        run = [key for key in funcs
+               if refresh or key not in cache
+               or now - cache[key]['time'] > engine.ttl(key)]
+        if cache:
+            log.debug('Grains cache expired for {0}. Refreshing.'.format(
+                ', '.join(sorted(run))))
+        rets = engine.run(run)
+        engine.report()
+        providers = {}
+        for key in funcs:
+            if key in rets:
+                data = rets[key]
+                if not isinstance(data, dict):
+                    data = {}
+                providers[key] = {'time': now,
+                                  'duration': engine.timing[key],
+                                  'data': data}
+            elif key in cache:
+                # Still fresh, or timed out and the last grains are kept
+                providers[key] = cache[key]
+        grains_data = GrainsEngine.merge(providers)
         # Write cache if enabled
         if self.opts.get('grains_cache', False):
             cumask = os.umask(077)
@@ -1238,7 +1535,7 @@ class Loader(object):
                     __salt__['cmd.run']('attrib -R "{0}"'.format(cfn))
                 with salt.utils.fopen(cfn, 'w+b') as fp_:
                     try:
-                        self.serial.dump(grains_data, fp_)
+                        self.serial.dump(providers, fp_)
                     except TypeError:
                         # Can't serialize pydsl
                         pass
@@ -1248,14 +1545,33 @@ class Loader(object):
             os.umask(cumask)
         return grains_data
 
+    def _read_grains_cache(self, cfn):
+        '''
+        Return the grains cached by grain function
+        '''
+        if not os.path.isfile(cfn):
+            log.debug('Grains cache file does not exist.')
+            return {}
+        try:
+            with salt.utils.fopen(cfn, 'rb') as fp_:
+                cache = self.serial.load(fp_)
+        except Exception:
+            log.debug('Unable to read the grains cache file {0}'.format(cfn))
+            return {}
+        if not isinstance(cache, dict):
+            return {}
+        return cache
+
 
 class LazyLoader(MutableMapping):
     '''
     Lazily load things modules. If anyone asks for len or attempts to iterate this
     will load them all.
 
-    TODO: negative caching? If you ask for 'foo.bar' and it doesn't exist it will
-    look EVERY time unless someone calls load_all()
+    Keys which do not match a module file name are looked up in the virtual
+    module index if it is enabled, the module names the index says nothing
+    provides are remembered so they are not looked up again. Without the index
+    all of the modules are loaded.
     '''
     def __init__(self,
                  loader,
@@ -1275,6 +1591,8 @@ class LazyLoader(MutableMapping):
 
         # have we already loded everything?
         self.loaded = False
+        # the module names nothing provides
+        self.missing = set()
 
     def _load(self, key):
         '''
@@ -1288,17 +1606,27 @@ class LazyLoader(MutableMapping):
             # if the modulename isn't in the whitelist, don't bother
             if mod_key not in self.whitelist:
                 raise KeyError
+        if mod_key in self.missing:
+            raise KeyError
         mod_funcs = self.loader.gen_module(mod_key,
                                            self.functions,
                                            pack=self.pack,
                                            )
         # if you loaded nothing, then we don't have it
         if mod_funcs is None:
-            # if we couldn't find it, then it could be a virtual or we don't have it
-            # until we have a better way, we have to load them all to know
-            # TODO: maybe do a load until, with some glob match first?
+            # if we couldn't find it, then it could be a virtual or we don't
+            # have it, ask the virtual module index
+            mod_funcs = self.loader.gen_virtual_module(mod_key,
+                                                       self.functions,
+                                                       pack=self.pack,
+                                                       )
+        if mod_funcs is None:
+            # the index can't tell, we have to load them all to know
             self.load_all()
             return self._dict[key]
+        if not mod_funcs:
+            self.missing.add(mod_key)
+            raise KeyError
         self._dict.update(mod_funcs)
 
     def load_all(self):
@@ -1360,17 +1688,27 @@ class LazyFilterLoader(LazyLoader):
             # if the modulename isn't in the whitelist, don't bother
             if key not in self.whitelist:
                 raise KeyError
+        if key in self.missing:
+            raise KeyError
         mod_funcs = self.loader.gen_module(key,
                                            self.functions,
                                            pack=self.pack,
                                            )
         # if you loaded nothing, then we don't have it
         if mod_funcs is None:
-            # if we couldn't find it, then it could be a virtual or we don't have it
-            # until we have a better way, we have to load them all to know
-            # TODO: maybe do a load until, with some glob match first?
+            # if we couldn't find it, then it could be a virtual or we don't
+            # have it, ask the virtual module index
+            mod_funcs = self.loader.gen_virtual_module(key,
+                                                       self.functions,
+                                                       pack=self.pack,
+                                                       )
+        if mod_funcs is None:
+            # the index can't tell, we have to load them all to know
             self.load_all()
             return self._dict[key]
+        if not mod_funcs:
+            self.missing.add(key)
+            raise KeyError
 
         # if we got one, now lets check if we have the function name we want
         for mod_key, mod_fun in mod_funcs.iteritems():
@@ -41,14 +41,17 @@ import salt.utils.atomicfile
 import salt.utils.event
 import salt.utils.verify
 import salt.utils.minions
+import salt.utils.minion_data
 import salt.utils.gzip_util
 from salt.defaults import DEFAULT_TARGET_DELIM
 from salt.utils.debug import enable_sigusr1_handler, enable_sigusr2_handler, inspect_stack
 from salt.exceptions import MasterExit
 from salt.utils.event import tagify
 import binascii
-from salt.utils.master import ConnectedCache
+from salt.utils.master import ConnectedCache, PillarPool, PillarPoolCli
+from salt.utils.master import PILLAR_READY
 from salt.utils.cache import CacheCli
+from salt.utils.odict import OrderedDict
 
 # Import halite libs
 try:
@@ -66,6 +69,9 @@ except ImportError:
 
 log = logging.getLogger(__name__)
 
+# The number of zmq topic hashes of minion ids kept by the publisher
+TOPIC_CACHE_SIZE = 16384
+
 
 def clean_proc(proc, wait_for_kill=10):
     '''
@@ -179,7 +185,10 @@ class Master(SMaster):
             now = int(time.time())
             loop_interval = int(self.opts['loop_interval'])
             if (now - last) >= loop_interval:
-                salt.daemons.masterapi.clean_old_jobs(self.opts)
+                reaped = salt.daemons.masterapi.clean_old_jobs(self.opts)
+                if isinstance(reaped, dict):
+                    # Report how much the job cache reaper did on this run
+                    event.fire_event(reaped, tagify('clean', 'job'))
                 salt.daemons.masterapi.clean_expired_tokens(self.opts)
 
             if self.opts.get('publish_session'):
@@ -382,6 +391,20 @@ class Publisher(multiprocessing.Process):
     def __init__(self, opts):
         super(Publisher, self).__init__()
         self.opts = opts
+        self.topics = OrderedDict()
+
+    def _topic(self, topic):
+        '''
+        Return the zmq topic of a minion id, zmq filters are substring match
+        so the id is hashed to avoid collisions
+        '''
+        htopic = self.topics.pop(topic, None)
+        if htopic is None:
+            htopic = hashlib.sha1(topic).hexdigest()
+            while len(self.topics) >= TOPIC_CACHE_SIZE:
+                self.topics.popitem(last=False)
+        self.topics[topic] = htopic
+        return htopic
 
     def run(self):
         '''
@@ -433,12 +456,13 @@ class Publisher(multiprocessing.Process):
                     if self.opts['zmq_filtering']:
                         # if you have a specific topic list, use that
                         if 'topic_lst' in unpacked_package:
+                            # The same frame is sent to every minion, without
+                            # copying the payload for each of them
+                            frame = zmq.Message(payload)
                             for topic in unpacked_package['topic_lst']:
-                                # zmq filters are substring match, hash the topic
-                                # to avoid collisions
-                                htopic = hashlib.sha1(topic).hexdigest()
-                                pub_sock.send(htopic, flags=zmq.SNDMORE)
-                                pub_sock.send(payload)
+                                pub_sock.send(
+                                    self._topic(topic), flags=zmq.SNDMORE)
+                                pub_sock.send(frame, copy=False)
                                 # otherwise its a broadcast
                         else:
                             # TODO: constants file for "broadcast"
@@ -506,6 +530,13 @@ class ReqServer(object):
         self.clients.bind(self.uri)
         self.work_procs = []
 
+        if self.opts['pillar_workers'] > 0:
+            log.info('Starting the pillar compile pool')
+            self.work_procs.append(PillarPool(self.opts))
+            for ind in range(int(self.opts['pillar_workers'])):
+                self.work_procs.append(PillarWorker(self.opts,
+                                                    self.crypticle))
+
         for ind in range(int(self.opts['worker_threads'])):
             self.work_procs.append(MWorker(self.opts,
                                            self.master_key,
@@ -711,6 +742,16 @@ class MWorker(multiprocessing.Process):
         log.info('AES payload received with command {0}'.format(data['cmd']))
         if data['cmd'].startswith('__'):
             return False
+        if data['cmd'] == '_pillar' and data.get('ver') == '2' \
+                and self.pillar_pool is not None:
+            # Leave the rendering to the pillar compile pool
+            ret = self.pillar_pool.compile(data)
+            if ret is not None:
+                return ret
+            log.warning(
+                'The pillar compile pool did not compile the pillar of {0}, '
+                'compiling it here'.format(data.get('id'))
+            )
         return self.aes_funcs.run_func(data['cmd'], data)
 
     def _update_aes(self):
@@ -750,6 +791,66 @@ class MWorker(multiprocessing.Process):
             self.mkey,
             self.crypticle)
         self.aes_funcs = AESFuncs(self.opts, self.crypticle)
+        self.pillar_pool = None
+        if self.opts['pillar_workers'] > 0:
+            self.pillar_pool = PillarPoolCli(self.opts)
+        self.__bind()
+
+
+class PillarWorker(multiprocessing.Process):
+    '''
+    A worker process of the pillar compile pool, compiles the pillar requests
+    the MWorkers hand over to the pool
+    '''
+    def __init__(self, opts, crypticle):
+        multiprocessing.Process.__init__(self)
+        self.opts = opts
+        self.serial = salt.payload.Serial(opts)
+        self.crypticle = crypticle
+
+    def __bind(self):
+        '''
+        Connect to the pool and compile the pillars it sends
+        '''
+        context = zmq.Context(1)
+        w_uri = 'ipc://{0}'.format(
+            os.path.join(self.opts['sock_dir'], 'pillar_workers.ipc')
+            )
+        log.info('Pillar worker connecting to socket {0}'.format(w_uri))
+        ready = [PILLAR_READY, str(os.getpid())]
+        socket = context.socket(zmq.REQ)
+        socket.connect(w_uri)
+        socket.send_multipart(ready)
+        try:
+            while True:
+                try:
+                    client, empty, package = socket.recv_multipart()
+                    load = self.serial.loads(package)
+                    ret = self.serial.dumps(
+                            self.aes_funcs.run_func('_pillar', load))
+                    socket.send_multipart([client, empty, ret])
+                except KeyboardInterrupt:
+                    raise
+                except Exception as exc:
+                    if isinstance(exc, zmq.ZMQError) and exc.errno == errno.EINTR:
+                        continue
+                    log.critical('Unexpected Error in pillar worker',
+                                 exc_info=True)
+                    # Start over with a new socket, the pool fails the
+                    # request of the old one
+                    socket.close()
+                    socket = context.socket(zmq.REQ)
+                    socket.connect(w_uri)
+                    socket.send_multipart(ready)
+        except KeyboardInterrupt:
+            socket.close()
+
+    def run(self):
+        '''
+        Start a pillar worker
+        '''
+        salt.utils.appendproctitle(self.__class__.__name__)
+        self.aes_funcs = AESFuncs(self.opts, self.crypticle)
         self.__bind()
 
 
@@ -782,6 +883,8 @@ class AESFuncs(object):
         fs_ = salt.fileserver.Fileserver(self.opts)
         self._serve_file = fs_.serve_file
         self._file_hash = fs_.file_hash
+        self._file_hashes = fs_.file_hashes
+        self._file_manifest = fs_.file_manifest
         self._file_list = fs_.file_list
         self._file_list_emptydirs = fs_.file_list_emptydirs
         self._dir_list = fs_.dir_list
@@ -1062,21 +1165,29 @@ class AESFuncs(object):
             load.get('ext'),
             self.mminion.functions)
         data = pillar.compile_pillar(pillar_dirs=pillar_dirs)
+        if self.opts.get('pillar_opts_compact', False) \
+                and load.get('opts_ref', False):
+            salt.pillar.compact_master_opts(self.opts, data)
         if self.opts.get('minion_data_cache', False):
-            cdir = os.path.join(self.opts['cachedir'], 'minions', load['id'])
-            if not os.path.isdir(cdir):
-                os.makedirs(cdir)
-            datap = os.path.join(cdir, 'data.p')
-            with salt.utils.fopen(datap, 'w+b') as fp_:
-                fp_.write(
-                    self.serial.dumps(
-                        {'grains': load['grains'],
-                         'pillar': data})
-                    )
+            mtime = salt.utils.minion_data.store(self.opts).store(
+                    load['id'], load['grains'], data)
+            if self.opts.get('minion_data_index', False):
+                salt.utils.minions.minion_data_index(self.opts).update(
+                        load['id'], load['grains'], data, mtime)
         for mod in mods:
             sys.modules[mod].__grains__ = self.opts['grains']
         return data
 
+    def _pillar_opts(self, load):
+        '''
+        Return the master opts referenced by a compacted pillar
+        '''
+        if any(key not in load for key in ('id', 'opts_hash')):
+            return False
+        if not salt.utils.verify.valid_id(self.opts, load['id']):
+            return False
+        return salt.pillar.get_master_opts(self.opts, load['opts_hash'])
+
     def _minion_event(self, load):
         '''
         Receive an event from the minion and fire it on the master event
@@ -1325,6 +1436,21 @@ class ClearFuncs(object):
         self.masterapi = salt.daemons.masterapi.LocalFuncs(opts, key)
         self.auto_key = salt.daemons.masterapi.AutoKey(opts)
         self.cache_cli = CacheCli(self.opts)
+        self.pub_sock = None
+
+    def _pub_sock(self):
+        '''
+        Return the socket to the publisher, it is connected on the first
+        publish and kept for the next ones
+        '''
+        if self.pub_sock is None:
+            context = zmq.Context(1)
+            self.pub_sock = context.socket(zmq.PUSH)
+            pull_uri = 'ipc://{0}'.format(
+                os.path.join(self.opts['sock_dir'], 'publish_pull.ipc')
+                )
+            self.pub_sock.connect(pull_uri)
+        return self.pub_sock
 
     def _auth(self, load):
         '''
@@ -2276,27 +2402,22 @@ class ClearFuncs(object):
                     **clear_load
                 )
             )
-        log.debug('Published command details {0}'.format(load))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('Published command details {0}'.format(load))
 
         payload['load'] = self.crypticle.dumps(load)
         if self.opts['sign_pub_messages']:
             master_pem_path = os.path.join(self.opts['pki_dir'], 'master.pem')
             log.debug("Signing data packet")
             payload['sig'] = salt.crypt.sign_message(master_pem_path, payload['load'])
-        # Send 0MQ to the publisher
-        context = zmq.Context(1)
-        pub_sock = context.socket(zmq.PUSH)
-        pull_uri = 'ipc://{0}'.format(
-            os.path.join(self.opts['sock_dir'], 'publish_pull.ipc')
-            )
-        pub_sock.connect(pull_uri)
         int_payload = {'payload': self.serial.dumps(payload)}
 
         # add some targeting stuff for lists only (for now)
         if load['tgt_type'] == 'list':
             int_payload['topic_lst'] = load['tgt']
 
-        pub_sock.send(self.serial.dumps(int_payload))
+        # Send 0MQ to the publisher
+        self._pub_sock().send(self.serial.dumps(int_payload))
         return {
             'enc': 'clear',
             'load': {
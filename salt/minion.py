@@ -76,6 +76,11 @@ import salt.syspaths
 
 log = logging.getLogger(__name__)
 
+# Compound targets compiled by Matcher.compile_compound, by target
+_COMPOUND_CACHE = {}
+# The number of compiled compound targets kept
+COMPOUND_CACHE_SIZE = 1024
+
 # To set up a minion:
 # 1. Read in the configuration
 # 2. Generate the function mapping dict
@@ -2481,13 +2486,17 @@ class Matcher(object):
                 return False
         return False
 
-    def compound_match(self, tgt):
+    def compile_compound(self, tgt):
         '''
-        Runs the compound target check
+        Parse a compound target into a list of (matcher, target) tuples and
+        a code object evaluating the target, with ``_m(index)`` standing for
+        the result of each matcher. Returns None if the target is invalid.
+
+        The compiled targets are cached in the process, so the targets of a
+        top file are only parsed once for all of the minions.
         '''
-        if not isinstance(tgt, string_types):
-            log.debug('Compound target received that is not a string')
-            return False
+        if tgt in _COMPOUND_CACHE:
+            return _COMPOUND_CACHE[tgt]
         ref = {'G': 'grain',
                'P': 'grain_pcre',
                'I': 'pillar',
@@ -2496,9 +2505,11 @@ class Matcher(object):
                'E': 'pcre'}
         if HAS_RANGE:
             ref['R'] = 'range'
+        matchers = []
         results = []
         opers = ['and', 'or', 'not', '(', ')']
         tokens = tgt.split()
+        compiled = None
         for match in tokens:
             # Try to match tokens from the compound target, first by using
             # the 'G, X, I, L, S, E' matcher types, then by hostname glob.
@@ -2507,14 +2518,9 @@ class Matcher(object):
                 matcher = ref.get(comps[0])
                 if not matcher:
                     # If an unknown matcher is called at any time, fail out
-                    return False
-                results.append(
-                    str(
-                        getattr(self, '{0}_match'.format(matcher))(
-                            '@'.join(comps[1:])
-                        )
-                    )
-                )
+                    break
+                results.append('_m({0})'.format(len(matchers)))
+                matchers.append((matcher, '@'.join(comps[1:])))
             elif match in opers:
                 # We didn't match a target, so append a boolean operator or
                 # subexpression
@@ -2530,17 +2536,47 @@ class Matcher(object):
                 else:
                     # seq start with oper, fail
                     if match not in ['(', ')']:
-                        return False
+                        break
             else:
                 # The match is not explicitly defined, evaluate it as a glob
-                results.append(str(self.glob_match(match)))
-        results = ' '.join(results)
+                results.append('_m({0})'.format(len(matchers)))
+                matchers.append(('glob', match))
+        else:
+            results = ' '.join(results)
+            try:
+                compiled = (matchers, compile(results, '<compound>', 'eval'))
+            except SyntaxError:
+                log.error('Invalid compound target: {0} for results: '
+                          '{1}'.format(tgt, results))
+        if len(_COMPOUND_CACHE) >= COMPOUND_CACHE_SIZE:
+            _COMPOUND_CACHE.clear()
+        _COMPOUND_CACHE[tgt] = compiled
+        return compiled
+
+    def compound_match(self, tgt):
+        '''
+        Runs the compound target check
+        '''
+        if not isinstance(tgt, string_types):
+            log.debug('Compound target received that is not a string')
+            return False
+        compiled = self.compile_compound(tgt)
+        if compiled is None:
+            return False
+        matchers, code = compiled
+
+        def _m(index):
+            '''
+            Run a matcher of the target, only when the result is needed
+            '''
+            matcher, target = matchers[index]
+            return getattr(self, '{0}_match'.format(matcher))(target)
+
         try:
-            return eval(results)  # pylint: disable=W0123
+            return eval(code, {'_m': _m})  # pylint: disable=W0123
         except Exception:
-            log.error('Invalid compound target: {0} for results: {1}'.format(tgt, results))
+            log.error('Invalid compound target: {0}'.format(tgt))
             return False
-        return False
 
     def nodegroup_match(self, tgt, nodegroups):
         '''
@@ -505,6 +505,23 @@ def list_master(saltenv='base', prefix='', env=None):
     return __context__['cp.fileclient'].file_list(saltenv, prefix)
 
 
+def file_manifest(saltenv='base', prefix=''):
+    '''
+    Return the hash, the size and the mode of the files stored on the master
+    by path, in one request. A masterless minion hashes its local files.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cp.file_manifest prefix=web/
+    '''
+    _mk_client()
+    return __context__['cp.fileclient'].file_manifest(saltenv,
+                                                      prefix,
+                                                      lazy=False)
+
+
 def list_master_dirs(saltenv='base', prefix='', env=None):
     '''
     List all of the directories stored on the master
@@ -5,9 +5,14 @@ Render the pillar data
 
 # Import python libs
 import os
+import re
+import json
+import time
+import random
 import collections
+import hashlib
 import logging
-from copy import copy
+from copy import copy, deepcopy
 
 # Import salt libs
 import salt.loader
@@ -15,6 +20,9 @@ import salt.fileclient
 import salt.minion
 import salt.crypt
 import salt.transport
+import salt.utils
+import salt.utils.atomicfile
+import salt.utils.threadpool
 from salt._compat import string_types
 from salt.template import compile_template
 from salt.utils.dictupdate import update
@@ -25,6 +33,184 @@ from salt.version import __version__
 
 log = logging.getLogger(__name__)
 
+# Rendered top files, by saltenv, path, renderer and hash of the source
+_TOP_CACHE = OrderedDict()
+# The number of rendered top files kept
+TOP_CACHE_SIZE = 256
+# Top files containing these are rendered for every minion
+TEMPLATE_MARKERS = ('{%', '{{', '{#', '${', '<%')
+
+# Rendered pillar SLS files, by saltenv, sls, path, renderer, defaults and
+# hash of the source. Each entry is a list of renders with the values of the
+# grains, pillar and opts they read.
+_SLS_CACHE = OrderedDict()
+# The number of pillar SLS files kept
+SLS_CACHE_SIZE = 1024
+# The number of renders kept for a pillar SLS file
+SLS_CACHE_RENDERS = 16
+# The renderers whose inputs the SLS render cache knows
+CACHEABLE_RENDERERS = frozenset(('jinja', 'yaml', 'yamlex', 'json'))
+# Templates which read other files, call salt functions or depend on the time
+# are rendered for every minion
+UNTRACKED_RE = re.compile(
+    r'{%-?\s*(include|import|from|extends)\b'
+    r'|\bsalt\s*[.\[]'
+    r'|\|\s*(random|strftime)\b'
+    r'|show_full_context'
+)
+# Counters of the SLS render cache of this process
+SLS_CACHE_STATS = {'hits': 0,
+                   'misses': 0,
+                   'uncacheable': 0,
+                   'render_time': 0.0,
+                   'saved_time': 0.0}
+
+# ext_pillar returns, by minion id, position in the ext_pillar option,
+# interface and arguments
+_EXT_PILLAR_CACHE = OrderedDict()
+# The number of ext_pillar returns kept
+EXT_PILLAR_CACHE_SIZE = 65536
+
+# Directory under the cachedir holding the master opts sent by reference
+MASTER_OPTS_DIR = 'pillar_opts'
+# Key of the reference to the master opts in pillar['master']
+MASTER_OPTS_REF = '__master_opts__'
+# Keys of pillar['master'] which differ between the minions, sent as is
+MASTER_OPTS_MINION_KEYS = ('id', 'environment', 'ext_pillar', 'pillar')
+# The number of master opts kept in the minion cache
+MASTER_OPTS_KEEP = 4
+
+# Answer of a master whose pillar compile pool is full
+PILLAR_BUSY = '__pillar_busy__'
+# The number of times a minion asks a busy master for its pillar
+PILLAR_BUSY_TRIES = 30
+# The maximum number of seconds a minion waits before asking again
+PILLAR_BUSY_WAIT = 10
+
+_MISSING = object()
+
+
+def _master_opts_path(opts, opts_hash):
+    '''
+    Return the path of the cached master opts with the given hash, or None if
+    the hash is malformed
+    '''
+    if not isinstance(opts_hash, string_types) \
+            or not re.match(r'^[0-9a-f]{40}$', opts_hash):
+        return None
+    return os.path.join(
+            opts['cachedir'], MASTER_OPTS_DIR, '{0}.p'.format(opts_hash))
+
+
+def _write_master_opts(opts, path, mopts):
+    '''
+    Write master opts to the cache
+    '''
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with salt.utils.atomicfile.atomic_open(path, 'w+b') as fp_:
+            salt.payload.Serial(opts).dump(mopts, fp_)
+    except (IOError, OSError) as exc:
+        log.error('Unable to write the master opts to {0}: {1}'.format(
+            path, exc))
+
+
+def compact_master_opts(opts, pillar):
+    '''
+    Replace the master opts in pillar['master'] by a reference to a copy of
+    them in the master cachedir, named after the hash of their content. The
+    keys which differ between the minions are kept in pillar['master']. The
+    master opts are sent as they are if they hold byte strings which are not
+    UTF-8.
+    '''
+    mopts = pillar.get('master')
+    if not isinstance(mopts, dict):
+        return pillar
+    shared = dict((key, val) for key, val in mopts.items()
+                  if key not in MASTER_OPTS_MINION_KEYS)
+    try:
+        data = json.dumps(shared, sort_keys=True, default=repr)
+    except UnicodeDecodeError:
+        log.debug('The master opts hold non UTF-8 byte strings, sending '
+                  'them in the pillar')
+        return pillar
+    opts_hash = hashlib.sha1(data).hexdigest()
+    path = _master_opts_path(opts, opts_hash)
+    if not os.path.isfile(path):
+        _write_master_opts(opts, path, shared)
+    ref = dict((key, mopts[key]) for key in MASTER_OPTS_MINION_KEYS
+               if key in mopts)
+    ref[MASTER_OPTS_REF] = opts_hash
+    pillar['master'] = ref
+    return pillar
+
+
+def get_master_opts(opts, opts_hash):
+    '''
+    Return the master opts referenced by a compacted pillar, False if they
+    are unknown
+    '''
+    path = _master_opts_path(opts, opts_hash)
+    if path is None or not os.path.isfile(path):
+        return False
+    try:
+        with salt.utils.fopen(path, 'rb') as fp_:
+            return salt.payload.Serial(opts).load(fp_)
+    except (IOError, OSError):
+        return False
+
+
+def render_cache_stats():
+    '''
+    Return the counters of the pillar SLS render cache of this process, with
+    the ratio of the pillar SLS renders served from the cache
+    '''
+    ret = dict(SLS_CACHE_STATS)
+    renders = ret['hits'] + ret['misses'] + ret['uncacheable']
+    ret['hit_rate'] = float(ret['hits']) / renders if renders else 0.0
+    return ret
+
+
+class _Recorder(collections.Mapping):
+    '''
+    Read only view of the grains, pillar or opts passed to a template, which
+    records the values of the keys the template reads. Using the whole
+    mapping, by iterating over it or printing it, sets whole.
+    '''
+    def __init__(self, data):
+        self._data = data
+        self.read = {}
+        self.whole = False
+
+    def __getitem__(self, key):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.read.setdefault(key, _MISSING)
+            raise
+        except TypeError:
+            # Unhashable key
+            self.whole = True
+            raise
+        if key not in self.read:
+            self.read[key] = deepcopy(value)
+        return value
+
+    def __iter__(self):
+        self.whole = True
+        return iter(self._data)
+
+    def __len__(self):
+        self.whole = True
+        return len(self._data)
+
+    def __repr__(self):
+        self.whole = True
+        return repr(self._data)
+
+    __str__ = __repr__
+
 
 def merge_recurse(obj_a, obj_b):
     copied = copy(obj_a)
@@ -76,11 +262,26 @@ class RemotePillar(object):
                 'grains': self.grains,
                 'saltenv': self.opts['environment'],
                 'ver': '2',
+                'opts_ref': True,
+                'busy_ok': True,
                 'cmd': '_pillar'}
         if self.ext:
             load['ext'] = self.ext
         # ret = self.sreq.send(load, tries=3, timeout=7200)
-        ret_pillar = self.sreq.crypted_transfer_decode_dictentry(load, dictkey='pillar', tries=3, timeout=7200)
+        for _ in range(PILLAR_BUSY_TRIES):
+            ret_pillar = self.sreq.crypted_transfer_decode_dictentry(load, dictkey='pillar', tries=3, timeout=7200)
+            if not isinstance(ret_pillar, dict) or PILLAR_BUSY not in ret_pillar:
+                break
+            # Spread the retries of the minions refreshed together
+            wait = random.uniform(1, PILLAR_BUSY_WAIT)
+            log.info(
+                'The master is busy compiling pillars, asking again in '
+                '{0:.1f} seconds'.format(wait)
+            )
+            time.sleep(wait)
+        else:
+            log.error('The master stayed too busy to compile the pillar')
+            return {}
 
         # key = self.auth.get_keys()
         # aes = key.private_decrypt(ret['key'], 4)
@@ -93,7 +294,56 @@ class RemotePillar(object):
                 '{1}'.format(type(ret_pillar).__name__, ret_pillar)
             )
             return {}
-        return ret_pillar
+        return self.expand_master_opts(ret_pillar)
+
+    def expand_master_opts(self, pillar):
+        '''
+        Replace the reference to the master opts sent by a master with
+        pillar_opts_compact set by the master opts, read from the minion cache
+        or requested from the master
+        '''
+        mopts = pillar.get('master')
+        if not isinstance(mopts, dict) or MASTER_OPTS_REF not in mopts:
+            return pillar
+        opts_hash = mopts.pop(MASTER_OPTS_REF)
+        path = _master_opts_path(self.opts, opts_hash)
+        if path is None:
+            log.error('Got a malformed master opts reference from the master')
+            return pillar
+        shared = get_master_opts(self.opts, opts_hash)
+        if shared is False:
+            load = {'id': self.id_,
+                    'opts_hash': opts_hash,
+                    'cmd': '_pillar_opts'}
+            shared = self.sreq.send(load, tries=3, timeout=60)
+            if isinstance(shared, dict):
+                _write_master_opts(self.opts, path, shared)
+                self._prune_master_opts(path)
+            else:
+                log.error('Unable to get the master opts {0} from the '
+                          'master'.format(opts_hash))
+                shared = {}
+        shared.update(mopts)
+        pillar['master'] = shared
+        return pillar
+
+    def _prune_master_opts(self, keep):
+        '''
+        Remove the oldest master opts from the minion cache
+        '''
+        cdir = os.path.dirname(keep)
+        try:
+            paths = [os.path.join(cdir, fn_) for fn_ in os.listdir(cdir)]
+            paths.sort(key=os.path.getmtime, reverse=True)
+        except OSError:
+            return
+        for path in paths[MASTER_OPTS_KEEP:]:
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
 
 
 class Pillar(object):
@@ -187,6 +437,43 @@ class Pillar(object):
             envs.update(list(self.opts['file_roots']))
         return envs
 
+    def render_top(self, path, saltenv):
+        '''
+        Render a top file. If pillar_top_cache is set the top files which do
+        not depend on the minion, without a shebang line, template markup or
+        a python renderer, are only rendered once in the process for all of
+        the minions, until their source changes.
+        '''
+        if not self.opts.get('pillar_top_cache', False) or not path \
+                or any(rend.strip().startswith('py')
+                       for rend in self.opts['renderer'].replace('|', '_').split('_')):
+            return compile_template(
+                    path, self.rend, self.opts['renderer'], saltenv=saltenv)
+        try:
+            with salt.utils.fopen(path, 'rb') as fp_:
+                source = fp_.read()
+        except (IOError, OSError):
+            return compile_template(
+                    path, self.rend, self.opts['renderer'], saltenv=saltenv)
+        if source.startswith('#!') \
+                or any(marker in source for marker in TEMPLATE_MARKERS):
+            return compile_template(
+                    path, self.rend, self.opts['renderer'], saltenv=saltenv)
+        key = (saltenv,
+               path,
+               self.opts['renderer'],
+               hashlib.md5(source).hexdigest())
+        if key in _TOP_CACHE:
+            top = _TOP_CACHE.pop(key)
+        else:
+            top = compile_template(
+                    path, self.rend, self.opts['renderer'], saltenv=saltenv)
+            while len(_TOP_CACHE) >= TOP_CACHE_SIZE:
+                _TOP_CACHE.popitem(last=False)
+        _TOP_CACHE[key] = top
+        # get_tops alters the top files
+        return deepcopy(top)
+
     def get_tops(self):
         '''
         Gather the top files
@@ -199,27 +486,23 @@ class Pillar(object):
         try:
             if self.opts['environment']:
                 tops[self.opts['environment']] = [
-                        compile_template(
+                        self.render_top(
                             self.client.cache_file(
                                 self.opts['state_top'],
                                 self.opts['environment']
                                 ),
-                            self.rend,
-                            self.opts['renderer'],
                             self.opts['environment']
                             )
                         ]
             else:
                 for saltenv in self._get_envs():
                     tops[saltenv].append(
-                            compile_template(
+                            self.render_top(
                                 self.client.cache_file(
                                     self.opts['state_top'],
                                     saltenv
                                     ),
-                                self.rend,
-                                self.opts['renderer'],
-                                saltenv=saltenv
+                                saltenv
                                 )
                             )
         except Exception as exc:
@@ -247,14 +530,12 @@ class Pillar(object):
                         continue
                     try:
                         tops[saltenv].append(
-                                compile_template(
+                                self.render_top(
                                     self.client.get_state(
                                         sls,
                                         saltenv
                                         ).get('dest', False),
-                                    self.rend,
-                                    self.opts['renderer'],
-                                    saltenv=saltenv
+                                    saltenv
                                     )
                                 )
                     except Exception as exc:
@@ -353,6 +634,101 @@ class Pillar(object):
                             matches[saltenv].append(item)
         return matches
 
+    def _sls_cache_key(self, fn_, saltenv, sls, defaults):
+        '''
+        Return the key of a pillar SLS file in the render cache and the
+        mappings the renders depend on, or None if the file can not be cached
+        '''
+        if not fn_:
+            return None
+        try:
+            with salt.utils.fopen(fn_, 'rb') as fp_:
+                source = fp_.read()
+        except (IOError, OSError):
+            return None
+        renderer = self.opts['renderer']
+        renderers = set(renderer.replace('|', '_').split('_'))
+        if source.startswith('#!') \
+                or UNTRACKED_RE.search(source) \
+                or not renderers <= CACHEABLE_RENDERERS:
+            return None
+        if 'jinja' in self.rend:
+            glbls = self.rend['jinja'].func_globals
+            mappings = {'grains': glbls.get('__grains__', {}),
+                        'pillar': glbls.get('__pillar__', {}),
+                        'opts': glbls.get('__opts__', {})}
+        else:
+            mappings = {}
+        key = (saltenv,
+               sls,
+               fn_,
+               renderer,
+               repr(sorted(defaults.items())),
+               hashlib.md5(source).hexdigest())
+        return key, mappings
+
+    def render_sls(self, fn_, saltenv, sls, defaults):
+        '''
+        Render a pillar SLS file. If pillar_render_cache is set, the values of
+        the grains, pillar and opts which a template reads are recorded, and
+        the render is reused for the other minions with the same values, until
+        the source of the file changes.
+        '''
+        cached = None
+        if self.opts.get('pillar_render_cache', False):
+            cached = self._sls_cache_key(fn_, saltenv, sls, defaults)
+        if cached is None:
+            if self.opts.get('pillar_render_cache', False):
+                SLS_CACHE_STATS['uncacheable'] += 1
+            return compile_template(
+                fn_, self.rend, self.opts['renderer'], saltenv, sls, **defaults)
+        key, mappings = cached
+        renders = _SLS_CACHE.pop(key, [])
+        _SLS_CACHE[key] = renders
+        if renders is None:
+            # The template uses the mappings in a way which is not tracked
+            SLS_CACHE_STATS['uncacheable'] += 1
+            return compile_template(
+                fn_, self.rend, self.opts['renderer'], saltenv, sls, **defaults)
+        for render in renders:
+            if all(mappings[name].get(item, _MISSING) == value
+                   for name, read in render['read'].items()
+                   for item, value in read.items()):
+                SLS_CACHE_STATS['hits'] += 1
+                SLS_CACHE_STATS['saved_time'] += render['duration']
+                # render_pstate alters the rendered data
+                return deepcopy(render['state'])
+        recorders = dict((name, _Recorder(data))
+                         for name, data in mappings.items())
+        start = time.time()
+        try:
+            state = compile_template(
+                fn_, self.rend, self.opts['renderer'], saltenv, sls,
+                context=recorders, **defaults)
+            failed = False
+        except Exception:
+            # The template may use the mappings in a way the recorders do not
+            # support, render it as usual
+            failed = True
+        duration = time.time() - start
+        SLS_CACHE_STATS['render_time'] += duration
+        if failed or any(rec.whole for rec in recorders.values()):
+            SLS_CACHE_STATS['uncacheable'] += 1
+            _SLS_CACHE[key] = None
+            if not failed:
+                return state
+            return compile_template(
+                fn_, self.rend, self.opts['renderer'], saltenv, sls, **defaults)
+        SLS_CACHE_STATS['misses'] += 1
+        renders.insert(0, {'read': dict((name, rec.read)
+                                        for name, rec in recorders.items()),
+                           'duration': duration,
+                           'state': deepcopy(state)})
+        del renders[SLS_CACHE_RENDERS:]
+        while len(_SLS_CACHE) > SLS_CACHE_SIZE:
+            _SLS_CACHE.popitem(last=False)
+        return state
+
     def render_pstate(self, sls, saltenv, mods, defaults=None):
         '''
         Collect a single pillar sls file and render it
@@ -377,8 +753,7 @@ class Pillar(object):
                 return None, mods, errors
         state = None
         try:
-            state = compile_template(
-                fn_, self.rend, self.opts['renderer'], saltenv, sls, **defaults)
+            state = self.render_sls(fn_, saltenv, sls, defaults)
         except Exception as exc:
             msg = 'Rendering SLS {0!r} failed, render error:\n{1}'.format(
                 sls, exc
@@ -487,6 +862,62 @@ class Pillar(object):
                                             val)
         return ext
 
+    def _ext_pillar_setting(self, name, key, default):
+        '''
+        Return the setting of an ext_pillar interface from the dict in the
+        name option
+        '''
+        settings = self.opts.get(name) or {}
+        return settings.get(key, self.opts.get(default, 0))
+
+    def _ext_pillar_job(self, pillar, val, pillar_dirs, key):
+        '''
+        Run an ext_pillar interface
+        '''
+        try:
+            return self._external_pillar_data(pillar,
+                                              val,
+                                              pillar_dirs,
+                                              key)
+        except TypeError as exc:
+            if str(exc).startswith('ext_pillar() takes exactly '):
+                log.warning('Deprecation warning: ext_pillar "{0}"'
+                            ' needs to accept minion_id as first'
+                            ' argument'.format(key))
+            else:
+                raise
+
+            return self._external_pillar_data(pillar,
+                                              val,
+                                              pillar_dirs,
+                                              key)
+
+    def _ext_pillar_lookup(self, index, val, key):
+        '''
+        Return the cache key of an ext_pillar interface return for the minion
+        and the cached return if it is still fresh, the cache key is None if
+        the interface has no cache TTL
+        '''
+        ttl = self._ext_pillar_setting(
+                'ext_pillar_interface_ttl', key, 'ext_pillar_cache_ttl')
+        if not ttl:
+            return None, None
+        ckey = (self.opts['id'], index, key, repr(val))
+        if ckey in _EXT_PILLAR_CACHE:
+            stamp, ext = _EXT_PILLAR_CACHE[ckey]
+            if time.time() - stamp <= ttl:
+                return ckey, deepcopy(ext)
+        return ckey, None
+
+    def _ext_pillar_store(self, ckey, ext):
+        '''
+        Keep the return of an ext_pillar interface for the minion
+        '''
+        _EXT_PILLAR_CACHE.pop(ckey, None)
+        _EXT_PILLAR_CACHE[ckey] = (time.time(), deepcopy(ext))
+        while len(_EXT_PILLAR_CACHE) > EXT_PILLAR_CACHE_SIZE:
+            _EXT_PILLAR_CACHE.popitem(last=False)
+
     def ext_pillar(self, pillar, pillar_dirs):
         '''
         Render the external pillar data
@@ -496,35 +927,28 @@ class Pillar(object):
         if not isinstance(self.opts['ext_pillar'], list):
             log.critical('The "ext_pillar" option is malformed')
             return pillar
-        ext = None
         for run in self.opts['ext_pillar']:
             if not isinstance(run, dict):
                 log.critical('The "ext_pillar" option is malformed')
                 return {}
+        if self.opts.get('ext_pillar_threads', 0) > 0:
+            return self.ext_pillar_concurrent(pillar, pillar_dirs)
+        ext = None
+        for index, run in enumerate(self.opts['ext_pillar']):
             for key, val in run.items():
                 if key not in self.ext_pillars:
                     err = ('Specified ext_pillar interface {0} is '
                            'unavailable').format(key)
                     log.critical(err)
                     continue
+                ckey, cached = self._ext_pillar_lookup(index, val, key)
+                if cached is not None:
+                    ext = cached
+                    continue
                 try:
-                    try:
-                        ext = self._external_pillar_data(pillar,
-                                                         val,
-                                                         pillar_dirs,
-                                                         key)
-                    except TypeError as exc:
-                        if str(exc).startswith('ext_pillar() takes exactly '):
-                            log.warning('Deprecation warning: ext_pillar "{0}"'
-                                        ' needs to accept minion_id as first'
-                                        ' argument'.format(key))
-                        else:
-                            raise
-
-                        ext = self._external_pillar_data(pillar,
-                                                         val,
-                                                         pillar_dirs,
-                                                         key)
+                    ext = self._ext_pillar_job(pillar, val, pillar_dirs, key)
+                    if ckey is not None:
+                        self._ext_pillar_store(ckey, ext)
                 except Exception as exc:
                     log.exception(
                             'Failed to load ext_pillar {0}: {1}'.format(
@@ -537,6 +961,70 @@ class Pillar(object):
                 ext = None
         return pillar
 
+    def ext_pillar_concurrent(self, pillar, pillar_dirs):
+        '''
+        Run the ext_pillar interfaces concurrently in a pool of
+        ext_pillar_threads threads, and merge their returns in the order of
+        the ext_pillar option. Each interface is passed the pillar built from
+        the pillar SLS files, not the returns of the previous interfaces.
+
+        An interface which does not return within its timeout is left behind,
+        and its last cached return is used if there is one.
+        '''
+        jobs = []
+        funcs = {}
+        timeouts = {}
+        ckeys = {}
+        exts = {}
+        for index, run in enumerate(self.opts['ext_pillar']):
+            for key, val in run.items():
+                if key not in self.ext_pillars:
+                    err = ('Specified ext_pillar interface {0} is '
+                           'unavailable').format(key)
+                    log.critical(err)
+                    continue
+                job = (index, key)
+                jobs.append(job)
+                ckeys[job], exts[job] = self._ext_pillar_lookup(
+                        index, val, key)
+                if exts[job] is not None:
+                    continue
+                funcs[job] = (lambda val=val, key=key: self._ext_pillar_job(
+                    pillar, val, pillar_dirs, key))
+                timeouts[job] = self._ext_pillar_setting(
+                        'ext_pillar_interface_timeout', key, 'ext_pillar_timeout')
+        results = salt.utils.threadpool.run(
+                funcs, self.opts['ext_pillar_threads'], timeouts)
+        for job in funcs:
+            key = job[1]
+            ckey = ckeys[job]
+            if job not in results:
+                log.error(
+                    'ext_pillar {0} did not return within {1} seconds'.format(
+                        key, timeouts[job]))
+                if ckey in _EXT_PILLAR_CACHE:
+                    exts[job] = deepcopy(_EXT_PILLAR_CACHE[ckey][1])
+                continue
+            ext, exc_info, duration = results[job]
+            if exc_info is not None:
+                log.error(
+                        'Failed to load ext_pillar {0}: {1}'.format(
+                            key,
+                            exc_info[1]
+                            ),
+                        exc_info=exc_info
+                        )
+                continue
+            log.debug('ext_pillar {0} took {1:.3f} seconds'.format(
+                key, duration))
+            if ckey is not None:
+                self._ext_pillar_store(ckey, ext)
+            exts[job] = ext
+        for job in jobs:
+            if exts[job]:
+                pillar = self.merge_sources(pillar, exts[job])
+        return pillar
+
     def merge_sources(self, obj_a, obj_b):
         strategy = self.merge_strategy
 
@@ -592,4 +1080,11 @@ class Pillar(object):
             for error in errors:
                 log.critical('Pillar render error: {0}'.format(error))
             pillar['_errors'] = errors
+        if self.opts.get('pillar_render_cache', False):
+            log.debug(
+                'Pillar render cache: {hits} hits, {misses} misses, '
+                '{uncacheable} uncacheable, {saved_time:.3f}s of '
+                '{render_time:.3f}s render time saved'.format(
+                    **SLS_CACHE_STATS)
+            )
         return pillar
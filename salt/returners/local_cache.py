@@ -11,10 +11,12 @@ import os
 import shutil
 import datetime
 import hashlib
+import time
 
 # Import salt libs
 import salt.payload
 import salt.utils
+import salt.utils.atomicfile
 
 log = logging.getLogger(__name__)
 
@@ -26,6 +28,10 @@ MINIONS_P = '.minions.p'
 RETURN_P = 'return.p'
 # out is the "out" from the minion data
 OUT_P = 'out.p'
+# the directory holding one file per hour listing the jids created in it
+EXPIRY_DIR = '.expiry'
+# marker set once the jobs created before the expiry buckets were picked up
+EXPIRY_SEEDED = '.seeded'
 
 
 def _job_dir():
@@ -47,10 +53,35 @@ def _jid_dir(jid):
                         jhash[2:])
 
 
+def _expiry_dir():
+    '''
+    Return the directory holding the expiry buckets
+    '''
+    return os.path.join(_job_dir(), EXPIRY_DIR)
+
+
+def _add_expiry(jid):
+    '''
+    Record the jid in the bucket of the hour it was created in, so that old
+    jobs can be found without walking the whole job cache
+    '''
+    edir = _expiry_dir()
+    if not os.path.isdir(edir):
+        try:
+            os.makedirs(edir)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+    with salt.utils.fopen(os.path.join(edir, str(jid)[:10]), 'a') as fn_:
+        fn_.write('{0}\n'.format(jid))
+
+
 def _walk_through(job_dir):
     serial = salt.payload.Serial(__opts__)
 
     for top in os.listdir(job_dir):
+        if top.startswith('.'):
+            continue
         t_path = os.path.join(job_dir, top)
 
         for final in os.listdir(t_path):
@@ -103,6 +134,7 @@ def prep_jid(nocache=False):
     if nocache:
         with salt.utils.fopen(os.path.join(jid_dir_, 'nocache'), 'w+') as fn_:
             fn_.write('')
+    _add_expiry(jid)
 
     return jid
 
@@ -258,46 +290,118 @@ def get_jids():
     return ret
 
 
+def _clean_old_jobs_walk():
+    '''
+    Walk the whole job cache, remove the old jobs and record the remaining
+    ones in the expiry buckets. Returns the number of jobs removed.
+    '''
+    deleted = 0
+    cur = datetime.datetime.now()
+    jid_root = _job_dir()
+    for top in os.listdir(jid_root):
+        if top.startswith('.'):
+            continue
+        t_path = os.path.join(jid_root, top)
+        for final in os.listdir(t_path):
+            f_path = os.path.join(t_path, final)
+            jid_file = os.path.join(f_path, 'jid')
+            if not os.path.isfile(jid_file):
+                # No jid file means corrupted cache entry, scrub it
+                shutil.rmtree(f_path)
+                continue
+            with salt.utils.fopen(jid_file, 'r') as fn_:
+                jid = fn_.read()
+            if len(jid) < 18:
+                # Invalid jid, scrub the dir
+                shutil.rmtree(f_path)
+                continue
+            # Parse the jid into a proper datetime object.
+            # We only parse down to the minute, since keep
+            # jobs is measured in hours, so a minute
+            # difference is not important.
+            try:
+                jidtime = datetime.datetime(int(jid[0:4]),
+                                            int(jid[4:6]),
+                                            int(jid[6:8]),
+                                            int(jid[8:10]),
+                                            int(jid[10:12]))
+            except ValueError:
+                # Invalid jid, scrub the dir
+                shutil.rmtree(f_path)
+                continue
+            difference = cur - jidtime
+            hours_difference = salt.utils.total_seconds(difference) / 3600.0
+            if hours_difference > __opts__['keep_jobs']:
+                shutil.rmtree(f_path)
+                deleted += 1
+            else:
+                _add_expiry(jid)
+    return deleted
+
+
 def clean_old_jobs():
     '''
     Clean out the old jobs from the job cache
+
+    Every job is recorded in the expiry bucket of the hour it was created in,
+    so only the buckets which are entirely older than ``keep_jobs`` are read
+    and only the expired jobs are touched. At most ``keep_jobs_reap_limit``
+    jobs are removed per run, the rest is left for the next run.
+
+    The first run walks the whole job cache once to pick up the jobs created
+    before the expiry buckets existed.
+
+    Returns a dict with the number of jobs deleted, the time it took and
+    whether expired jobs are still pending.
     '''
-    if __opts__['keep_jobs'] != 0:
-        cur = datetime.datetime.now()
-
-        jid_root = _job_dir()
-        if not os.path.exists(jid_root):
-            return
-
-        for top in os.listdir(jid_root):
-            t_path = os.path.join(jid_root, top)
-            for final in os.listdir(t_path):
-                f_path = os.path.join(t_path, final)
-                jid_file = os.path.join(f_path, 'jid')
-                if not os.path.isfile(jid_file):
-                    # No jid file means corrupted cache entry, scrub it
-                    shutil.rmtree(f_path)
-                else:
-                    with salt.utils.fopen(jid_file, 'r') as fn_:
-                        jid = fn_.read()
-                    if len(jid) < 18:
-                        # Invalid jid, scrub the dir
-                        shutil.rmtree(f_path)
-                    else:
-                        # Parse the jid into a proper datetime object.
-                        # We only parse down to the minute, since keep
-                        # jobs is measured in hours, so a minute
-                        # difference is not important.
-                        try:
-                            jidtime = datetime.datetime(int(jid[0:4]),
-                                                        int(jid[4:6]),
-                                                        int(jid[6:8]),
-                                                        int(jid[8:10]),
-                                                        int(jid[10:12]))
-                        except ValueError as e:
-                            # Invalid jid, scrub the dir
-                            shutil.rmtree(f_path)
-                        difference = cur - jidtime
-                        hours_difference = salt.utils.total_seconds(difference) / 3600.0
-                        if hours_difference > __opts__['keep_jobs']:
-                            shutil.rmtree(f_path)
+    ret = {'deleted': 0, 'pending': False, 'duration': 0}
+    if __opts__['keep_jobs'] == 0:
+        return ret
+    jid_root = _job_dir()
+    if not os.path.exists(jid_root):
+        return ret
+    start = time.time()
+    edir = _expiry_dir()
+    seeded = os.path.join(edir, EXPIRY_SEEDED)
+    if not os.path.isfile(seeded):
+        ret['deleted'] = _clean_old_jobs_walk()
+        if not os.path.isdir(edir):
+            os.makedirs(edir)
+        with salt.utils.fopen(seeded, 'w+') as fn_:
+            fn_.write('')
+        ret['duration'] = time.time() - start
+        return ret
+
+    limit = __opts__.get('keep_jobs_reap_limit', 0)
+    cutoff = datetime.datetime.now() - datetime.timedelta(
+            hours=__opts__['keep_jobs'])
+    for bucket in sorted(os.listdir(edir)):
+        if bucket.startswith('.'):
+            continue
+        b_path = os.path.join(edir, bucket)
+        try:
+            bucket_end = datetime.datetime.strptime(bucket, '%Y%m%d%H') + \
+                datetime.timedelta(hours=1)
+        except ValueError:
+            os.remove(b_path)
+            continue
+        if bucket_end > cutoff:
+            # The buckets are sorted, all of the remaining ones are newer
+            break
+        with salt.utils.fopen(b_path, 'r') as fn_:
+            jids = [jid.strip() for jid in fn_ if jid.strip()]
+        for idx, jid in enumerate(jids):
+            if limit and ret['deleted'] >= limit:
+                # Put the jobs we did not get to back for the next run
+                with salt.utils.atomicfile.atomic_open(b_path, 'w+') as fn_:
+                    fn_.write(''.join('{0}\n'.format(j) for j in jids[idx:]))
+                ret['pending'] = True
+                ret['duration'] = time.time() - start
+                return ret
+            f_path = _jid_dir(jid)
+            if os.path.isdir(f_path):
+                shutil.rmtree(f_path)
+                ret['deleted'] += 1
+        os.remove(b_path)
+    ret['duration'] = time.time() - start
+    return ret
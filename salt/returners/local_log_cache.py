@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+'''
+Return data to a local job cache which keeps a single append-only log file
+per job
+
+The ``local_cache`` returner creates a directory for every job and another
+one for every minion which returned, holding a ``return.p`` and an ``out.p``
+file. This returner writes the load, the expected minions and every return
+of a job as records appended to one log file instead, and keeps an index of
+the jobs started in each hour, so listing the jobs only reads the index
+files. The logs are grouped in one directory per hour, which lets old jobs
+be removed a whole hour at a time.
+
+To use it as the master job cache, set in the master config:
+
+.. code-block:: yaml
+
+    master_job_cache: local_log_cache
+'''
+
+# Import python libs
+import errno
+import logging
+import os
+import shutil
+import struct
+import time
+import datetime
+
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
+
+# Import salt libs
+import salt.payload
+import salt.utils
+import salt.utils.minions
+
+log = logging.getLogger(__name__)
+
+# Directory under the cachedir holding the job logs
+JOBS_DIR = 'jobs_log'
+# Per hour index of the jobs started in that hour
+INDEX = 'index.log'
+# Marker file, the job returns must not be cached
+NOCACHE = '.nocache'
+# Bucket used for job ids which do not carry a timestamp
+OTHER_BUCKET = 'other'
+
+# Every record is prefixed with its length
+_HEADER = struct.Struct('>I')
+
+
+def _job_dir():
+    '''
+    Return root of the jobs cache directory
+    '''
+    return os.path.join(__opts__['cachedir'], JOBS_DIR)
+
+
+def _bucket(jid):
+    '''
+    Return the name of the hour bucket for the given job id
+    '''
+    jid = str(jid)
+    if len(jid) == 20 and jid.isdigit():
+        return jid[:10]
+    return OTHER_BUCKET
+
+
+def _jid_log(jid):
+    '''
+    Return the path to the log file of the given job id
+    '''
+    jid = str(jid)
+    return os.path.join(_job_dir(), _bucket(jid), '{0}.log'.format(jid))
+
+
+def _append(path, records, create=False):
+    '''
+    Append serialized records to a log file with a single write. Raises
+    OSError with ENOENT if the file does not exist and create is False.
+    '''
+    serial = salt.payload.Serial(__opts__)
+    data = []
+    for record in records:
+        payload = serial.dumps(record)
+        data.append(_HEADER.pack(len(payload)))
+        data.append(payload)
+    flags = os.O_WRONLY | os.O_APPEND
+    if create:
+        flags |= os.O_CREAT
+    fd_ = os.open(path, flags, 0o600)
+    try:
+        if HAS_FCNTL:
+            fcntl.flock(fd_, fcntl.LOCK_EX)
+        os.write(fd_, ''.join(data))
+    finally:
+        os.close(fd_)
+
+
+def _read(path):
+    '''
+    Yield the records of a log file, a truncated record at the end of the
+    file (a write in progress) is ignored
+    '''
+    serial = salt.payload.Serial(__opts__)
+    try:
+        with salt.utils.fopen(path, 'rb') as fp_:
+            data = fp_.read()
+    except (IOError, OSError):
+        return
+    pos = 0
+    while pos + _HEADER.size <= len(data):
+        size = _HEADER.unpack_from(data, pos)[0]
+        pos += _HEADER.size
+        if pos + size > len(data):
+            break
+        try:
+            yield serial.loads(data[pos:pos + size])
+        except Exception:
+            log.error('Corrupted record in job cache log {0}'.format(path))
+            return
+        pos += size
+
+
+def _format_job_instance(job):
+    return {'Function': job.get('fun', 'unknown-function'),
+            'Arguments': list(job.get('arg', [])),
+            # unlikely but safeguard from invalid returns
+            'Target': job.get('tgt', 'unknown-target'),
+            'Target-type': job.get('tgt_type', []),
+            'User': job.get('user', 'root')}
+
+
+def _format_jid_instance(jid, job):
+    ret = _format_job_instance(job)
+    ret.update({'StartTime': salt.utils.jid_to_time(jid)})
+    return ret
+
+
+def prep_jid(nocache=False):
+    '''
+    Return a job id and create the log file for it. The log is created
+    exclusively, so a job id is never handed out twice.
+    '''
+    jid = salt.utils.gen_jid()
+    path = _jid_log(jid)
+    bucket = os.path.dirname(path)
+    if not os.path.isdir(bucket):
+        try:
+            os.makedirs(bucket)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+    try:
+        os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600))
+    except OSError:
+        # Someone else is using this jid, get a new one
+        return prep_jid(nocache=nocache)
+    if nocache:
+        with salt.utils.fopen(path + NOCACHE, 'w+') as fn_:
+            fn_.write('')
+    return jid
+
+
+def returner(load):
+    '''
+    Return data to the local job cache
+    '''
+    # if a minion is returning a standalone job, get a jobid
+    if load['jid'] == 'req':
+        load['jid'] = prep_jid(nocache=load.get('nocache', False))
+
+    path = _jid_log(load['jid'])
+    if os.path.exists(path + NOCACHE):
+        return
+
+    record = {'type': 'ret', 'id': load['id'], 'return': load['return']}
+    if 'out' in load:
+        record['out'] = load['out']
+    try:
+        _append(path, [record])
+    except OSError as exc:
+        if exc.errno == errno.ENOENT:
+            log.error(
+                'An inconsistency occurred, a job was received with a job id '
+                'that is not present in the local cache: {jid}'.format(**load)
+            )
+            return False
+        raise
+
+
+def save_load(jid, clear_load):
+    '''
+    Save the load to the specified jid
+    '''
+    path = _jid_log(jid)
+    bucket = os.path.dirname(path)
+    if not os.path.isdir(bucket):
+        try:
+            os.makedirs(bucket)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+
+    records = [{'type': 'load', 'load': clear_load}]
+    # if you have a tgt, save that for the UI etc
+    if 'tgt' in clear_load:
+        ckminions = salt.utils.minions.CkMinions(__opts__)
+        # Retrieve the minions list
+        minions = ckminions.check_minions(
+                clear_load['tgt'],
+                clear_load.get('tgt_type', 'glob')
+                )
+        records.append({'type': 'minions', 'minions': minions})
+
+    try:
+        _append(path, records, create=True)
+        job = dict((key, clear_load[key])
+                   for key in ('fun', 'arg', 'tgt', 'tgt_type', 'user')
+                   if key in clear_load)
+        job['jid'] = jid
+        _append(os.path.join(bucket, INDEX), [job], create=True)
+    except (IOError, OSError) as exc:
+        log.warning('Could not write job invocation cache file: {0}'.format(exc))
+
+
+def get_load(jid):
+    '''
+    Return the load data that marks a specified jid
+    '''
+    ret = {}
+    for record in _read(_jid_log(jid)):
+        if record.get('type') == 'load':
+            ret.update(record['load'])
+        elif record.get('type') == 'minions':
+            ret['Minions'] = record['minions']
+    return ret
+
+
+def get_jid(jid):
+    '''
+    Return the information returned when the specified job id was executed
+    '''
+    ret = {}
+    for record in _read(_jid_log(jid)):
+        if record.get('type') != 'ret':
+            continue
+        if record['id'] in ret:
+            # Minion has already returned this jid and it should be dropped
+            log.error(
+                'An extra return was detected from minion {0}, please verify '
+                'the minion, this could be a replay attack'.format(
+                    record['id']
+                )
+            )
+            continue
+        ret[record['id']] = {'return': record['return']}
+        if 'out' in record:
+            ret[record['id']]['out'] = record['out']
+    return ret
+
+
+def get_jids():
+    '''
+    Return a list of all job ids
+    '''
+    ret = {}
+    job_dir = _job_dir()
+    if not os.path.isdir(job_dir):
+        return ret
+    for bucket in os.listdir(job_dir):
+        for job in _read(os.path.join(job_dir, bucket, INDEX)):
+            ret[job['jid']] = _format_jid_instance(job['jid'], job)
+    return ret
+
+
+def _remove_logs(b_path, logs, ret, limit):
+    '''
+    Remove the given job logs of a bucket, and their nocache markers, up to
+    the reap limit. Returns False once the limit is reached.
+    '''
+    for fn_ in logs:
+        if limit and ret['deleted'] >= limit:
+            ret['pending'] = True
+            return False
+        for path in (fn_, fn_ + NOCACHE):
+            try:
+                os.remove(os.path.join(b_path, path))
+            except OSError:
+                pass
+        ret['deleted'] += 1
+    return True
+
+
+def clean_old_jobs():
+    '''
+    Clean out the old jobs from the job cache. Whole hour buckets are removed
+    once the last job they can hold is older than keep_jobs. At most
+    ``keep_jobs_reap_limit`` jobs are removed per run, the oldest first, the
+    rest is left for the next run.
+
+    Returns a dict with the number of jobs deleted, the time it took and
+    whether expired jobs are still pending.
+    '''
+    ret = {'deleted': 0, 'pending': False, 'duration': 0}
+    if __opts__['keep_jobs'] == 0:
+        return ret
+    job_dir = _job_dir()
+    if not os.path.isdir(job_dir):
+        return ret
+    start = time.time()
+    limit = __opts__.get('keep_jobs_reap_limit', 0)
+    keep = __opts__['keep_jobs'] * 3600
+    cur = datetime.datetime.now()
+    # The hour buckets sort by age, the undated jobs come last
+    for bucket in sorted(os.listdir(job_dir)):
+        b_path = os.path.join(job_dir, bucket)
+        if bucket == OTHER_BUCKET:
+            # No timestamp in these job ids, go by the age of the files
+            logs = []
+            others = []
+            for fn_ in sorted(os.listdir(b_path)):
+                try:
+                    if time.time() - os.path.getmtime(
+                            os.path.join(b_path, fn_)) <= keep:
+                        continue
+                except OSError:
+                    continue
+                if fn_.endswith('.log') and fn_ != INDEX:
+                    logs.append(fn_)
+                else:
+                    others.append(fn_)
+            if not _remove_logs(b_path, logs, ret, limit):
+                break
+            # The index and the markers left behind
+            for fn_ in others:
+                try:
+                    os.remove(os.path.join(b_path, fn_))
+                except OSError:
+                    pass
+            continue
+        try:
+            bucket_start = datetime.datetime.strptime(bucket, '%Y%m%d%H')
+        except ValueError:
+            # Not a bucket written by this returner, scrub it
+            shutil.rmtree(b_path, ignore_errors=True)
+            continue
+        bucket_end = bucket_start + datetime.timedelta(hours=1)
+        if salt.utils.total_seconds(cur - bucket_end) <= keep:
+            continue
+        logs = sorted(fn_ for fn_ in os.listdir(b_path)
+                      if fn_.endswith('.log') and fn_ != INDEX)
+        if not limit or ret['deleted'] + len(logs) <= limit:
+            shutil.rmtree(b_path, ignore_errors=True)
+            ret['deleted'] += len(logs)
+            continue
+        # Only part of the bucket fits in this run, its index keeps listing
+        # the removed jobs until the rest of the bucket goes
+        _remove_logs(b_path, logs, ret, limit)
+        break
+    ret['duration'] = time.time() - start
+    return ret
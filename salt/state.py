@@ -14,10 +14,16 @@ The data sent to the state calls is as follows:
 
 # Import python libs
 import os
+import re
 import sys
 import copy
 import site
+import json
+import errno
+import select
+import hashlib
 import fnmatch
+import threading
 import logging
 import traceback
 import datetime
@@ -27,7 +33,10 @@ import salt.utils
 import salt.loader
 import salt.minion
 import salt.pillar
+import salt.payload
+import salt.version
 import salt.fileclient
+import salt.transport
 import salt.utils.event
 import salt.syspaths as syspaths
 from salt.utils import context, immutabletypes
@@ -38,6 +47,14 @@ from salt.utils.odict import OrderedDict, DefaultOrderedDict
 
 log = logging.getLogger(__name__)
 
+# The requisites a chunk waits for when the chunks are called in parallel
+DEPENDENCIES = ('require', 'watch', 'onfail', 'onchanges')
+
+# The options which change the compiled highstate, see state_compile_cache
+COMPILE_OPTS = ('id', 'environment', 'renderer', 'state_top',
+                'state_auto_order', 'nodegroups', 'jinja_lstrip_blocks',
+                'jinja_trim_blocks')
+
 
 STATE_INTERNAL_KEYWORDS = frozenset([
     # These are keywords passed to state module functions which are to be used
@@ -207,6 +224,27 @@ def master_compile(master_opts, minion_opts, grains, id_, saltenv):
     return st_.compile_highstate()
 
 
+def file_refs(chunks):
+    '''
+    Return the salt:// files the low chunks refer to, as sets of paths by salt
+    environment
+    '''
+    refs = {}
+    for chunk in chunks:
+        saltenv = chunk.get('saltenv', chunk.get('__env__', 'base'))
+        for key, val in chunk.items():
+            if key.startswith('__'):
+                continue
+            if not isinstance(val, list):
+                val = [val]
+            for comp in val:
+                if not isinstance(comp, string_types):
+                    continue
+                if comp.startswith('salt://') and '?' not in comp:
+                    refs.setdefault(saltenv, set()).add(comp)
+    return refs
+
+
 def ishashable(obj):
     try:
         hash(obj)
@@ -222,6 +260,66 @@ class StateError(Exception):
     pass
 
 
+class RequisiteIndex(object):
+    '''
+    Find the chunks a requisite refers to without matching the requisite
+    against every chunk. The chunks are indexed by name, id and sls, glob
+    requisites are compiled once and matched against the distinct names, ids
+    and sls files, and the chunks found for a requisite are remembered.
+    '''
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.size = len(chunks)
+        self.names = {}
+        self.ids = {}
+        self.sls = {}
+        self.found = {}
+        for pos, chunk in enumerate(chunks):
+            self.names.setdefault(
+                    os.path.normcase(chunk['name']), []).append(pos)
+            self.ids.setdefault(
+                    os.path.normcase(chunk['__id__']), []).append(pos)
+            if '__sls__' in chunk:
+                self.sls.setdefault(
+                        os.path.normcase(chunk['__sls__']), []).append(pos)
+
+    def _match(self, index, pattern):
+        '''
+        Return the positions of the chunks whose key in the index matches
+        the pattern
+        '''
+        if not isinstance(pattern, string_types) \
+                or not any(char in pattern for char in '*?['):
+            return index.get(pattern, [])
+        match = re.compile(fnmatch.translate(pattern)).match
+        ret = []
+        for key, positions in index.iteritems():
+            if isinstance(key, string_types) and match(key):
+                ret.extend(positions)
+        return ret
+
+    def find(self, req_key, req_val):
+        '''
+        Return the chunks the requisite refers to, in the order of the chunks.
+        A chunk is found if its state is req_key and its name or id matches
+        req_val, or for sls requisites if its sls file matches req_val and
+        its name and id do not.
+        '''
+        key = (req_key, req_val)
+        if key not in self.found:
+            pattern = os.path.normcase(req_val)
+            named = set(self._match(self.names, pattern))
+            named.update(self._match(self.ids, pattern))
+            if req_key == 'sls':
+                positions = [pos for pos in self._match(self.sls, pattern)
+                             if pos not in named]
+            else:
+                positions = [pos for pos in named
+                             if self.chunks[pos]['state'] == req_key]
+            self.found[key] = [self.chunks[pos] for pos in sorted(positions)]
+        return self.found[key]
+
+
 class Compiler(object):
     '''
     Class used to compile and manage the High Data structure
@@ -565,6 +663,7 @@ class State(object):
         self.active = set()
         self.mod_init = set()
         self.pre = {}
+        self.req_index = None
         self.__run_num = 0
         self.jid = jid
 
@@ -618,6 +717,17 @@ class State(object):
                     log.error('Failed to execute aggregate for state {0}'.format(low['state']))
         return low
 
+    def _requisite_index(self, chunks):
+        '''
+        Return the requisite index of the chunks, it is built once for each
+        list of chunks
+        '''
+        if (self.req_index is None
+                or self.req_index.chunks is not chunks
+                or self.req_index.size != len(chunks)):
+            self.req_index = RequisiteIndex(chunks)
+        return self.req_index
+
     def _run_check(self, low_data):
         '''
         Check that unless doesn't return 0, and that onlyif returns a 0.
@@ -1570,6 +1680,9 @@ class State(object):
         '''
         Iterate over a list of chunks and call them, checking for requires.
         '''
+        self.req_index = RequisiteIndex(chunks)
+        if self.opts.get('state_workers', 0) > 0 and hasattr(os, 'fork'):
+            return self.call_chunks_parallel(chunks)
         running = {}
         for low in chunks:
             if '__FAILHARD__' in running:
@@ -1583,6 +1696,211 @@ class State(object):
             self.active = set()
         return running
 
+    def call_chunks_parallel(self, chunks):
+        '''
+        Call the chunks in up to state_workers forked processes at the same
+        time. A chunk starts once the chunks it requires have run, and never
+        before a chunk which comes before it in the run. The chunks which
+        have to run on their own, or whose requisites are not met, are called
+        in this process once the forked ones are done.
+        '''
+        running = {}
+        index = self._requisite_index(chunks)
+        aggregate = self.functions['config.option']('state_aggregate')
+        order = self._run_order(chunks)
+        workers = {}
+        forked = set()
+        pos = numbered = 0
+        while pos < len(order) or workers:
+            while pos < len(order) and len(workers) < self.opts['state_workers']:
+                low = order[pos]
+                tag = _gen_tag(low)
+                if tag in running:
+                    pos += 1
+                    continue
+                if self._serial_chunk(low, aggregate):
+                    break
+                reqs = self._requisite_chunks(low, index)
+                if reqs is None \
+                        or any(_gen_tag(req) not in running for req in reqs):
+                    break
+                if self.check_requisite(low, running, chunks, True) \
+                        not in ('met', 'change'):
+                    break
+                self._mod_init(low)
+                pid, rfd = self._fork_chunk(low, running, chunks)
+                workers[rfd] = (pid, low, [])
+                forked.add(tag)
+                pos += 1
+            if workers:
+                self._collect_chunks(workers, running)
+            else:
+                low = order[pos]
+                pos += 1
+                if _gen_tag(low) not in running:
+                    running = self.call_chunk(low, running, chunks)
+                    if '__FAILHARD__' in running:
+                        running.pop('__FAILHARD__')
+                        return running
+                    if self.check_failhard(low, running):
+                        return running
+                self.active = set()
+            # Number the returns of the forked chunks in the order of the run
+            while numbered < pos:
+                tag = _gen_tag(order[numbered])
+                if tag not in running:
+                    break
+                if tag in forked:
+                    running[tag]['__run_num__'] = self.__run_num
+                    self.__run_num += 1
+                    self.event(running[tag], len(chunks))
+                numbered += 1
+        return running
+
+    def _requisite_chunks(self, low, index):
+        '''
+        Return the chunks the low chunk waits for when the chunks are called
+        in parallel, or None if one of its requisites is not found
+        '''
+        ret = []
+        for requisite in ('require', 'watch', 'prereq', 'onfail', 'onchanges',
+                          'prerequired'):
+            for req in low.get(requisite) or []:
+                req = trim_req(req)
+                req_key = next(iter(req))
+                if req[req_key] is None:
+                    return None
+                found = index.find(req_key, req[req_key])
+                if not found:
+                    return None
+                if requisite in DEPENDENCIES:
+                    ret.extend(found)
+        return ret
+
+    def _run_order(self, chunks):
+        '''
+        Return the chunks in the order call_chunks calls them, the chunks a
+        chunk requires come before it unless one of its requisites is not
+        found. The prereqs are left to call_chunk.
+        '''
+        index = self._requisite_index(chunks)
+        order = []
+        seen = set()
+        for chunk in chunks:
+            if id(chunk) in seen:
+                continue
+            seen.add(id(chunk))
+            stack = [(chunk, iter(self._requisite_chunks(chunk, index) or []))]
+            while stack:
+                low, reqs = stack[-1]
+                for req in reqs:
+                    if id(req) not in seen:
+                        seen.add(id(req))
+                        stack.append(
+                            (req, iter(self._requisite_chunks(req, index) or [])))
+                        break
+                else:
+                    stack.pop()
+                    order.append(low)
+        return order
+
+    def _serial_chunk(self, low, aggregate):
+        '''
+        Return True if the chunk has to run on its own when the chunks are
+        called in parallel: it can stop the run, takes part in a prereq,
+        aggregates other chunks or can reload the modules
+        '''
+        if low.get('failhard', False) or self.opts['failhard']:
+            return True
+        for key in ('prereq', 'prerequired', '__prereq__', 'provider'):
+            if key in low:
+                return True
+        if low.get('reload_modules', False) is True:
+            return True
+        if aggregate is True or low.get('aggregate') is True:
+            return True
+        if low['state'] in ('pkg', 'ports'):
+            return True
+        if low['state'] == 'file':
+            return low['fun'] in ('recurse', 'symlink') or (
+                low['fun'] == 'managed' and low['name'].endswith(
+                    ('.py', '.pyx', '.pyo', '.pyc', '.so')))
+        return False
+
+    def _fork_chunk(self, low, running, chunks):
+        '''
+        Call the chunk in a forked process, returns the pid of the process and
+        the pipe its running data is read from
+        '''
+        rfd, wfd = os.pipe()
+        pid = os.fork()
+        if pid:
+            os.close(wfd)
+            return pid, rfd
+        try:
+            os.close(rfd)
+            tag = _gen_tag(low)
+            serial = salt.payload.Serial(self.opts)
+            # The events are fired in the order of the run by the parent
+            self.opts['state_events'] = False
+            try:
+                before = set(running)
+                running = self.call_chunk(low, running, chunks)
+                data = serial.dumps(
+                        dict((key, val) for key, val in running.items()
+                             if key not in before))
+            except Exception:
+                data = serial.dumps({tag: {
+                    'result': False,
+                    'name': low['name'],
+                    'changes': {},
+                    'comment': 'An exception occurred in this state: {0}'.format(
+                        traceback.format_exc()),
+                    '__run_num__': 0,
+                    '__sls__': low.get('__sls__')}})
+            with os.fdopen(wfd, 'wb') as fp_:
+                fp_.write(data)
+        finally:
+            os._exit(0)
+
+    def _collect_chunks(self, workers, running):
+        '''
+        Read the running data of the forked chunks until one of them is done
+        '''
+        while True:
+            try:
+                readable = select.select(list(workers), [], [])[0]
+            except select.error as exc:
+                if exc.args[0] == errno.EINTR:
+                    continue
+                raise
+            done = False
+            for rfd in readable:
+                data = os.read(rfd, 65536)
+                if data:
+                    workers[rfd][2].append(data)
+                    continue
+                pid, low, parts = workers.pop(rfd)
+                os.close(rfd)
+                os.waitpid(pid, 0)
+                tag = _gen_tag(low)
+                ret = {}
+                if parts:
+                    ret = salt.payload.Serial(self.opts).loads(''.join(parts))
+                if tag not in ret:
+                    ret[tag] = {
+                        'result': False,
+                        'name': low['name'],
+                        'changes': {},
+                        'comment': 'The process calling the state exited '
+                                   'without a return',
+                        '__run_num__': 0,
+                        '__sls__': low.get('__sls__')}
+                running.update(ret)
+                done = True
+            if done:
+                return
+
     def check_failhard(self, low, running):
         '''
         Check if the low data chunk should send a failhard signal
@@ -1628,28 +1946,19 @@ class State(object):
                 'onchanges': []}
         if pre:
             reqs['prerequired'] = []
+        index = self._requisite_index(chunks)
         for r_state in reqs:
             if r_state in low and low[r_state] is not None:
                 for req in low[r_state]:
                     req = trim_req(req)
-                    found = False
-                    for chunk in chunks:
-                        req_key = next(iter(req))
-                        req_val = req[req_key]
-                        if req_val is None:
-                            continue
-                        if (fnmatch.fnmatch(chunk['name'], req_val) or
-                            fnmatch.fnmatch(chunk['__id__'], req_val)):
-                            if chunk['state'] == req_key:
-                                found = True
-                                reqs[r_state].append(chunk)
-                        elif req_key == 'sls':
-                            # Allow requisite tracking of entire sls files
-                            if fnmatch.fnmatch(chunk['__sls__'], req_val):
-                                found = True
-                                reqs[r_state].append(chunk)
+                    req_key = next(iter(req))
+                    req_val = req[req_key]
+                    if req_val is None:
+                        return 'unmet'
+                    found = index.find(req_key, req_val)
                     if not found:
                         return 'unmet'
+                    reqs[r_state].extend(found)
         fun_stats = set()
         for r_state, chunks in reqs.items():
             if r_state == 'prereq':
@@ -1727,34 +2036,24 @@ class State(object):
         if status == 'unmet':
             lost = {}
             reqs = []
+            index = self._requisite_index(chunks)
             for requisite in requisites:
                 lost[requisite] = []
                 if requisite not in low:
                     continue
                 for req in low[requisite]:
                     req = trim_req(req)
-                    found = False
-                    for chunk in chunks:
-                        req_key = next(iter(req))
-                        req_val = req[req_key]
-                        if req_val is None:
-                            continue
-                        if (fnmatch.fnmatch(chunk['name'], req_val) or
-                            fnmatch.fnmatch(chunk['__id__'], req_val)):
-                            if chunk['state'] == req_key:
-                                if requisite == 'prereq':
-                                    chunk['__prereq__'] = True
-                                elif requisite == 'prerequired':
-                                    chunk['__prerequired__'] = True
-                                reqs.append(chunk)
-                                found = True
-                        elif req_key == 'sls':
-                            # Allow requisite tracking of entire sls files
-                            if fnmatch.fnmatch(chunk['__sls__'], req_val):
-                                if requisite == 'prereq':
-                                    chunk['__prereq__'] = True
-                                reqs.append(chunk)
-                                found = True
+                    req_key = next(iter(req))
+                    req_val = req[req_key]
+                    found = []
+                    if req_val is not None:
+                        found = index.find(req_key, req_val)
+                    for chunk in found:
+                        if requisite == 'prereq':
+                            chunk['__prereq__'] = True
+                        elif requisite == 'prerequired' and req_key != 'sls':
+                            chunk['__prerequired__'] = True
+                    reqs.extend(found)
                     if not found:
                         lost[requisite].append(req)
             if lost['require'] or lost['watch'] or lost['prereq'] or lost['onfail'] or lost['onchanges'] or lost.get('prerequired'):
@@ -1922,29 +2221,90 @@ class State(object):
         '''
         Process a high data call and ensure the defined states.
         '''
+        chunks, errors = self.compile_high(high)
+        if errors:
+            return errors
+        return self.call_compiled(chunks)
+
+    def compile_high(self, high):
+        '''
+        Compile the high data into the ordered low chunks, return the chunks
+        and the errors
+        '''
         errors = []
         # If there is extension data reconcile it
         high, ext_errors = self.reconcile_extend(high)
         errors += ext_errors
         errors += self.verify_high(high)
         if errors:
-            return errors
+            return [], errors
         high, req_in_errors = self.requisite_in(high)
         errors += req_in_errors
         high = self.apply_exclude(high)
         # Verify that the high data is structurally sound
         if errors:
-            return errors
+            return [], errors
         # Compile and verify the raw chunks
-        chunks = self.compile_high_data(high)
-        # If there are extensions in the highstate, process them and update
-        # the low data chunks
-        if errors:
-            return errors
-        ret = self.call_chunks(chunks)
-        ret = self.call_listen(chunks, ret)
+        return self.compile_high_data(high), errors
+
+    def call_compiled(self, chunks):
+        '''
+        Call the compiled low chunks and their listeners
+        '''
+        hashes = {}
+        if self.opts.get('state_prefetch_files', 0) > 0 \
+                and self.opts.get('file_client') == 'remote':
+            hashes = self.prefetch_files(chunks)
+        with salt.fileclient.known_hashes(hashes):
+            ret = self.call_chunks(chunks)
+            ret = self.call_listen(chunks, ret)
         return ret
 
+    def prefetch_files(self, chunks):
+        '''
+        Ask the master for the hashes of the salt:// files the chunks refer to
+        in one request per salt environment and download the changed ones in
+        parallel, return the hashes by (saltenv, path)
+        '''
+        if 'cp.fileclient' not in self.state_con:
+            # The states fetch their files with the client of the cp module
+            self.state_con['cp.fileclient'] = \
+                    salt.fileclient.get_file_client(self.opts)
+        client = self.state_con['cp.fileclient']
+        hashes = {}
+        for saltenv, paths in file_refs(chunks).items():
+            for path, hsum in client.hash_files(sorted(paths), saltenv).items():
+                # Directories and missing files have no hash
+                if hsum:
+                    hashes[(saltenv, path)] = hsum
+        queue = sorted(hashes, reverse=True)
+
+        def fetch():
+            while queue:
+                try:
+                    saltenv, path = queue.pop()
+                except IndexError:
+                    return
+                try:
+                    client.cache_file(path, saltenv)
+                except Exception as exc:
+                    # The state fetching the file reports the error
+                    log.debug('Unable to prefetch {0}: {1}'.format(path, exc))
+
+        # The cached copies are checked against the hashes of the master
+        with salt.fileclient.known_hashes(hashes):
+            threads = []
+            for _ in range(min(self.opts['state_prefetch_files'], len(queue))):
+                threads.append(threading.Thread(target=fetch))
+                threads[-1].start()
+            for thread in threads:
+                thread.join()
+        # The connections of the fetch threads are not used again
+        salt.transport.ZeroMQChannel.clear_thread_sreqs(
+                [thread.name for thread in threads])
+        log.debug('Prefetched {0} files'.format(len(hashes)))
+        return hashes
+
     def render_template(self, high, template):
         errors = []
         if not high:
@@ -2713,6 +3073,99 @@ class BaseHighState(object):
             return False
         return True
 
+    def _compile_key(self, exclude, whitelist):
+        '''
+        Return the digest of the inputs of the highstate compilation other
+        than the state files: the pillar, the grains, the available states and
+        the options used by the renderers and the compiler. Returns None if
+        they hold byte strings which are not UTF-8, the highstate is then
+        compiled without the cache.
+        '''
+        data = [salt.version.__version__,
+                exclude,
+                whitelist,
+                self.avail,
+                self.opts['grains'],
+                self.state.opts['pillar']]
+        for opt in COMPILE_OPTS:
+            data.append(self.opts.get(opt))
+        try:
+            data = json.dumps(data, sort_keys=True, default=repr)
+        except UnicodeDecodeError:
+            log.debug('The pillar or the grains hold non UTF-8 byte strings, '
+                      'not using the compile cache')
+            return None
+        return hashlib.sha256(data).hexdigest()
+
+    def _load_compiled(self, cfn, exclude, whitelist, force=False):
+        '''
+        Return the low chunks of the compile cache if none of the inputs of
+        their compilation changed, or None
+        '''
+        if not os.path.isfile(cfn):
+            return None
+        key = self._compile_key(exclude, whitelist)
+        if key is None:
+            return None
+        try:
+            with salt.utils.fopen(cfn, 'rb') as fp_:
+                compiled = self.serial.load(fp_)
+        except Exception as exc:
+            log.debug('Unable to read the compile cache {0}: {1}'.format(
+                cfn, exc))
+            return None
+        if not isinstance(compiled, dict) or compiled.get('key') != key:
+            return None
+        files = {}
+        for saltenv, path, hsum in compiled['files']:
+            files.setdefault(saltenv, {})[path] = hsum
+        for saltenv in files:
+            hashes = self.client.hash_files(sorted(files[saltenv]), saltenv)
+            if hashes != files[saltenv]:
+                log.debug('The {0} files changed, compiling the '
+                          'highstate'.format(saltenv))
+                return None
+        # Syncing the dynamic modules may change the grains and the pillar
+        self.load_dynamic(compiled['matches'])
+        if self._compile_key(exclude, whitelist) != key:
+            return None
+        if not self._check_pillar(force):
+            return None
+        log.debug('Running the compiled highstate from {0}'.format(cfn))
+        return compiled['chunks']
+
+    def _store_compiled(self, cfn, exclude, whitelist, files, matches, chunks):
+        '''
+        Store the low chunks in the compile cache with the hashes of the
+        salt:// files fetched to compile them
+        '''
+        key = self._compile_key(exclude, whitelist)
+        if key is None:
+            return
+        paths = {}
+        for saltenv, path in files:
+            paths.setdefault(saltenv, []).append(path)
+        hashes = []
+        for saltenv in sorted(paths):
+            ret = self.client.hash_files(sorted(paths[saltenv]), saltenv)
+            for path in sorted(ret):
+                hashes.append([saltenv, path, ret[path]])
+        compiled = {'key': key,
+                    'files': hashes,
+                    'matches': matches,
+                    'chunks': chunks}
+        cumask = os.umask(077)
+        try:
+            with salt.utils.fopen(cfn, 'w+b') as fp_:
+                self.serial.dump(compiled, fp_)
+        except TypeError:
+            # Can't serialize pydsl
+            os.remove(cfn)
+        except (IOError, OSError):
+            log.error('Unable to write the compile cache {0}'.format(cfn))
+        finally:
+            os.umask(cumask)
+
     def matches_whitelist(self, matches, whitelist):
         '''
         Reads over the matches and returns a matches dict with just the ones
@@ -2754,38 +3207,48 @@ class BaseHighState(object):
                 with salt.utils.fopen(cfn, 'rb') as fp_:
                     high = self.serial.load(fp_)
                     return self.state.call_high(high)
+        compile_cache = self.opts.get('state_compile_cache', False)
+        if compile_cache:
+            ccfn = os.path.join(
+                    self.opts['cachedir'],
+                    '{0}.compiled.p'.format(cache_name)
+            )
+            chunks = self._load_compiled(ccfn, exclude, whitelist, force)
+            if chunks is not None:
+                return self.state.call_compiled(chunks)
         # File exists so continue
         err = []
-        try:
-            top = self.get_top()
-        except SaltRenderError as err:
-            ret[tag_name]['comment'] = err.error
-            return ret
-        except Exception:
-            trb = traceback.format_exc()
-            err.append(trb)
-            return err
-        err += self.verify_tops(top)
-        matches = self.top_matches(top)
-        if not matches:
-            msg = ('No Top file or external nodes data matches found')
-            ret[tag_name]['comment'] = msg
-            return ret
-        matches = self.matches_whitelist(matches, whitelist)
-        self.load_dynamic(matches)
-        if not self._check_pillar(force):
-            err += ['Pillar failed to render with the following messages:']
-            err += self.state.opts['pillar']['_errors']
-        else:
-            high, errors = self.render_highstate(matches)
-            if exclude:
-                if isinstance(exclude, str):
-                    exclude = exclude.split(',')
-                if '__exclude__' in high:
-                    high['__exclude__'].extend(exclude)
-                else:
-                    high['__exclude__'] = exclude
-            err += errors
+        with salt.fileclient.record_files() as files:
+            try:
+                top = self.get_top()
+            except SaltRenderError as err:
+                ret[tag_name]['comment'] = err.error
+                return ret
+            except Exception:
+                trb = traceback.format_exc()
+                err.append(trb)
+                return err
+            err += self.verify_tops(top)
+            matches = self.top_matches(top)
+            if not matches:
+                msg = ('No Top file or external nodes data matches found')
+                ret[tag_name]['comment'] = msg
+                return ret
+            matches = self.matches_whitelist(matches, whitelist)
+            self.load_dynamic(matches)
+            if not self._check_pillar(force):
+                err += ['Pillar failed to render with the following messages:']
+                err += self.state.opts['pillar']['_errors']
+            else:
+                high, errors = self.render_highstate(matches)
+                if exclude:
+                    if isinstance(exclude, str):
+                        exclude = exclude.split(',')
+                    if '__exclude__' in high:
+                        high['__exclude__'].extend(exclude)
+                    else:
+                        high['__exclude__'] = exclude
+                err += errors
         if err:
             return err
         if not high:
@@ -2806,7 +3269,13 @@ class BaseHighState(object):
             log.error(msg.format(cfn))
 
         os.umask(cumask)
-        return self.state.call_high(high)
+        if not compile_cache:
+            return self.state.call_high(high)
+        chunks, errors = self.state.compile_high(high)
+        if errors:
+            return errors
+        self._store_compiled(ccfn, exclude, whitelist, files, matches, chunks)
+        return self.state.call_compiled(chunks)
 
     def compile_highstate(self):
         '''
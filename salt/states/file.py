@@ -246,6 +246,7 @@ import yaml
 # Import salt libs
 import salt.utils
 import salt.utils.templates
+import salt.fileclient
 from salt.exceptions import CommandExecutionError
 from salt.utils.serializers import yaml as yaml_serializer
 from salt.utils.serializers import json as json_serializer
@@ -2173,51 +2174,56 @@ def recurse(name,
         #we're searching for things that start with this *directory*.
         # use '/' since #master only runs on POSIX
         srcpath = srcpath + '/'
-    fns_ = __salt__['cp.list_master'](__env__, srcpath)
+    # The manifest lists the files with their hashes, the files already in
+    # the minion cache are then not hashed on the master one at a time
+    manifest = __salt__['cp.file_manifest'](__env__, srcpath)
+    fns_ = sorted(manifest)
     # If we are instructed to keep symlinks, then process them.
     if keep_symlinks:
         # Make this global so that emptydirs can use it if needed.
         symlinks = __salt__['cp.list_master_symlinks'](__env__, srcpath)
         fns_ = process_symlinks(fns_, symlinks)
-    for fn_ in fns_:
-        if not fn_.strip():
-            continue
+    hashes = salt.fileclient.manifest_hashes(manifest, __env__, 'salt://|')
+    with salt.fileclient.known_hashes(hashes):
+        for fn_ in fns_:
+            if not fn_.strip():
+                continue
 
-        # fn_ here is the absolute (from file_roots) source path of
-        # the file to copy from; it is either a normal file or an
-        # empty dir(if include_empty==true).
+            # fn_ here is the absolute (from file_roots) source path of
+            # the file to copy from; it is either a normal file or an
+            # empty dir(if include_empty==true).
 
-        relname = os.path.relpath(fn_, srcpath)
-        if relname.startswith('..'):
-            continue
-
-        # Check for maxdepth of the relative path
-        if maxdepth is not None:
-            # Since paths are all master, just use POSIX separator
-            relpieces = relname.split('/')
-            # Handle empty directories (include_empty==true) by removing the
-            # the last piece if it is an empty string
-            if not relpieces[-1]:
-                relpieces = relpieces[:-1]
-            if len(relpieces) > maxdepth + 1:
+            relname = os.path.relpath(fn_, srcpath)
+            if relname.startswith('..'):
                 continue
 
-        #- Check if it is to be excluded. Match only part of the path
-        # relative to the target directory
-        if not salt.utils.check_include_exclude(
-                relname, include_pat, exclude_pat):
-            continue
-        dest = os.path.join(name, relname)
-        dirname = os.path.dirname(dest)
-        keep.add(dest)
+            # Check for maxdepth of the relative path
+            if maxdepth is not None:
+                # Since paths are all master, just use POSIX separator
+                relpieces = relname.split('/')
+                # Handle empty directories (include_empty==true) by removing
+                # the the last piece if it is an empty string
+                if not relpieces[-1]:
+                    relpieces = relpieces[:-1]
+                if len(relpieces) > maxdepth + 1:
+                    continue
+
+            #- Check if it is to be excluded. Match only part of the path
+            # relative to the target directory
+            if not salt.utils.check_include_exclude(
+                    relname, include_pat, exclude_pat):
+                continue
+            dest = os.path.join(name, relname)
+            dirname = os.path.dirname(dest)
+            keep.add(dest)
 
-        if dirname not in vdir:
-            # verify the directory perms if they are set
-            manage_directory(dirname)
-            vdir.add(dirname)
+            if dirname not in vdir:
+                # verify the directory perms if they are set
+                manage_directory(dirname)
+                vdir.add(dirname)
 
-        src = 'salt://{0}'.format(fn_)
-        manage_file(dest, src)
+            src = 'salt://{0}'.format(fn_)
+            manage_file(dest, src)
 
     if include_empty:
         mdirs = __salt__['cp.list_master_dirs'](__env__, srcpath)
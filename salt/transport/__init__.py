@@ -175,6 +175,17 @@ class ZeroMQChannel(Channel):
 
         return ZeroMQChannel.sreq_cache[key]
 
+    @classmethod
+    def clear_thread_sreqs(cls, names):
+        '''
+        Destroy the cached connections of the named threads of this process,
+        once these threads are done
+        '''
+        pid = os.getpid()
+        for key in cls.sreq_cache.keys():
+            if key[1] == pid and key[2] in names:
+                cls.sreq_cache.pop(key).destroy()
+
     def __init__(self, opts, **kwargs):
         self.opts = opts
         self.ttype = 'zeromq'
@@ -195,6 +206,9 @@ class ZeroMQChannel(Channel):
 
     def crypted_transfer_decode_dictentry(self, load, dictkey=None, tries=3, timeout=60):
         ret = self.sreq.send('aes', self.auth.crypticle.dumps(load), tries, timeout)
+        if isinstance(ret, dict) and dictkey not in ret:
+            # Nothing was encrypted for us, e.g. the master is busy
+            return ret
         key = self.auth.get_keys()
         aes = key.private_decrypt(ret['key'], 4)
         pcrypt = salt.crypt.Crypticle(self.opts, aes)
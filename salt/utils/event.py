@@ -58,7 +58,7 @@ import time
 import datetime
 import multiprocessing
 from multiprocessing import Process
-from collections import MutableMapping
+from collections import MutableMapping, deque
 
 # Import third party libs
 try:
@@ -108,7 +108,7 @@ def get_event(node, sock_dir=None, transport='zeromq', opts=None, listen=True):
     '''
     if transport == 'zeromq':
         if node == 'master':
-            return MasterEvent(sock_dir or opts.get('sock_dir', None))
+            return MasterEvent(sock_dir or opts.get('sock_dir', None), opts)
         return SaltEvent(node, sock_dir, opts)
     elif transport == 'raet':
         import salt.utils.raetevent
@@ -138,6 +138,151 @@ def tagify(suffix='', prefix='', base=SALT):
     return TAGPARTER.join([part for part in parts if part])
 
 
+class _TrieNode(object):
+    '''
+    A node in the SubscriptionRegistry prefix trie
+    '''
+    __slots__ = ('children', 'queue')
+
+    def __init__(self):
+        self.children = {}
+        self.queue = None
+
+
+class SubscriptionRegistry(object):
+    '''
+    Hold the events waiting to be picked up by get_event, one bounded queue
+    per subscribed tag prefix.
+
+    The subscribed prefixes are kept in a character trie, so an incoming event
+    is routed by walking its tag once and appending it to the queue of every
+    subscribed prefix found on the way. An event routed to several queues is
+    shared between them and consumed only once.
+    '''
+    def __init__(self, maxlen=10000):
+        self.maxlen = maxlen
+        self.root = _TrieNode()
+        self.prefixes = set()
+        self.seq = 0
+
+    def _node(self, prefix, create=False):
+        node = self.root
+        for char in prefix:
+            child = node.children.get(char)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[char] = _TrieNode()
+            node = child
+        return node
+
+    def _subtree_queues(self, node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.queue is not None:
+                yield node.queue
+            stack.extend(node.children.values())
+
+    def subscribe(self, prefix):
+        '''
+        Start keeping the events whose tag starts with prefix. Events already
+        held for other prefixes which match are carried over.
+        '''
+        if prefix in self.prefixes:
+            return
+        entries = {}
+        # Events held for a shorter prefix may match the new one
+        node = self.root
+        for char in prefix:
+            if node.queue is not None:
+                for entry in node.queue:
+                    if not entry[2] and entry[1]['tag'].startswith(prefix):
+                        entries[entry[0]] = entry
+            node = node.children.get(char)
+            if node is None:
+                break
+        node = self._node(prefix, create=True)
+        # Events held for a longer prefix all match the new one
+        for queue in self._subtree_queues(node):
+            for entry in queue:
+                if not entry[2]:
+                    entries[entry[0]] = entry
+        node.queue = deque(
+            (entries[seq] for seq in sorted(entries)[-self.maxlen:]),
+            self.maxlen)
+        self.prefixes.add(prefix)
+
+    def unsubscribe(self, prefix):
+        '''
+        Stop keeping the events for prefix, the events only held for it are
+        dropped
+        '''
+        if prefix not in self.prefixes:
+            return
+        self.prefixes.discard(prefix)
+        path = [self.root]
+        for char in prefix:
+            path.append(path[-1].children[char])
+        path[-1].queue = None
+        # Prune the branch which no longer leads to a subscription
+        for idx in range(len(prefix), 0, -1):
+            node = path[idx]
+            if node.queue is not None or node.children:
+                break
+            del path[idx - 1].children[prefix[idx - 1]]
+
+    def retain(self, prefixes):
+        '''
+        Make the passed prefixes the only subscriptions
+        '''
+        prefixes = set(prefixes)
+        for prefix in self.prefixes.difference(prefixes):
+            self.unsubscribe(prefix)
+        for prefix in prefixes:
+            self.subscribe(prefix)
+
+    def route(self, event):
+        '''
+        Queue the event for every subscribed prefix of its tag, returns False
+        if nobody is subscribed to it
+        '''
+        self.seq += 1
+        entry = [self.seq, event, False]
+        routed = False
+        node = self.root
+        tag = event['tag']
+        idx = 0
+        while node is not None:
+            if node.queue is not None:
+                if len(node.queue) == self.maxlen:
+                    log.warning(
+                        'Dropping the oldest pending event for tag prefix '
+                        '{0!r}, the queue is full'.format(tag[:idx]))
+                node.queue.append(entry)
+                routed = True
+            if idx == len(tag):
+                break
+            node = node.children.get(tag[idx])
+            idx += 1
+        return routed
+
+    def pop(self, prefix):
+        '''
+        Return the oldest pending event for a subscribed prefix, or None
+        '''
+        node = self._node(prefix)
+        if node is None or node.queue is None:
+            return None
+        queue = node.queue
+        while queue:
+            entry = queue.popleft()
+            if not entry[2]:
+                entry[2] = True
+                return entry[1]
+        return None
+
+
 class SaltEvent(object):
     '''
     The base class used to manage salt events
@@ -154,7 +299,8 @@ class SaltEvent(object):
         if sock_dir is None:
             sock_dir = opts.get('sock_dir', None)
         self.puburi, self.pulluri = self.__load_uri(sock_dir, node)
-        self.pending_events = []
+        self.pending_events = SubscriptionRegistry(
+                opts.get('max_pending_events', 10000))
 
     def __load_uri(self, sock_dir, node):
         '''
@@ -259,7 +405,10 @@ class SaltEvent(object):
         return mtag, data
 
     def _check_pending(self, tag, pending_tags):
-        """Check the pending_events list for events that match the tag
+        """Check the pending events for an event that matches the tag
+
+        The tag and the pending_tags become the only subscriptions of the
+        pending events registry, events held for any other tag are dropped.
 
         :param tag: The tag to search for
         :type tag: str
@@ -267,18 +416,8 @@ class SaltEvent(object):
         :type pending_tags: list[str]
         :return:
         """
-        old_events = self.pending_events
-        self.pending_events = []
-        ret = None
-        for evt in old_events:
-            if evt['tag'].startswith(tag):
-                if ret is None:
-                    ret = evt
-                else:
-                    self.pending_events.append(evt)
-            elif any(evt['tag'].startswith(ptag) for ptag in pending_tags):
-                self.pending_events.append(evt)
-        return ret
+        self.pending_events.retain([tag] + list(pending_tags))
+        return self.pending_events.pop(tag)
 
     def _get_event(self, wait, tag, pending_tags):
         start = time.time()
@@ -298,12 +437,13 @@ class SaltEvent(object):
                 else:
                     raise
 
-            if not ret['tag'].startswith(tag):  # tag not match
-                if any(ret['tag'].startswith(ptag) for ptag in pending_tags):
-                    self.pending_events.append(ret)
+            # Queue the event for the tag and the pending tags it matches
+            if not self.pending_events.route(ret) or \
+                    not ret['tag'].startswith(tag):  # tag not match
                 wait = timeout_at - time.time()
                 continue
 
+            ret = self.pending_events.pop(tag)
             log.trace('get_event() received = {0}'.format(ret))
             return ret
 
@@ -320,14 +460,15 @@ class SaltEvent(object):
         New in Boron always checks the list of pending events
 
         use_pending
-            Defines whether to keep all unconsumed events in a pending_events
-            list, or to discard events that don't match the requested tag.  If
-            set to True, MAY CAUSE MEMORY LEAKS.
+            Defines whether to keep all unconsumed events pending, or to
+            discard events that don't match the requested tag. The pending
+            events are held in a queue bounded by the ``max_pending_events``
+            option, the oldest events are dropped once it is full.
 
         pending_tags
-            Add any events matching the listed tags to the pending queue.
-            Still MAY CAUSE MEMORY LEAKS but less likely than use_pending
-            assuming you later get_event for the tags you've listed here
+            Add any events matching the listed tags to the pending queues,
+            one bounded queue per tag. Events pending for tags which are not
+            passed on the next call are dropped.
 
             New in Boron
         '''
@@ -487,8 +628,8 @@ class MasterEvent(SaltEvent):
     '''
     Create a master event management object
     '''
-    def __init__(self, sock_dir):
-        super(MasterEvent, self).__init__('master', sock_dir)
+    def __init__(self, sock_dir, opts=None):
+        super(MasterEvent, self).__init__('master', sock_dir, opts)
         self.connect_pub()
 
 
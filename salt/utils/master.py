@@ -9,7 +9,10 @@
 
 # Import python libs
 import os
+import time
+import errno
 import logging
+import collections
 from threading import Thread, Event
 import multiprocessing
 import zmq
@@ -19,13 +22,23 @@ import salt.log
 import salt.client
 import salt.pillar
 import salt.utils
+import salt.utils.event
 import salt.utils.minions
+import salt.utils.minion_data
+import salt.utils.process
 import salt.payload
 from salt.exceptions import SaltException
 import salt.config
 
 log = logging.getLogger(__name__)
 
+# First message of a pillar worker, it is ready for a request
+PILLAR_READY = 'ready'
+# Sent along with the requests of the minions which understand busy answers
+PILLAR_BUSY_OK = 'busy_ok'
+# Answer of the pool when the worker compiling a request went away
+PILLAR_FAILED = 'failed'
+
 
 class MasterPillarUtil(object):
     '''
@@ -106,19 +119,10 @@ class MasterPillarUtil(object):
             log.debug('Skipping cached mine data minion_data_cache'
                       'and enfore_mine_cache are both disabled.')
             return mine_data
-        mdir = os.path.join(self.opts['cachedir'], 'minions')
-        try:
-            for minion_id in minion_ids:
-                if not salt.utils.verify.valid_id(self.opts, minion_id):
-                    continue
-                path = os.path.join(mdir, minion_id, 'mine.p')
-                if os.path.isfile(path):
-                    with salt.utils.fopen(path, 'rb') as fp_:
-                        mdata = self.serial.loads(fp_.read())
-                        if isinstance(mdata, dict):
-                            mine_data[minion_id] = mdata
-        except (OSError, IOError):
-            return mine_data
+        minion_ids = [minion_id for minion_id in minion_ids
+                      if salt.utils.verify.valid_id(self.opts, minion_id)]
+        mine_data.update(
+            salt.utils.minion_data.store(self.opts).mine_fetch(minion_ids))
         return mine_data
 
     def _get_cached_minion_data(self, *minion_ids):
@@ -130,21 +134,14 @@ class MasterPillarUtil(object):
             log.debug('Skipping cached data because minion_data_cache is not '
                       'enabled.')
             return grains, pillars
-        mdir = os.path.join(self.opts['cachedir'], 'minions')
-        try:
-            for minion_id in minion_ids:
-                if not salt.utils.verify.valid_id(self.opts, minion_id):
-                    continue
-                path = os.path.join(mdir, minion_id, 'data.p')
-                if os.path.isfile(path):
-                    with salt.utils.fopen(path, 'rb') as fp_:
-                        mdata = self.serial.loads(fp_.read())
-                        if mdata.get('grains', False):
-                            grains[minion_id] = mdata['grains']
-                        if mdata.get('pillar', False):
-                            pillars[minion_id] = mdata['pillar']
-        except (OSError, IOError):
-            return grains, pillars
+        minion_ids = [minion_id for minion_id in minion_ids
+                      if salt.utils.verify.valid_id(self.opts, minion_id)]
+        store = salt.utils.minion_data.store(self.opts)
+        for minion_id, mdata in store.fetch(minion_ids).iteritems():
+            if mdata['grains']:
+                grains[minion_id] = mdata['grains']
+            if mdata['pillar']:
+                pillars[minion_id] = mdata['pillar']
         return grains, pillars
 
     def _get_live_minion_grains(self, minion_ids):
@@ -348,42 +345,30 @@ class MasterPillarUtil(object):
         else:
             # Unless both clear_pillar and clear_grains are True, we need
             # to read in the pillar/grains data since they are both stored
-            # in the same file, 'data.p'
+            # in the same cache entry
             grains, pillars = self._get_cached_minion_data(*minion_ids)
+        store = salt.utils.minion_data.store(self.opts)
         try:
             for minion_id in minion_ids:
                 if not salt.utils.verify.valid_id(self.opts, minion_id):
                     continue
-                cdir = os.path.join(self.opts['cachedir'], 'minions', minion_id)
-                if not os.path.isdir(cdir):
-                    # Cache dir for this minion does not exist. Nothing to do.
-                    continue
-                data_file = os.path.join(cdir, 'data.p')
-                mine_file = os.path.join(cdir, 'mine.p')
                 minion_pillar = pillars.pop(minion_id, False)
                 minion_grains = grains.pop(minion_id, False)
                 if ((clear_pillar and clear_grains) or
                     (clear_pillar and not minion_grains) or
                     (clear_grains and not minion_pillar)):
-                    # Not saving pillar or grains, so just delete the cache file
-                    os.remove(os.path.join(data_file))
+                    # Not saving pillar or grains, so just drop the cache entry
+                    store.remove(minion_id)
                 elif clear_pillar and minion_grains:
-                    with salt.utils.fopen(data_file, 'w+b') as fp_:
-                        fp_.write(self.serial.dumps({'grains': minion_grains}))
+                    store.store(minion_id, minion_grains, None)
                 elif clear_grains and minion_pillar:
-                    with salt.utils.fopen(data_file, 'w+b') as fp_:
-                        fp_.write(self.serial.dumps({'pillar': minion_pillar}))
+                    store.store(minion_id, None, minion_pillar)
                 if clear_mine:
-                    # Delete the whole mine file
-                    os.remove(os.path.join(mine_file))
+                    # Delete the whole mine
+                    store.mine_flush(minion_id)
                 elif clear_mine_func is not None:
-                    # Delete a specific function from the mine file
-                    with salt.utils.fopen(mine_file, 'rb') as fp_:
-                        mine_data = self.serial.loads(fp_.read())
-                    if isinstance(mine_data, dict):
-                        if mine_data.pop(clear_mine_func, False):
-                            with salt.utils.fopen(mine_file, 'w+b') as fp_:
-                                fp_.write(self.serial.dumps(mine_data))
+                    # Delete a specific function from the mine
+                    store.mine_delete(minion_id, clear_mine_func)
         except (OSError, IOError):
             return True
         return True
@@ -618,6 +603,285 @@ class ConnectedCache(multiprocessing.Process):
         context.term()
         log.debug('ConCache Shutting down')
 
+def _is_running(pid):
+    '''
+    Return False if the process is gone, or is a zombie which was not reaped
+    yet
+    '''
+    if not salt.utils.process.os_is_running(pid):
+        return False
+    try:
+        with salt.utils.fopen('/proc/{0}/stat'.format(pid)) as fp_:
+            # pid (comm) state ...
+            return fp_.read().rsplit(')', 1)[-1].split()[0] != 'Z'
+    except (IOError, IndexError):
+        return True
+
+
+class PillarPool(multiprocessing.Process):
+    '''
+    The queue of the pillar compile pool. The MWorkers hand the pillar
+    requests over to it, it passes them on to the first idle pillar worker
+    and sends the compiled pillar back to the MWorker.
+
+    At most ``pillar_queue_depth`` requests wait for a worker, the pool
+    answers any other request right away with ``salt.pillar.PILLAR_BUSY``,
+    the minion asks again later. That way the MWorkers waiting on the pool
+    are bounded and the others are left to the job returns, file requests
+    and authentication. The requests of the minions which do not understand
+    the busy answer always wait for a worker.
+
+    The workers send their pid when they are ready. A request is failed back
+    to its MWorker when the process of its worker is gone, or when the worker
+    starts over with a new connection after an error.
+    '''
+    def __init__(self, opts):
+        super(PillarPool, self).__init__()
+        self.opts = opts
+        self.depth = int(opts.get('pillar_queue_depth', 0))
+        self.pool_sock = os.path.join(opts['sock_dir'], 'pillar_pool.ipc')
+        self.worker_sock = os.path.join(opts['sock_dir'], 'pillar_workers.ipc')
+        # Identities of the workers waiting for a request
+        self.idle = collections.deque()
+        # Requests waiting for a worker, with the time they arrived
+        self.pending = collections.deque()
+        # Client and start time of the request run by each busy worker
+        self.busy = {}
+        # Process id of each worker
+        self.pids = {}
+        self.counters = {'completed': 0,
+                         'rejected': 0,
+                         'failed': 0,
+                         'wait_time': 0.0,
+                         'wait_max': 0.0,
+                         'compile_time': 0.0}
+
+    def submit(self, client, request, now=None, busy_ok=True):
+        '''
+        Queue a request, returns False if the queue is full and the minion
+        understands the busy answer
+        '''
+        if busy_ok and not self.idle and len(self.pending) >= self.depth:
+            self.counters['rejected'] += 1
+            return False
+        if now is None:
+            now = time.time()
+        self.pending.append((client, request, now))
+        return True
+
+    def ready(self, worker, pid=None):
+        '''
+        A worker is ready for a request, returns the clients of the requests
+        lost by an earlier connection of the same worker process
+        '''
+        lost = []
+        if pid is not None:
+            for old, old_pid in self.pids.items():
+                if old_pid == pid and old != worker:
+                    lost.extend(self.lost(old))
+            self.pids[worker] = pid
+        self.idle.append(worker)
+        return lost
+
+    def lost(self, worker):
+        '''
+        Forget a worker which went away, returns the client of the request it
+        was compiling in a list
+        '''
+        self.pids.pop(worker, None)
+        if worker in self.idle:
+            self.idle.remove(worker)
+        if worker not in self.busy:
+            return []
+        client, start = self.busy.pop(worker)
+        self.counters['failed'] += 1
+        return [client]
+
+    def reap(self):
+        '''
+        Forget the workers whose process is gone, returns the clients of the
+        requests they were compiling
+        '''
+        lost = []
+        for worker, pid in self.pids.items():
+            if not _is_running(pid):
+                log.error(
+                    'Pillar worker {0} is gone, failing its request'.format(pid)
+                )
+                lost.extend(self.lost(worker))
+        return lost
+
+    def done(self, worker, now=None):
+        '''
+        A worker sent back a compiled pillar, returns the client to send it to
+        or None if the request was already failed
+        '''
+        if worker not in self.busy:
+            return None
+        if now is None:
+            now = time.time()
+        client, start = self.busy.pop(worker)
+        self.counters['completed'] += 1
+        self.counters['compile_time'] += now - start
+        self.idle.append(worker)
+        return client
+
+    def dispatch(self, now=None):
+        '''
+        Yield the worker, client and request of the requests which can be run
+        '''
+        if now is None:
+            now = time.time()
+        while self.idle and self.pending:
+            worker = self.idle.popleft()
+            client, request, queued = self.pending.popleft()
+            wait = now - queued
+            self.counters['wait_time'] += wait
+            self.counters['wait_max'] = max(self.counters['wait_max'], wait)
+            self.busy[worker] = (client, now)
+            yield worker, client, request
+
+    def stats(self):
+        '''
+        Return the queue metrics of the pool
+        '''
+        ret = dict(self.counters)
+        ret.update({'workers': len(self.idle) + len(self.busy),
+                    'active': len(self.busy),
+                    'queued': len(self.pending),
+                    'depth': self.depth})
+        started = ret['completed'] + ret['active'] + ret['failed']
+        ret['wait_avg'] = ret['wait_time'] / started if started else 0.0
+        ret['compile_avg'] = (ret['compile_time'] / ret['completed']
+                              if ret['completed'] else 0.0)
+        return ret
+
+    def run(self):
+        '''
+        Route the requests of the MWorkers to the pillar workers, and fire the
+        queue metrics on the master event bus every loop_interval
+        '''
+        salt.utils.appendproctitle(self.__class__.__name__)
+        serial = salt.payload.Serial(self.opts)
+        busy = serial.dumps({salt.pillar.PILLAR_BUSY: True})
+        event = salt.utils.event.MasterEvent(self.opts['sock_dir'])
+        tag = salt.utils.event.tagify('stats', 'pillar_pool')
+        interval = int(self.opts['loop_interval'])
+
+        context = zmq.Context(1)
+        clients = context.socket(zmq.ROUTER)
+        clients.setsockopt(zmq.LINGER, 100)
+        clients.bind('ipc://' + self.pool_sock)
+        workers = context.socket(zmq.ROUTER)
+        workers.setsockopt(zmq.LINGER, 100)
+        workers.bind('ipc://' + self.worker_sock)
+        for sock in (self.pool_sock, self.worker_sock):
+            os.chmod(sock, 0600)
+
+        poller = zmq.Poller()
+        poller.register(clients, zmq.POLLIN)
+        poller.register(workers, zmq.POLLIN)
+        last = reaped = time.time()
+        log.info('Pillar compile pool started')
+        try:
+            while True:
+                try:
+                    socks = dict(poller.poll(1000))
+                except zmq.ZMQError as exc:
+                    if exc.errno == errno.EINTR:
+                        continue
+                    raise
+                if socks.get(workers) == zmq.POLLIN:
+                    frames = workers.recv_multipart()
+                    if frames[2] == PILLAR_READY:
+                        # worker, '', ready, pid
+                        pid = int(frames[3]) if len(frames) > 3 else None
+                        for client in self.ready(frames[0], pid):
+                            clients.send_multipart([client, '', PILLAR_FAILED])
+                    else:
+                        # worker, '', client, '', reply
+                        client = self.done(frames[0])
+                        if client is not None:
+                            clients.send_multipart([client, '', frames[-1]])
+                if socks.get(clients) == zmq.POLLIN:
+                    # client, '', busy_ok, request
+                    frames = clients.recv_multipart()
+                    busy_ok = frames[-2] == PILLAR_BUSY_OK
+                    if not self.submit(frames[0], frames[-1], busy_ok=busy_ok):
+                        clients.send_multipart([frames[0], '', busy])
+                if time.time() - reaped >= 1:
+                    reaped = time.time()
+                    for client in self.reap():
+                        clients.send_multipart([client, '', PILLAR_FAILED])
+                for worker, client, request in self.dispatch():
+                    workers.send_multipart([worker, '', client, '', request])
+                if time.time() - last >= interval:
+                    last = time.time()
+                    stats = self.stats()
+                    log.debug('Pillar compile pool: {0}'.format(stats))
+                    event.fire_event(stats, tag)
+        except KeyboardInterrupt:
+            clients.close()
+            workers.close()
+            context.term()
+
+
+class PillarPoolCli(object):
+    '''
+    Connection client of the pillar compile pool, used by the MWorkers
+    '''
+    def __init__(self, opts):
+        self.opts = opts
+        self.serial = salt.payload.Serial(self.opts)
+        self.pool_sock = os.path.join(self.opts['sock_dir'], 'pillar_pool.ipc')
+        self.context = zmq.Context(1)
+        self.socket = None
+        self._connect()
+
+    def _connect(self):
+        '''
+        Set up a new socket to the pool
+        '''
+        if self.socket is not None:
+            self.socket.close()
+        self.socket = self.context.socket(zmq.REQ)
+        self.socket.setsockopt(zmq.LINGER, 100)
+        self.socket.connect('ipc://' + self.pool_sock)
+
+    def compile(self, load):
+        '''
+        Hand a pillar request over to the pool and return the answer of the
+        worker which compiled it, or ``salt.pillar.PILLAR_BUSY`` if the pool
+        is full or did not answer within ``pillar_pool_timeout`` seconds.
+
+        The minions which do not send ``busy_ok`` do not understand the busy
+        answer, None is returned instead when the pool did not answer in time
+        or lost the worker of the request, and the pillar is left to the
+        caller.
+        '''
+        busy_ok = load.get('busy_ok', False)
+        self.socket.send_multipart(
+            [PILLAR_BUSY_OK if busy_ok else '', self.serial.dumps(load)])
+        timeout = self.opts.get('pillar_pool_timeout', 0)
+        if timeout and not self.socket.poll(timeout * 1000):
+            log.error(
+                'The pillar compile pool did not answer within {0} '
+                'seconds'.format(timeout)
+            )
+            # The socket is waiting for this answer, start over
+            self._connect()
+            if not busy_ok:
+                return None
+            return {salt.pillar.PILLAR_BUSY: True}
+        ret = self.socket.recv()
+        if ret == PILLAR_FAILED:
+            log.error('The pillar compile pool lost the worker of the request')
+            if not busy_ok:
+                return None
+            return {salt.pillar.PILLAR_BUSY: True}
+        return self.serial.loads(ret)
+
+
 # test code for the ConCache class
 if __name__ == '__main__':
 
@@ -0,0 +1,534 @@
+# -*- coding: utf-8 -*-
+'''
+Backends of the minion data cache, the grains and pillar of every minion
+kept by the master when ``minion_data_cache`` is set, and of the mine
+
+The ``files`` backend writes a ``data.p`` and a ``mine.p`` file for each
+minion under ``cachedir/minions``. The ``sqlite`` backend keeps the grains
+and the pillar of all the minions in separate columns of a single sqlite
+database, so the grains can be read without loading the pillar. Its writes
+are collected and committed in batches, in a database in WAL mode which only
+syncs to disk at checkpoints. The mine data is kept in the same database,
+ordered by function and minion, so the data of one function for all the
+minions is a single sequential read.
+
+Select the backend with ``minion_data_cache_backend`` in the master config.
+'''
+
+# Import python libs
+import os
+import time
+import errno
+import atexit
+import logging
+import threading
+
+try:
+    import sqlite3
+    HAS_SQLITE3 = True
+except ImportError:
+    HAS_SQLITE3 = False
+
+# Import salt libs
+import salt.payload
+import salt.utils
+from salt.defaults import DEFAULT_TARGET_DELIM
+
+log = logging.getLogger(__name__)
+
+# The kinds of minion data in the cache
+KINDS = ('grains', 'pillar')
+# Name of the sqlite database in the cachedir
+SQLITE_DB = 'minion_data.db'
+
+# Per-process registry of the stores, by process id, cachedir and backend
+_STORES = {}
+
+
+def store(opts):
+    '''
+    Return the minion data store configured in the passed opts. The store is
+    created once per process.
+    '''
+    backend = opts.get('minion_data_cache_backend', 'files')
+    if backend == 'sqlite' and not HAS_SQLITE3:
+        log.error('The sqlite minion data cache backend needs the sqlite3 '
+                  'module, falling back to the files backend')
+        backend = 'files'
+    key = (os.getpid(), opts['cachedir'], backend)
+    if key not in _STORES:
+        _STORES[key] = {'files': FileStore,
+                        'sqlite': SQLiteStore}.get(backend, FileStore)(opts)
+    return _STORES[key]
+
+
+class MinionDataStore(object):
+    '''
+    The read API shared by the backends. The minion_ids argument of the
+    methods is a list of minion ids, None for every minion in the cache;
+    minions without cached data are left out of the returns.
+    '''
+    def __init__(self, opts):
+        self.opts = opts
+        self.serial = salt.payload.Serial(opts)
+
+    def ids(self):
+        '''
+        Return the set of minion ids with cached data
+        '''
+        return set(self.mtimes())
+
+    def grains(self, minion_ids=None):
+        '''
+        Return the cached grains, by minion id
+        '''
+        return dict((id_, data['grains']) for id_, data
+                    in self.fetch(minion_ids, ('grains',)).iteritems())
+
+    def pillar(self, minion_ids=None):
+        '''
+        Return the cached pillar, by minion id
+        '''
+        return dict((id_, data['pillar']) for id_, data
+                    in self.fetch(minion_ids, ('pillar',)).iteritems())
+
+    def get(self,
+            key,
+            kind='grains',
+            minion_ids=None,
+            default=None,
+            delimiter=DEFAULT_TARGET_DELIM):
+        '''
+        Return the value of a single key path of the grains or the pillar, by
+        minion id
+        '''
+        return dict(
+            (id_, salt.utils.traverse_dict_and_list(
+                data[kind] or {}, key, default, delimiter))
+            for id_, data in self.fetch(minion_ids, (kind,)).iteritems())
+
+    def flush(self):
+        '''
+        Write out the pending changes
+        '''
+        pass
+
+
+class FileStore(MinionDataStore):
+    '''
+    Keep the data of each minion in cachedir/minions/<id>/data.p
+    '''
+    def __init__(self, opts):
+        super(FileStore, self).__init__(opts)
+        self.cdir = os.path.join(opts['cachedir'], 'minions')
+
+    def _path(self, minion_id):
+        return os.path.join(self.cdir, minion_id, 'data.p')
+
+    def mtimes(self, minion_ids=None):
+        '''
+        Return the time the data of the minions was last written, by minion id
+        '''
+        if minion_ids is None:
+            try:
+                minion_ids = os.listdir(self.cdir)
+            except OSError:
+                return {}
+        ret = {}
+        for id_ in minion_ids:
+            try:
+                ret[id_] = os.path.getmtime(self._path(id_))
+            except OSError:
+                continue
+        return ret
+
+    def fetch(self, minion_ids=None, kinds=KINDS):
+        '''
+        Return the requested kinds of data, by minion id
+        '''
+        if minion_ids is None:
+            try:
+                minion_ids = os.listdir(self.cdir)
+            except OSError:
+                return {}
+        ret = {}
+        for id_ in minion_ids:
+            try:
+                with salt.utils.fopen(self._path(id_), 'rb') as fp_:
+                    miniondata = self.serial.load(fp_)
+            except (IOError, OSError):
+                continue
+            if not isinstance(miniondata, dict):
+                continue
+            ret[id_] = dict((kind, miniondata.get(kind)) for kind in kinds)
+        return ret
+
+    def store(self, minion_id, grains, pillar):
+        '''
+        Replace the data of a minion, returns the time it was written
+        '''
+        cdir = os.path.join(self.cdir, minion_id)
+        if not os.path.isdir(cdir):
+            try:
+                os.makedirs(cdir)
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+        data = {}
+        if grains is not None:
+            data['grains'] = grains
+        if pillar is not None:
+            data['pillar'] = pillar
+        with salt.utils.fopen(self._path(minion_id), 'w+b') as fp_:
+            fp_.write(self.serial.dumps(data))
+        return os.path.getmtime(self._path(minion_id))
+
+    def remove(self, minion_id):
+        '''
+        Drop the data of a minion
+        '''
+        try:
+            os.remove(self._path(minion_id))
+        except OSError:
+            pass
+
+    def prune(self, keep):
+        '''
+        Drop the data of the minions which are not in keep
+        '''
+        for id_ in set(self.mtimes()).difference(keep):
+            self.remove(id_)
+
+    def _mine_path(self, minion_id):
+        return os.path.join(self.cdir, minion_id, 'mine.p')
+
+    def mine_fetch(self, minion_ids=None):
+        '''
+        Return the whole mine of the minions, by minion id
+        '''
+        if minion_ids is None:
+            try:
+                minion_ids = os.listdir(self.cdir)
+            except OSError:
+                return {}
+        ret = {}
+        for id_ in minion_ids:
+            try:
+                with salt.utils.fopen(self._mine_path(id_), 'rb') as fp_:
+                    mine = self.serial.load(fp_)
+            except Exception:
+                continue
+            if isinstance(mine, dict):
+                ret[id_] = mine
+        return ret
+
+    def mine_get(self, fun, minion_ids=None):
+        '''
+        Return the mine data of a function, by minion id
+        '''
+        return dict((id_, mine[fun]) for id_, mine
+                    in self.mine_fetch(minion_ids).iteritems()
+                    if mine.get(fun))
+
+    def mine_update(self, minion_id, data, clear=False):
+        '''
+        Add the functions in data to the mine of a minion, replace its whole
+        mine if clear is True
+        '''
+        cdir = os.path.join(self.cdir, minion_id)
+        if not os.path.isdir(cdir):
+            try:
+                os.makedirs(cdir)
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+        mine = {}
+        if not clear:
+            mine = self.mine_fetch([minion_id]).get(minion_id, {})
+        mine.update(data)
+        with salt.utils.fopen(self._mine_path(minion_id), 'w+b') as fp_:
+            fp_.write(self.serial.dumps(mine))
+
+    def mine_delete(self, minion_id, fun):
+        '''
+        Drop a function from the mine of a minion
+        '''
+        mine = self.mine_fetch([minion_id]).get(minion_id)
+        if mine is not None and mine.pop(fun, False):
+            with salt.utils.fopen(self._mine_path(minion_id), 'w+b') as fp_:
+                fp_.write(self.serial.dumps(mine))
+
+    def mine_flush(self, minion_id):
+        '''
+        Drop the whole mine of a minion
+        '''
+        try:
+            os.remove(self._mine_path(minion_id))
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+
+class SQLiteStore(MinionDataStore):
+    '''
+    Keep the data of all the minions in cachedir/minion_data.db. The writes
+    of this process are held for at most ``minion_data_cache_batch_interval``
+    seconds, or until ``minion_data_cache_batch_size`` of them are pending,
+    and committed in one transaction.
+    '''
+    def __init__(self, opts):
+        super(SQLiteStore, self).__init__(opts)
+        self.path = os.path.join(opts['cachedir'], SQLITE_DB)
+        self.batch_size = opts.get('minion_data_cache_batch_size', 64)
+        self.batch_interval = opts.get('minion_data_cache_batch_interval', 1)
+        # Pending writes by minion id, None for a removal
+        self.pending = {}
+        self.timer = None
+        self.lock = threading.RLock()
+        exists = os.path.isfile(self.path)
+        self.conn = sqlite3.connect(self.path,
+                                    timeout=30,
+                                    check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS minion_data '
+                          '(id TEXT PRIMARY KEY, grains BLOB, pillar BLOB, '
+                          'mtime REAL)')
+        has_mine = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'mine'").fetchone()
+        if not has_mine:
+            # Without a rowid the rows are stored in primary key order, the
+            # data of a function for all the minions is contiguous. Other
+            # master workers may be creating the table at the same time.
+            self.conn.execute('CREATE TABLE IF NOT EXISTS mine '
+                              '(fun TEXT, id TEXT, data BLOB, '
+                              'PRIMARY KEY (fun, id)){0}'.format(
+                                  ' WITHOUT ROWID'
+                                  if sqlite3.sqlite_version_info >= (3, 8, 2)
+                                  else ''))
+            self.conn.execute('CREATE INDEX IF NOT EXISTS mine_id ON mine (id)')
+        self.conn.commit()
+        if not exists:
+            self._import_files()
+        if not has_mine:
+            self._import_mine()
+        atexit.register(self.flush)
+
+    def _import_files(self):
+        '''
+        Fill a new database from the data.p files of the files backend
+        '''
+        files = FileStore(self.opts)
+        mtimes = files.mtimes()
+        for id_, data in files.fetch(list(mtimes)).iteritems():
+            self.pending[id_] = self._row(
+                    data['grains'], data['pillar'], mtimes[id_])
+        if self.pending:
+            log.info('Importing the cached data of {0} minions into '
+                     '{1}'.format(len(self.pending), self.path))
+            self.flush()
+
+    def _import_mine(self):
+        '''
+        Fill a new mine table from the mine.p files of the files backend
+        '''
+        mines = FileStore(self.opts).mine_fetch()
+        if mines:
+            log.info('Importing the mine of {0} minions into {1}'.format(
+                len(mines), self.path))
+        for id_, mine in mines.iteritems():
+            self.mine_update(id_, mine, clear=True)
+
+    def _row(self, grains, pillar, mtime):
+        return tuple(
+            None if data is None else sqlite3.Binary(self.serial.dumps(data))
+            for data in (grains, pillar)) + (mtime,)
+
+    def _load(self, blob):
+        if blob is None:
+            return None
+        return self.serial.loads(str(blob))
+
+    def _query(self, columns, minion_ids):
+        '''
+        Return the rows with the requested columns for the minions
+        '''
+        self.flush()
+        sql = 'SELECT id, {0} FROM minion_data'.format(', '.join(columns))
+        if minion_ids is None:
+            return self.conn.execute(sql).fetchall()
+        minion_ids = list(minion_ids)
+        rows = []
+        # Stay below the limit of sqlite on the number of host parameters
+        for ind in range(0, len(minion_ids), 500):
+            chunk = minion_ids[ind:ind + 500]
+            rows.extend(self.conn.execute(
+                '{0} WHERE id IN ({1})'.format(
+                    sql, ', '.join('?' * len(chunk))),
+                chunk).fetchall())
+        return rows
+
+    def mtimes(self, minion_ids=None):
+        '''
+        Return the time the data of the minions was last written, by minion id
+        '''
+        with self.lock:
+            return dict(self._query(('mtime',), minion_ids))
+
+    def fetch(self, minion_ids=None, kinds=KINDS):
+        '''
+        Return the requested kinds of data, by minion id
+        '''
+        with self.lock:
+            rows = self._query(kinds, minion_ids)
+        ret = {}
+        for row in rows:
+            ret[row[0]] = dict(
+                (kind, self._load(blob)) for kind, blob in zip(kinds, row[1:]))
+        return ret
+
+    def store(self, minion_id, grains, pillar):
+        '''
+        Replace the data of a minion, returns the time it was written
+        '''
+        mtime = time.time()
+        row = self._row(grains, pillar, mtime)
+        with self.lock:
+            self.pending[minion_id] = row
+            self._schedule()
+        return mtime
+
+    def remove(self, minion_id):
+        '''
+        Drop the data of a minion
+        '''
+        with self.lock:
+            self.pending[minion_id] = None
+            self._schedule()
+
+    def prune(self, keep):
+        '''
+        Drop the data of the minions which are not in keep
+        '''
+        with self.lock:
+            for id_ in set(self.mtimes()).difference(keep):
+                self.pending[id_] = None
+            self.flush()
+            mine_ids = [row[0] for row in self.conn.execute(
+                'SELECT DISTINCT id FROM mine').fetchall()]
+            for id_ in set(mine_ids).difference(keep):
+                self.mine_flush(id_)
+
+    def mine_fetch(self, minion_ids=None):
+        '''
+        Return the whole mine of the minions, by minion id
+        '''
+        sql = 'SELECT id, fun, data FROM mine'
+        with self.lock:
+            if minion_ids is None:
+                rows = self.conn.execute(sql).fetchall()
+            else:
+                minion_ids = list(minion_ids)
+                rows = []
+                for ind in range(0, len(minion_ids), 500):
+                    chunk = minion_ids[ind:ind + 500]
+                    rows.extend(self.conn.execute(
+                        '{0} WHERE id IN ({1})'.format(
+                            sql, ', '.join('?' * len(chunk))),
+                        chunk).fetchall())
+        ret = {}
+        for id_, fun, blob in rows:
+            ret.setdefault(id_, {})[fun] = self._load(blob)
+        return ret
+
+    def mine_get(self, fun, minion_ids=None):
+        '''
+        Return the mine data of a function, by minion id
+        '''
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT id, data FROM mine WHERE fun = ?', (fun,)).fetchall()
+        if minion_ids is not None:
+            minion_ids = set(minion_ids)
+        ret = {}
+        for id_, blob in rows:
+            if minion_ids is not None and id_ not in minion_ids:
+                continue
+            data = self._load(blob)
+            if data:
+                ret[id_] = data
+        return ret
+
+    def mine_update(self, minion_id, data, clear=False):
+        '''
+        Add the functions in data to the mine of a minion, replace its whole
+        mine if clear is True
+        '''
+        rows = [(fun, minion_id, sqlite3.Binary(self.serial.dumps(val)))
+                for fun, val in data.iteritems()]
+        with self.lock:
+            with self.conn:
+                if clear:
+                    self.conn.execute(
+                        'DELETE FROM mine WHERE id = ?', (minion_id,))
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO mine (fun, id, data) '
+                    'VALUES (?, ?, ?)', rows)
+
+    def mine_delete(self, minion_id, fun):
+        '''
+        Drop a function from the mine of a minion
+        '''
+        with self.lock:
+            with self.conn:
+                self.conn.execute(
+                    'DELETE FROM mine WHERE fun = ? AND id = ?',
+                    (fun, minion_id))
+
+    def mine_flush(self, minion_id):
+        '''
+        Drop the whole mine of a minion
+        '''
+        with self.lock:
+            with self.conn:
+                self.conn.execute(
+                    'DELETE FROM mine WHERE id = ?', (minion_id,))
+
+    def _schedule(self):
+        '''
+        Commit the pending writes now if the batch is full, or start the timer
+        committing them
+        '''
+        if len(self.pending) >= self.batch_size or self.batch_interval <= 0:
+            self.flush()
+        elif self.timer is None:
+            self.timer = threading.Timer(self.batch_interval, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        '''
+        Commit the pending writes in one transaction
+        '''
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.pending:
+                return
+            pending, self.pending = self.pending, {}
+            removed = [(id_,) for id_, row in pending.iteritems()
+                       if row is None]
+            rows = [(id_,) + row for id_, row in pending.iteritems()
+                    if row is not None]
+            try:
+                with self.conn:
+                    self.conn.executemany(
+                        'DELETE FROM minion_data WHERE id = ?', removed)
+                    self.conn.executemany(
+                        'INSERT OR REPLACE INTO minion_data '
+                        '(id, grains, pillar, mtime) VALUES (?, ?, ?, ?)',
+                        rows)
+            except sqlite3.Error as exc:
+                log.error('Unable to write to the minion data cache {0}: '
+                          '{1}'.format(self.path, exc))
@@ -8,11 +8,16 @@ expected to return
 import os
 import glob
 import re
+import time
+import fnmatch
 import logging
 
 # Import salt libs
 import salt.payload
 import salt.utils
+import salt.utils.network
+import salt.utils.minion_data
+from salt._compat import string_types
 from salt.defaults import DEFAULT_TARGET_DELIM
 from salt.exceptions import CommandExecutionError
 
@@ -34,34 +39,20 @@ def get_minion_data(minion, opts):
     Return value is a tuple of the minion ID, grains, and pillar
     '''
     if opts.get('minion_data_cache', False):
-        serial = salt.payload.Serial(opts)
-        cdir = os.path.join(opts['cachedir'], 'minions')
-        if not os.path.isdir(cdir):
-            return minion if minion else None, None, None
-        minions = os.listdir(cdir)
+        store = salt.utils.minion_data.store(opts)
         if minion is None:
             # If no minion specified, take first one with valid grains
-            for id_ in minions:
-                datap = os.path.join(cdir, id_, 'data.p')
-                try:
-                    with salt.utils.fopen(datap, 'rb') as fp_:
-                        miniondata = serial.load(fp_)
-                except (IOError, OSError):
+            for id_ in store.ids():
+                miniondata = store.fetch([id_]).get(id_)
+                if miniondata is None:
                     continue
-                grains = miniondata.get('grains')
-                pillar = miniondata.get('pillar')
-                return id_, grains, pillar
+                return id_, miniondata['grains'], miniondata['pillar']
         else:
             # Search for specific minion
-            datap = os.path.join(cdir, minion, 'data.p')
-            try:
-                with salt.utils.fopen(datap, 'rb') as fp_:
-                    miniondata = serial.load(fp_)
-            except (IOError, OSError):
+            miniondata = store.fetch([minion]).get(minion)
+            if miniondata is None:
                 return minion, None, None
-            grains = miniondata.get('grains')
-            pillar = miniondata.get('pillar')
-            return minion, grains, pillar
+            return minion, miniondata['grains'], miniondata['pillar']
     # No cache dir, return empty dict
     return minion if minion else None, None, None
 
@@ -93,6 +84,284 @@ def nodegroup_comp(group, nodegroups, skip=None):
         return ret[:-3]
 
 
+# Per-process registry of minion data indexes, keyed on the cachedir
+_MINION_DATA_INDEXES = {}
+
+
+def minion_data_index(opts):
+    '''
+    Return the MinionDataIndex for the cachedir in the passed opts. The index
+    is created once per process and reused by every CkMinions instance.
+    '''
+    cachedir = opts['cachedir']
+    if cachedir not in _MINION_DATA_INDEXES:
+        _MINION_DATA_INDEXES[cachedir] = MinionDataIndex(opts)
+    return _MINION_DATA_INDEXES[cachedir]
+
+
+class MinionDataIndex(object):
+    '''
+    Keep the grains and pillar from the minion data cache in memory, along
+    with inverted indexes mapping every key path to its values and to the set
+    of minions holding each value.
+
+    The minion data cache is loaded once, writes made in this process are
+    pushed in through update(), and changes made by other processes are
+    picked up by an mtime sweep at most every ``minion_data_index_interval``
+    seconds.
+    Lookups only ever touch the minions whose indexed values can match, the
+    final decision is still made by ``salt.utils.subdict_match`` so targeting
+    results are the same as a full scan of the cache.
+    '''
+    def __init__(self, opts):
+        self.opts = opts
+        self.interval = opts.get('minion_data_index_interval', 30)
+        self.last_refresh = 0
+        self.data = {}
+        self.entries = {}
+        self.mtimes = {}
+        # kind -> path tuple -> set of minion ids holding that path
+        self.paths = {'grains': {}, 'pillar': {}}
+        # kind -> path tuple -> lowercased value -> set of minion ids
+        self.values = {'grains': {}, 'pillar': {}}
+
+    @property
+    def store(self):
+        '''
+        The minion data store of this process
+        '''
+        return salt.utils.minion_data.store(self.opts)
+
+    def _flatten(self, data, path=()):
+        '''
+        Yield (path, value) for every key path in the data. Scalar values are
+        lowercased strings the way subdict_match compares them, the value is
+        None for the entry recording that the path itself exists. List
+        members are indexed under the path of the list itself.
+        '''
+        if isinstance(data, dict):
+            for key, val in data.iteritems():
+                if not isinstance(key, string_types):
+                    key = str(key)
+                sub = path + (key,)
+                yield sub, None
+                for item in self._flatten(val, sub):
+                    yield item
+        elif isinstance(data, list):
+            for member in data:
+                for item in self._flatten(member, path):
+                    yield item
+        elif path:
+            try:
+                yield path, str(data).lower()
+            except UnicodeError:
+                pass
+
+    def _index(self, minion_id, data, add):
+        '''
+        Add or remove the (path, value) entries of one minion to or from the
+        inverted indexes
+        '''
+        for kind, entries in data.iteritems():
+            for path, val in entries:
+                if val is None:
+                    self._set_op(self.paths[kind], path, minion_id, add)
+                else:
+                    self._set_op(self.values[kind].setdefault(path, {}),
+                                 val,
+                                 minion_id,
+                                 add)
+                    if not add and not self.values[kind][path]:
+                        del self.values[kind][path]
+
+    @staticmethod
+    def _set_op(mapping, key, minion_id, add):
+        if add:
+            mapping.setdefault(key, set()).add(minion_id)
+            return
+        ids = mapping.get(key)
+        if ids is None:
+            return
+        ids.discard(minion_id)
+        if not ids:
+            del mapping[key]
+
+    def update(self, minion_id, grains, pillar, mtime=None):
+        '''
+        Replace the indexed data for a single minion
+        '''
+        self.remove(minion_id)
+        self.data[minion_id] = {'grains': grains, 'pillar': pillar}
+        if mtime is None:
+            mtime = self.store.mtimes([minion_id]).get(minion_id)
+        self.mtimes[minion_id] = mtime
+        entries = {}
+        for kind in ('grains', 'pillar'):
+            entries[kind] = set()
+            entries[kind].update(
+                    self._flatten(self.data[minion_id][kind]))
+        self.entries[minion_id] = entries
+        self._index(minion_id, entries, True)
+
+    def remove(self, minion_id):
+        '''
+        Drop a minion from the index
+        '''
+        if minion_id not in self.data:
+            return
+        self._index(minion_id, self.entries.pop(minion_id), False)
+        del self.data[minion_id]
+        self.mtimes.pop(minion_id, None)
+
+    def refresh(self, force=False):
+        '''
+        Sync the index with the minion data cache, only the minions whose
+        data was written since they were indexed are read again
+        '''
+        if not force and time.time() - self.last_refresh < self.interval:
+            return
+        self.last_refresh = time.time()
+        mtimes = self.store.mtimes()
+        seen = set()
+        changed = []
+        for id_, mtime in mtimes.iteritems():
+            if id_ in self.data and self.mtimes.get(id_) == mtime:
+                seen.add(id_)
+            else:
+                changed.append(id_)
+        for id_, miniondata in self.store.fetch(changed).iteritems():
+            seen.add(id_)
+            self.update(id_,
+                        miniondata['grains'],
+                        miniondata['pillar'],
+                        mtimes[id_])
+        for id_ in set(self.data).difference(seen):
+            self.remove(id_)
+        log.debug('Minion data index holds {0} minions'.format(len(self.data)))
+
+    def minions(self):
+        '''
+        Return the set of minion ids which have indexed data
+        '''
+        self.refresh()
+        return set(self.data)
+
+    def _candidates(self, kind, expr, delimiter, regex_match):
+        '''
+        Return a superset of the minions matching the expression, or None if
+        the expression can not be answered from the inverted index
+        '''
+        if delimiter != DEFAULT_TARGET_DELIM:
+            # subdict_match recurses into lists with the default delimiter
+            return None
+        ret = set()
+        splits = expr.split(delimiter)
+        for idx in range(1, len(splits)):
+            path = tuple(splits[:idx])
+            matchstr = delimiter.join(splits[idx:])
+            if any(comp.isdigit() for comp in path):
+                # Numeric list indexes are resolved by traverse_dict_and_list
+                return None
+            if matchstr == '*':
+                ret.update(self.paths[kind].get(path, ()))
+                continue
+            if matchstr.startswith('*' + delimiter):
+                return None
+            values = self.values[kind].get(path)
+            if not values:
+                continue
+            pattern = matchstr.lower()
+            if regex_match:
+                try:
+                    reg = re.compile(pattern)
+                except Exception:
+                    log.error('Invalid regex {0!r} in match'.format(matchstr))
+                    continue
+                for val, ids in values.iteritems():
+                    if reg.match(val):
+                        ret.update(ids)
+            elif any(char in pattern for char in '*?['):
+                for val, ids in values.iteritems():
+                    if fnmatch.fnmatch(val, pattern):
+                        ret.update(ids)
+            else:
+                ret.update(values.get(pattern, ()))
+        return ret
+
+    def unindexed(self, minions):
+        '''
+        Return the passed minions which have no data in the index
+        '''
+        self.refresh()
+        return set(id_ for id_ in minions if id_ not in self.data)
+
+    def _narrowed(self, minions):
+        '''
+        Return the indexed minions out of the passed ones if there are few
+        enough of them to check directly, rather than through the inverted
+        indexes, otherwise None
+        '''
+        if minions is None or len(minions) * 10 > len(self.data):
+            return None
+        return [id_ for id_ in minions if id_ in self.data]
+
+    def match(self, kind, expr, delimiter=DEFAULT_TARGET_DELIM,
+              regex_match=False, minions=None):
+        '''
+        Return the set of indexed minions whose grains or pillar (depending
+        on kind) match the expression, optionally only out of the passed
+        minions
+        '''
+        self.refresh()
+        candidates = self._narrowed(minions)
+        if candidates is None:
+            candidates = self._candidates(kind, expr, delimiter, regex_match)
+            if candidates is None:
+                candidates = self.data
+            if minions is not None:
+                candidates = [id_ for id_ in candidates if id_ in minions]
+        return set(
+            id_ for id_ in candidates
+            if salt.utils.subdict_match(self.data[id_][kind],
+                                        expr,
+                                        delimiter,
+                                        regex_match=regex_match)
+        )
+
+    def match_ipcidr(self, expr, minions=None):
+        '''
+        Return the set of indexed minions with an ipv4 grain in the passed
+        CIDR network or equal to the passed address, optionally only out of
+        the passed minions
+        '''
+        self.refresh()
+        candidates = self._narrowed(minions)
+        if candidates is not None:
+            ret = set()
+            for id_ in candidates:
+                addrs = (self.data[id_]['grains'] or {}).get('ipv4', [])
+                if '/' in expr:
+                    if salt.utils.network.in_subnet(expr, addrs=addrs):
+                        ret.add(id_)
+                elif expr in addrs:
+                    ret.add(id_)
+            return ret
+        values = self.values['grains'].get(('ipv4',), {})
+        if '/' in expr:
+            addrs = [val for val in values
+                     if salt.utils.network.in_subnet(expr, addrs=[val])]
+        else:
+            addrs = [expr] if expr in values else []
+        ret = set()
+        for addr in addrs:
+            for id_ in values[addr]:
+                if minions is not None and id_ not in minions:
+                    continue
+                if addr in (self.data[id_]['grains'] or {}).get('ipv4', []):
+                    ret.add(id_)
+        return ret
+
+
 class CkMinions(object):
     '''
     Used to check what minions should respond from a target
@@ -100,11 +369,34 @@ class CkMinions(object):
     def __init__(self, opts):
         self.opts = opts
         self.serial = salt.payload.Serial(opts)
+        self.index = None
         if self.opts['transport'] == 'zeromq':
             self.acc = 'minions'
         else:
             self.acc = 'accepted'
 
+    def _use_index(self):
+        '''
+        Return True if grain, pillar and ipcidr targets should be resolved
+        through the in-memory minion data index
+        '''
+        if not self.opts.get('minion_data_cache', False):
+            return False
+        if not self.opts.get('minion_data_index', False):
+            return False
+        if self.index is None:
+            self.index = minion_data_index(self.opts)
+        return True
+
+    def _check_indexed_minions(self, minions, matched):
+        '''
+        Filter the accepted minions through the set of indexed minions which
+        matched. Minions without cached data are kept, like the full cache
+        scan does.
+        '''
+        unindexed = self.index.unindexed(minions)
+        return list(unindexed.union(minions.intersection(matched)))
+
     def _check_glob_minions(self, expr):
         '''
         Return the minions found by looking via globs
@@ -158,19 +450,13 @@ class CkMinions(object):
         minions = set(
             os.listdir(os.path.join(self.opts['pki_dir'], self.acc))
         )
+        if self._use_index():
+            return self._check_indexed_minions(
+                    minions,
+                    self.index.match('grains', expr, delimiter))
         if self.opts.get('minion_data_cache', False):
-            cdir = os.path.join(self.opts['cachedir'], 'minions')
-            if not os.path.isdir(cdir):
-                return list(minions)
-            for id_ in os.listdir(cdir):
-                if id_ not in minions:
-                    continue
-                datap = os.path.join(cdir, id_, 'data.p')
-                try:
-                    with salt.utils.fopen(datap, 'rb') as fp_:
-                        grains = self.serial.load(fp_).get('grains')
-                except (IOError, OSError):
-                    continue
+            store = salt.utils.minion_data.store(self.opts)
+            for id_, grains in store.grains(minions).iteritems():
                 if not salt.utils.subdict_match(grains, expr, delimiter):
                     minions.remove(id_)
         return list(minions)
@@ -182,19 +468,16 @@ class CkMinions(object):
         minions = set(
             os.listdir(os.path.join(self.opts['pki_dir'], self.acc))
         )
+        if self._use_index():
+            return self._check_indexed_minions(
+                    minions,
+                    self.index.match('grains',
+                                     expr,
+                                     delimiter,
+                                     regex_match=True))
         if self.opts.get('minion_data_cache', False):
-            cdir = os.path.join(self.opts['cachedir'], 'minions')
-            if not os.path.isdir(cdir):
-                return list(minions)
-            for id_ in os.listdir(cdir):
-                if id_ not in minions:
-                    continue
-                datap = os.path.join(cdir, id_, 'data.p')
-                try:
-                    with salt.utils.fopen(datap, 'rb') as fp_:
-                        grains = self.serial.load(fp_).get('grains')
-                except (IOError, OSError):
-                    continue
+            store = salt.utils.minion_data.store(self.opts)
+            for id_, grains in store.grains(minions).iteritems():
                 if not salt.utils.subdict_match(grains, expr, delimiter,
                                                 regex_match=True):
                     minions.remove(id_)
@@ -207,19 +490,13 @@ class CkMinions(object):
         minions = set(
             os.listdir(os.path.join(self.opts['pki_dir'], self.acc))
         )
+        if self._use_index():
+            return self._check_indexed_minions(
+                    minions,
+                    self.index.match('pillar', expr, delimiter))
         if self.opts.get('minion_data_cache', False):
-            cdir = os.path.join(self.opts['cachedir'], 'minions')
-            if not os.path.isdir(cdir):
-                return list(minions)
-            for id_ in os.listdir(cdir):
-                if id_ not in minions:
-                    continue
-                datap = os.path.join(cdir, id_, 'data.p')
-                try:
-                    with salt.utils.fopen(datap, 'rb') as fp_:
-                        pillar = self.serial.load(fp_).get('pillar')
-                except (IOError, OSError):
-                    continue
+            store = salt.utils.minion_data.store(self.opts)
+            for id_, pillar in store.pillar(minions).iteritems():
                 if not salt.utils.subdict_match(pillar, expr, delimiter):
                     minions.remove(id_)
         return list(minions)
@@ -231,19 +508,26 @@ class CkMinions(object):
         minions = set(
             os.listdir(os.path.join(self.opts['pki_dir'], self.acc))
         )
-        if self.opts.get('minion_data_cache', False):
-            cdir = os.path.join(self.opts['cachedir'], 'minions')
-            if not os.path.isdir(cdir):
-                return list(minions)
-            for id_ in os.listdir(cdir):
-                if id_ not in minions:
-                    continue
-                datap = os.path.join(cdir, id_, 'data.p')
+        if self._use_index():
+            num_parts = len(expr.split('/'))
+            if num_parts > 2:
+                # Target is not valid CIDR, no minions match
+                return []
+            elif num_parts == 1:
+                # Target is an IPv4 address
+                import socket
                 try:
-                    with salt.utils.fopen(datap, 'rb') as fp_:
-                        grains = self.serial.load(fp_).get('grains')
-                except (IOError, OSError):
-                    continue
+                    socket.inet_aton(expr)
+                except socket.error:
+                    # Not a valid IPv4 address, no minions match
+                    return []
+            return self._check_indexed_minions(
+                    minions,
+                    self.index.match_ipcidr(expr))
+        if self.opts.get('minion_data_cache', False):
+            store = salt.utils.minion_data.store(self.opts)
+            for id_, grains in store.grains(minions).iteritems():
+                grains = grains or {}
                 num_parts = len(expr.split('/'))
                 if num_parts > 2:
                     # Target is not valid CIDR, no minions match
@@ -280,18 +564,9 @@ class CkMinions(object):
             os.listdir(os.path.join(self.opts['pki_dir'], self.acc))
         )
         if self.opts.get('minion_data_cache', False):
-            cdir = os.path.join(self.opts['cachedir'], 'minions')
-            if not os.path.isdir(cdir):
-                return list(minions)
-            for id_ in os.listdir(cdir):
-                if id_ not in minions:
-                    continue
-                datap = os.path.join(cdir, id_, 'data.p')
-                try:
-                    with salt.utils.fopen(datap, 'rb') as fp_:
-                        grains = self.serial.load(fp_).get('grains')
-                except (IOError, OSError):
-                    continue
+            store = salt.utils.minion_data.store(self.opts)
+            for id_, grains in store.grains(minions).iteritems():
+                grains = grains or {}
                 range_ = seco.range.Range(self.opts['range_server'])
                 try:
                     if grains.get('fqdn', '') not in range_.expand(expr):
@@ -306,127 +581,238 @@ class CkMinions(object):
     def _check_compound_minions(self, expr):
         '''
         Return the minions found by looking via compound matcher
+
+        The expression is parsed once into a tree of set operations which is
+        evaluated against a shrinking set of candidate minions. Within an
+        ``and`` the cheapest terms run first, so the terms which need cached
+        minion data only look at the minions that are still in the running,
+        and each minion's cache file is read at most once per call.
         '''
         minions = set(
             os.listdir(os.path.join(self.opts['pki_dir'], self.acc))
         )
         if self.opts.get('minion_data_cache', False):
-            ref = {'G': self._check_grain_minions,
-                   'P': self._check_grain_pcre_minions,
-                   'I': self._check_pillar_minions,
-                   'L': self._check_list_minions,
-                   'S': self._check_ipcidr_minions,
-                   'E': self._check_pcre_minions,
-                   'R': self._all_minions}
-            results = []
-            unmatched = []
-            opers = ['and', 'or', 'not', '(', ')']
-            tokens = expr.split()
-            for match in tokens:
-                # Try to match tokens from the compound target, first by using
-                # the 'G, X, I, L, S, E' matcher types, then by hostname glob.
-                if '@' in match and match[1] == '@':
-                    comps = match.split('@')
-                    matcher = ref.get(comps[0])
-                    if not matcher:
-                        # If an unknown matcher is called at any time, fail out
-                        return []
-                    if unmatched and unmatched[-1] == '-':
-                        results.append(str(set(matcher('@'.join(comps[1:])))))
-                        results.append(')')
-                        unmatched.pop()
-                    else:
-                        results.append(str(set(matcher('@'.join(comps[1:])))))
-                elif match in opers:
-                    # We didn't match a target, so append a boolean operator or
-                    # subexpression
-                    if results:
-                        if match == 'not':
-                            if results[-1] == '&':
-                                pass
-                            elif results[-1] == '|':
-                                pass
-                            else:
-                                results.append('&')
-                            results.append('(')
-                            results.append(str(set(minions)))
-                            results.append('-')
-                            unmatched.append('-')
-                        elif match == 'and':
-                            results.append('&')
-                        elif match == 'or':
-                            results.append('|')
-                        elif match == '(':
-                            results.append(match)
-                            unmatched.append(match)
-                        elif match == ')':
-                            if not unmatched or unmatched[-1] != '(':
-                                log.error('Invalid compound expr (unexpected '
-                                          'right parenthesis): {0}'
-                                          .format(expr))
-                                return []
-                            results.append(match)
-                            unmatched.pop()
-                            if unmatched and unmatched[-1] == '-':
-                                results.append(')')
-                                unmatched.pop()
-                        else:  # Won't get here, unless oper is added
-                            log.error('Unhandled oper in compound expr: {0}'
-                                      .format(expr))
-                            return []
-                    else:
-                        # seq start with oper, fail
-                        if match == '(':
-                            results.append(match)
-                            unmatched.append(match)
-                        else:
-                            return []
-                else:
-                    # The match is not explicitly defined, evaluate as a glob
-                    if unmatched and unmatched[-1] == '-':
-                        results.append(
-                                str(set(self._check_glob_minions(match))))
-                        results.append(')')
-                        unmatched.pop()
-                    else:
-                        results.append(
-                                str(set(self._check_glob_minions(match))))
-            for token in unmatched:
-                results.append(')')
-            results = ' '.join(results)
-            log.debug('Evaluating final compound matching expr: {0}'
-                      .format(results))
             try:
-                return list(eval(results))  # pylint: disable=W0123
-            except Exception:
-                log.error('Invalid compound target: {0}'.format(expr))
+                tree = self._parse_compound(expr)
+            except ValueError as exc:
+                log.error('Invalid compound target: {0}: {1}'.format(expr, exc))
                 return []
+            if tree is None:
+                return []
+            log.debug('Evaluating compound target {0!r} as {1!r}'.format(
+                expr, tree))
+            return list(self._eval_compound(tree, minions, {}))
         return list(minions)
 
+    def _parse_compound(self, expr):
+        '''
+        Parse a compound target into a tree of nested tuples:
+
+            ('and', [node, ...]), ('or', [node, ...]), ('not', node)
+            ('term', matcher_letter, pattern)
+
+        Returns None if an unknown matcher is used, raises ValueError if the
+        expression is malformed.
+        '''
+        tokens = []
+        for token in expr.split():
+            if token in ('and', 'or', 'not', '(', ')'):
+                if token == 'not' and tokens and \
+                        tokens[-1] not in ('and', 'or', 'not', '('):
+                    # "A not B" means "A and not B"
+                    tokens.append('and')
+                tokens.append(token)
+            elif '@' in token and token[1] == '@':
+                comps = token.split('@')
+                if comps[0] not in self._compound_cost:
+                    # If an unknown matcher is called at any time, fail out
+                    return None
+                tokens.append(('term', comps[0], '@'.join(comps[1:])))
+            else:
+                # The match is not explicitly defined, evaluate as a glob
+                tokens.append(('term', 'glob', token))
+        if not tokens or tokens[0] == 'not':
+            raise ValueError('expression can not start with an operator')
+        pos = [0]
+
+        def _peek():
+            if pos[0] < len(tokens):
+                return tokens[pos[0]]
+            return None
+
+        def _next():
+            token = _peek()
+            if token is None:
+                raise ValueError('unexpected end of expression')
+            pos[0] += 1
+            return token
+
+        def _boolean(oper, child):
+            nodes = [child()]
+            while _peek() == oper:
+                _next()
+                nodes.append(child())
+            if len(nodes) == 1:
+                return nodes[0]
+            return (oper, nodes)
+
+        def _or():
+            return _boolean('or', _and)
+
+        def _and():
+            return _boolean('and', _not)
+
+        def _not():
+            if _peek() == 'not':
+                _next()
+                return ('not', _not())
+            return _atom()
+
+        def _atom():
+            token = _next()
+            if token == '(':
+                node = _or()
+                if _next() != ')':
+                    raise ValueError('missing right parenthesis')
+                return node
+            if isinstance(token, tuple):
+                return token
+            raise ValueError('unexpected {0!r}'.format(token))
+
+        tree = _or()
+        if _peek() is not None:
+            raise ValueError('unexpected {0!r}'.format(_peek()))
+        return tree
+
+    # Relative cost of the compound term types, the terms which can be
+    # answered from the minion ids alone come first
+    _compound_cost = {'L': 0,
+                      'R': 0,
+                      'glob': 1,
+                      'E': 1,
+                      'G': 2,
+                      'P': 2,
+                      'I': 2,
+                      'S': 2}
+
+    def _compound_node_cost(self, node):
+        if node[0] == 'term':
+            return self._compound_cost[node[1]]
+        if node[0] == 'not':
+            return self._compound_node_cost(node[1])
+        return max(self._compound_node_cost(child) for child in node[1])
+
+    def _eval_compound(self, node, candidates, cache):
+        '''
+        Return the subset of the candidate minions matching the node
+        '''
+        if not candidates:
+            return set()
+        if node[0] == 'term':
+            return self._eval_compound_term(node[1], node[2], candidates, cache)
+        if node[0] == 'not':
+            return candidates.difference(
+                    self._eval_compound(node[1], candidates, cache))
+        children = sorted(node[1], key=self._compound_node_cost)
+        if node[0] == 'and':
+            for child in children:
+                candidates = self._eval_compound(child, candidates, cache)
+                if not candidates:
+                    break
+            return candidates
+        ret = set()
+        for child in children:
+            matched = self._eval_compound(child, candidates, cache)
+            ret.update(matched)
+            candidates = candidates.difference(matched)
+            if not candidates:
+                break
+        return ret
+
+    def _eval_compound_term(self, matcher, expr, candidates, cache):
+        '''
+        Return the subset of the candidate minions matching a single term
+        '''
+        if matcher == 'R':
+            return candidates
+        if matcher == 'L':
+            return candidates.intersection(m for m in expr.split(',') if m)
+        if matcher == 'glob':
+            return set(
+                fn_ for fn_ in fnmatch.filter(candidates, expr)
+                if expr.startswith('.') or not fn_.startswith('.')
+            )
+        if matcher == 'E':
+            reg = re.compile(expr)
+            return set(fn_ for fn_ in candidates if reg.match(fn_))
+        if matcher == 'S':
+            num_parts = len(expr.split('/'))
+            if num_parts > 2:
+                # Target is not valid CIDR, no minions match
+                return set()
+            elif num_parts == 1:
+                import socket
+                try:
+                    socket.inet_aton(expr)
+                except socket.error:
+                    # Not a valid IPv4 address, no minions match
+                    return set()
+        if self._use_index():
+            unindexed = self.index.unindexed(candidates)
+            if matcher == 'S':
+                matched = self.index.match_ipcidr(expr, minions=candidates)
+            else:
+                matched = self.index.match(
+                        'pillar' if matcher == 'I' else 'grains',
+                        expr,
+                        DEFAULT_TARGET_DELIM,
+                        regex_match=matcher == 'P',
+                        minions=candidates)
+            return unindexed.union(matched)
+        ret = set()
+        for id_ in candidates:
+            if id_ not in cache:
+                cache[id_] = self._read_minion_data(id_)
+            miniondata = cache[id_]
+            if miniondata is None:
+                # No cached data, the minion can not be ruled out
+                ret.add(id_)
+                continue
+            if matcher == 'S':
+                addrs = (miniondata.get('grains') or {}).get('ipv4', [])
+                if '/' in expr:
+                    if salt.utils.network.in_subnet(expr, addrs=addrs):
+                        ret.add(id_)
+                elif expr in addrs:
+                    ret.add(id_)
+                continue
+            data = miniondata.get('pillar' if matcher == 'I' else 'grains')
+            if salt.utils.subdict_match(data,
+                                        expr,
+                                        regex_match=matcher == 'P'):
+                ret.add(id_)
+        return ret
+
+    def _read_minion_data(self, minion_id):
+        '''
+        Read the cached data for a minion, returns None if there is none
+        '''
+        return salt.utils.minion_data.store(self.opts).fetch(
+                [minion_id]).get(minion_id)
+
     def connected_ids(self, subset=None, show_ipv4=False):
         '''
         Return a set of all connected minion ids, optionally within a subset
         '''
         minions = set()
         if self.opts.get('minion_data_cache', False):
-            cdir = os.path.join(self.opts['cachedir'], 'minions')
-            if not os.path.isdir(cdir):
+            store = salt.utils.minion_data.store(self.opts)
+            search = store.grains(subset or None)
+            if not search:
                 return minions
             addrs = salt.utils.network.local_port_tcp(int(self.opts['publish_port']))
-            if subset:
-                search = subset
-            else:
-                search = os.listdir(cdir)
-            for id_ in search:
-                datap = os.path.join(cdir, id_, 'data.p')
-                try:
-                    grains = self.serial.load(
-                        salt.utils.fopen(datap, 'rb')
-                    ).get('grains', {})
-                except AttributeError:
-                    pass
-                except (IOError, OSError):
-                    continue
+            for id_, grains in search.iteritems():
+                grains = grains or {}
                 for ipv4 in grains.get('ipv4', []):
                     if ipv4 == '127.0.0.1' or ipv4 == '0.0.0.0':
                         continue
@@ -701,23 +1087,8 @@ def mine_get(tgt, fun, tgt_type='glob', opts=None):
     Gathers the data from the specified minions' mine, pass in the target,
     function to look up and the target type
     '''
-    ret = {}
-    serial = salt.payload.Serial(opts)
     checker = salt.utils.minions.CkMinions(opts)
     minions = checker.check_minions(
             tgt,
             tgt_type)
-    for minion in minions:
-        mine = os.path.join(
-                opts['cachedir'],
-                'minions',
-                minion,
-                'mine.p')
-        try:
-            with salt.utils.fopen(mine, 'rb') as fp_:
-                fdata = serial.load(fp_).get(fun)
-                if fdata:
-                    ret[minion] = fdata
-        except Exception:
-            continue
-    return ret
+    return salt.utils.minion_data.store(opts).mine_get(fun, minions)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+'''
+Run independent callables concurrently in a pool of threads, with a timeout
+for each of them
+'''
+
+# Import python libs
+import sys
+import time
+import threading
+
+# Import salt libs
+from salt._compat import Queue
+
+
+def call(func):
+    '''
+    Run a callable, returns a tuple of its return, of the exception info if
+    it raised and of the time it took
+    '''
+    start = time.time()
+    try:
+        ret, exc_info = func(), None
+    except Exception:
+        ret, exc_info = None, sys.exc_info()
+    return ret, exc_info, time.time() - start
+
+
+def run(funcs, threads, timeouts=None):
+    '''
+    Run the callables of the funcs dict in a pool of threads, one after
+    another if threads is 0. Returns a dict of the call returns of the
+    callables which returned, by key.
+
+    The timeouts dict holds the number of seconds a callable may run for, by
+    key. A callable which does not return in time is left behind in its
+    thread, which is replaced in the pool, and is missing from the return.
+    '''
+    if timeouts is None:
+        timeouts = {}
+    keys = list(funcs)
+    if threads <= 0:
+        return dict((key, call(funcs[key])) for key in keys)
+
+    pending = Queue.Queue()
+    results = Queue.Queue()
+    for key in keys:
+        pending.put(key)
+
+    def worker():
+        while True:
+            try:
+                key = pending.get_nowait()
+            except Queue.Empty:
+                return
+            timer = None
+            if timeouts.get(key):
+                # Wake up the collecting loop if the callable hangs
+                timer = threading.Timer(
+                        timeouts[key], results.put, [(key, None)])
+                timer.daemon = True
+                timer.start()
+            ret = call(funcs[key])
+            if timer is not None:
+                timer.cancel()
+            results.put((key, ret))
+
+    def spawn():
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+
+    for _ in range(min(threads, len(keys))):
+        spawn()
+    rets = {}
+    timed_out = set()
+    while len(rets) + len(timed_out) < len(keys):
+        key, ret = results.get()
+        if key in rets or key in timed_out:
+            continue
+        if ret is None:
+            timed_out.add(key)
+            # The thread running it is stuck, replace it
+            spawn()
+            continue
+        rets[key] = ret
+    return rets
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+'''
+Benchmark the collection of job returns by LocalClient.get_iter_returns.
+
+The returns of a job sent to the requested number of minions are replayed
+from memory in place of the master event bus, so only the time spent by the
+client to process them is measured. The cost of the completion check done by
+the previous implementation, which intersected the found and the expected
+minions after every return, is reported for comparison.
+
+    python tests/cmd-iter-bench.py -m 10000
+'''
+# Import python libs
+import time
+import argparse
+
+# Import salt libs
+import salt.client
+
+
+class ReplayEvent(object):
+    '''
+    Hand out the returns of a job as the event bus would
+    '''
+    def __init__(self, jid, minions):
+        self.events = [{'tag': 'salt/job/{0}/ret/{1}'.format(jid, minion),
+                        'id': minion,
+                        'jid': jid,
+                        'fun': 'test.ping',
+                        'return': True}
+                       for minion in minions]
+        self.events.reverse()
+
+    def get_event(self, wait=5, tag='', full=False, use_pending=False, pending_tags=None):
+        if self.events:
+            return self.events.pop()
+        return None
+
+
+def parse():
+    '''
+    Parse the command line
+    '''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m',
+                        dest='minions',
+                        type=int,
+                        default=10000,
+                        help='The number of minions the job is sent to')
+    parser.add_argument('-r',
+                        dest='runs',
+                        type=int,
+                        default=5,
+                        help='The number of jobs to collect')
+    return parser.parse_args()
+
+
+def collect(minions, runs):
+    '''
+    Return the average time taken to collect all the returns of a job
+    '''
+    local = salt.client.LocalClient.__new__(salt.client.LocalClient)
+    local.opts = {'timeout': 5,
+                  'order_masters': False,
+                  'master_job_cache': 'bench'}
+    local.returners = {'bench.get_load': lambda jid: {'fun': 'test.ping'}}
+    local.progress = {}
+    total = 0
+    for run in range(runs):
+        jid = '2015010100000000000{0}'.format(run)
+        local.event = ReplayEvent(jid, minions)
+        start = time.time()
+        count = len(list(local.get_iter_returns(jid, minions)))
+        total += time.time() - start
+        assert count == len(minions)
+    return total / runs
+
+
+def intersect(minions, runs):
+    '''
+    Return the average time taken by an intersection of the found and expected
+    minions after every return
+    '''
+    expected = set(minions)
+    total = 0
+    for _ in range(runs):
+        found = set()
+        start = time.time()
+        for minion in minions:
+            found.add(minion)
+            len(found.intersection(expected)) >= len(expected)
+        total += time.time() - start
+    return total / runs
+
+
+def main():
+    '''
+    Run the benchmark
+    '''
+    args = parse()
+    minions = ['minion{0}'.format(num) for num in range(args.minions)]
+    print 'Collecting {0} returns, average of {1} jobs'.format(
+        args.minions, args.runs)
+    elapsed = collect(minions, args.runs)
+    print '    get_iter_returns    {0:8.3f}s  {1:8.1f}us per return'.format(
+        elapsed, elapsed / args.minions * 1e6)
+    elapsed = intersect(minions, args.runs)
+    print '    intersection checks {0:8.3f}s  {1:8.1f}us per return'.format(
+        elapsed, elapsed / args.minions * 1e6)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+'''
+Benchmark master side compound targeting against a synthetic minion data
+cache.
+
+The first run builds a fake pki dir and minion data cache with the requested
+number of minions under the given directory, later runs reuse it. Each
+expression is evaluated with the full cache scan and with the minion data
+index, the time of the first (cold) and of the following (warm) evaluations
+is reported.
+
+    python tests/compound-bench.py -d /tmp/compound-bench -m 50000
+'''
+# Import python libs
+import os
+import time
+import random
+import argparse
+
+# Import salt libs
+import salt.payload
+import salt.utils
+import salt.utils.minions
+
+EXPRS = [
+    'G@os:Ubuntu',
+    'G@os:Ubuntu and G@role:web and not L@minion0,minion1',
+    'G@role:db or ( E@minion1.* and I@datacenter:dc2 )',
+    'web* and S@10.1.0.0/16 and G@virtual:kvm',
+]
+
+OSES = ['Ubuntu', 'CentOS', 'Debian', 'Arch']
+ROLES = ['web', 'db', 'cache', 'queue']
+
+
+def parse():
+    '''
+    Parse the command line
+    '''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d',
+                        dest='root',
+                        default='/tmp/compound-bench',
+                        help='The directory to build the minion cache in')
+    parser.add_argument('-m',
+                        dest='minions',
+                        type=int,
+                        default=50000,
+                        help='The number of minions to generate')
+    parser.add_argument('-r',
+                        dest='runs',
+                        type=int,
+                        default=3,
+                        help='The number of warm runs for each expression')
+    return parser.parse_args()
+
+
+def build(opts, count):
+    '''
+    Generate the pki dir and the minion data cache
+    '''
+    serial = salt.payload.Serial(opts)
+    pki_dir = os.path.join(opts['pki_dir'], 'minions')
+    cdir = os.path.join(opts['cachedir'], 'minions')
+    if os.path.isdir(pki_dir) and len(os.listdir(pki_dir)) == count:
+        return
+    for path in (pki_dir, cdir):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+    rand = random.Random(count)
+    for num in range(count):
+        role = rand.choice(ROLES)
+        id_ = '{0}{1}'.format(role if num % 2 else 'minion', num)
+        with salt.utils.fopen(os.path.join(pki_dir, id_), 'w+') as fp_:
+            fp_.write('')
+        grains = {'id': id_,
+                  'os': rand.choice(OSES),
+                  'role': role,
+                  'virtual': rand.choice(['kvm', 'physical']),
+                  'ipv4': ['127.0.0.1',
+                           '10.{0}.{1}.{2}'.format(rand.randint(0, 3),
+                                                   num // 250 % 250,
+                                                   num % 250 + 1)],
+                  'cpu_flags': ['fpu', 'vme', 'de', 'pse', 'tsc', 'msr']}
+        pillar = {'datacenter': 'dc{0}'.format(num % 4),
+                  'users': dict(('user{0}'.format(i), {'uid': i})
+                                for i in range(10))}
+        mdir = os.path.join(cdir, id_)
+        if not os.path.isdir(mdir):
+            os.makedirs(mdir)
+        with salt.utils.fopen(os.path.join(mdir, 'data.p'), 'w+b') as fp_:
+            fp_.write(serial.dumps({'grains': grains, 'pillar': pillar}))
+
+
+def bench(opts, expr, runs):
+    '''
+    Return the number of matches and the cold and average warm time taken to
+    evaluate the expression
+    '''
+    ckminions = salt.utils.minions.CkMinions(opts)
+    start = time.time()
+    found = ckminions.check_minions(expr, 'compound')
+    cold = time.time() - start
+    start = time.time()
+    for _ in range(runs):
+        ckminions.check_minions(expr, 'compound')
+    warm = (time.time() - start) / max(runs, 1)
+    return len(found), cold, warm
+
+
+def main():
+    '''
+    Build the cache and run the benchmark
+    '''
+    args = parse()
+    opts = {'pki_dir': os.path.join(args.root, 'pki'),
+            'cachedir': os.path.join(args.root, 'cache'),
+            'transport': 'zeromq',
+            'serial': 'msgpack',
+            'minion_data_cache': True,
+            'minion_data_index': False,
+            'minion_data_index_interval': 3600}
+    start = time.time()
+    build(opts, args.minions)
+    print 'Cache with {0} minions ready in {1:.2f}s'.format(
+        args.minions, time.time() - start)
+    for expr in EXPRS:
+        print expr
+        for index in (False, True):
+            opts['minion_data_index'] = index
+            found, cold, warm = bench(opts, expr, args.runs)
+            print '    {0:<6} matched {1:>6}  cold {2:8.3f}s  warm {3:8.3f}s'.format(
+                'index' if index else 'scan', found, cold, warm)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+'''
+Benchmark the Crypticle used to encrypt the messages between the master and
+the minions.
+
+The number of messages per second handled by encrypt, decrypt, dumps and
+loads is reported for payloads from 1 KB to 1 MB.
+
+    python tests/crypticle-bench.py -t 2
+'''
+# Import python libs
+import os
+import time
+import argparse
+
+# Import salt libs
+import salt.crypt
+
+SIZES = [1024, 16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024]
+
+
+def parse():
+    '''
+    Parse the command line
+    '''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-t',
+                        dest='time',
+                        type=float,
+                        default=1,
+                        help='The number of seconds to run each measure for')
+    return parser.parse_args()
+
+
+def rate(func, data, duration):
+    '''
+    Return the number of calls to func per second
+    '''
+    count = 0
+    start = time.time()
+    while True:
+        func(data)
+        count += 1
+        elapsed = time.time() - start
+        if elapsed >= duration:
+            return count / elapsed
+
+
+def main():
+    '''
+    Run the benchmark
+    '''
+    args = parse()
+    crypticle = salt.crypt.Crypticle(
+            {'serial': 'msgpack'},
+            salt.crypt.Crypticle.generate_key_string())
+    print '{0:>8}  {1:>10}  {2:>10}  {3:>10}  {4:>10}  (messages/s)'.format(
+        'size', 'encrypt', 'decrypt', 'dumps', 'loads')
+    for size in SIZES:
+        data = os.urandom(size)
+        load = {'fun': 'test.echo', 'jid': '20150101000000000000', 'arg': [data]}
+        print '{0:>7}K  {1:10.0f}  {2:10.0f}  {3:10.0f}  {4:10.0f}'.format(
+            size // 1024,
+            rate(crypticle.encrypt, data, args.time),
+            rate(crypticle.decrypt, crypticle.encrypt(data), args.time),
+            rate(crypticle.dumps, load, args.time),
+            rate(crypticle.loads, crypticle.dumps(load), args.time))
+
+
+if __name__ == '__main__':
+    main()
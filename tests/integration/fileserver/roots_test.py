@@ -11,6 +11,7 @@ ensure_in_syspath('../..')
 
 # Import salt libs
 import integration
+import salt.utils
 from salt.fileserver import roots
 from salt import fileclient
 
@@ -18,6 +19,8 @@ roots.__opts__ = {}
 
 # Import Python libs
 import os
+import shutil
+import tempfile
 
 
 @skipIf(NO_MOCK, NO_MOCK_REASON)
@@ -82,10 +85,75 @@ class RootsTest(integration.ModuleCase):
                          'OLD MAN:  Hee hee ha ha!\n\n',
                  'dest': 'testfile'})
 
+    def test_serve_file_window(self):
+        path = os.path.join(integration.FILES, 'file', 'base', 'testfile')
+        with salt.utils.fopen(path, 'rb') as fp_:
+            content = fp_.read()
+        fnd = {'path': path,
+               'rel': 'testfile'}
+        for opts in ({'fileserver_handle_cache': 0},
+                     {'fileserver_handle_cache': 2},
+                     {'fileserver_handle_cache': 2, 'fileserver_mmap': True}):
+            opts.update({'file_buffer_size': 100,
+                         'file_transfer_window': 4})
+            with patch.dict(roots.__opts__, opts):
+                # A single chunk unless the client asks for a window
+                load = {'saltenv': 'base', 'path': path, 'loc': 10}
+                self.assertEqual(roots.serve_file(load, fnd)['data'],
+                                 content[10:110])
+                # The window is capped by the master
+                load['window'] = 10
+                self.assertEqual(roots.serve_file(load, fnd)['data'],
+                                 content[10:410])
+                load['loc'] = len(content)
+                self.assertEqual(roots.serve_file(load, fnd)['data'], '')
+        for handle in roots._HANDLES.values():
+            roots._close_handle(handle)
+        roots._HANDLES.clear()
+
     @skipIf(True, "Update test not yet implemented")
     def test_update(self):
         pass
 
+    @skipIf(not roots.HAS_PYINOTIFY, 'pyinotify is not installed')
+    def test_update_inotify(self):
+        tmp = tempfile.mkdtemp(dir=integration.TMP)
+        root = os.path.join(tmp, 'base')
+        os.makedirs(os.path.join(root, 'sub'))
+        for path in ('a', 'sub/b'):
+            with salt.utils.fopen(os.path.join(root, path), 'w') as fp_:
+                fp_.write(path)
+        opts = {'cachedir': os.path.join(tmp, 'cache'),
+                'file_roots': {'base': [root]},
+                'fileserver_inotify': True,
+                'fileserver_ignoresymlinks': False,
+                'fileserver_followsymlinks': True,
+                'file_ignore_regex': False,
+                'file_ignore_glob': False,
+                'fileserver_list_cache_time': 3600}
+        try:
+            with patch.dict(roots.__opts__, opts):
+                roots.update()
+                self.assertEqual(roots.file_list({'saltenv': 'base'}),
+                                 ['a', 'sub/b'])
+                # A file added to a known directory is patched in the cache
+                with salt.utils.fopen(os.path.join(root, 'sub', 'c'), 'w') as fp_:
+                    fp_.write('c')
+                roots.update()
+                self.assertEqual(roots.file_list({'saltenv': 'base'}),
+                                 ['a', 'sub/b', 'sub/c'])
+                # Removing a directory drops its files from the mtime map
+                shutil.rmtree(os.path.join(root, 'sub'))
+                roots.update()
+                self.assertEqual(roots._TRACKER['mtime_map'].keys(),
+                                 [os.path.join(root, 'a')])
+                self.assertEqual(roots.file_list({'saltenv': 'base'}), ['a'])
+        finally:
+            if roots._TRACKER.get('notifier'):
+                roots._TRACKER['notifier'].stop()
+            roots._TRACKER.clear()
+            shutil.rmtree(tmp)
+
     def test_file_hash(self):
         with patch.dict(roots.__opts__, {'file_roots': self.master_opts['file_roots'],
                                  'fileserver_ignoresymlinks': False,
@@ -105,6 +173,34 @@ class RootsTest(integration.ModuleCase):
             ret = roots.file_hash(load, fnd)
             self.assertDictEqual(ret, {'hsum': '98aa509006628302ce38ce521a7f805f', 'hash_type': 'md5'})
 
+    def test_file_hash_index(self):
+        cachedir = tempfile.mkdtemp(dir=integration.TMP)
+        path = os.path.join(cachedir, 'hashed')
+        with salt.utils.fopen(path, 'w') as fp_:
+            fp_.write('first')
+        load = {'saltenv': 'base', 'path': path}
+        fnd = {'path': path, 'rel': 'hashed'}
+        opts = {'cachedir': cachedir,
+                'hash_type': 'md5',
+                'fileserver_hash_index': True}
+        try:
+            with patch.dict(roots.__opts__, opts):
+                first = roots.file_hash(load, fnd)
+                self.assertEqual(first['hsum'], salt.utils.get_hash(path, 'md5'))
+                with salt.utils.fopen(path, 'w') as fp_:
+                    fp_.write('second')
+                os.utime(path, (1, 1))
+                # Served from the index until the update drops the entry
+                self.assertEqual(roots.file_hash(load, fnd), first)
+                roots._update_hash_index({path: os.path.getmtime(path)})
+                self.assertEqual(roots.file_hash(load, fnd)['hsum'],
+                                 salt.utils.get_hash(path, 'md5'))
+                # The hash computed after the update was journaled
+                self.assertEqual(roots._read_hash_index()[path][1], 1)
+        finally:
+            shutil.rmtree(cachedir)
+            roots._HASH_INDEX.update({'key': None, 'hashes': {}})
+
     def test_file_list_emptydirs(self):
         if integration.TMP_STATE_TREE not in self.master_opts['file_roots']['base']:
             self.skipTest('This test fails when using tests/runtests.py. salt-runtests will be available soon.')
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+'''
+Benchmark the startup of ``salt-call --local test.ping`` with and without the
+virtual module index.
+
+A throw away minion configuration is written under the given directory. The
+cold runs remove the index before starting salt-call, the warm runs reuse the
+index written by the previous run.
+
+    python tests/loader-bench.py -d /tmp/loader-bench -r 5
+'''
+# Import python libs
+import os
+import sys
+import time
+import shutil
+import argparse
+import subprocess
+
+SALT_CALL = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'scripts',
+        'salt-call')
+
+
+def parse():
+    '''
+    Parse the command line
+    '''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d',
+                        dest='root',
+                        default='/tmp/loader-bench',
+                        help='The directory to write the minion configuration in')
+    parser.add_argument('-r',
+                        dest='runs',
+                        type=int,
+                        default=5,
+                        help='The number of runs for each measure')
+    return parser.parse_args()
+
+
+def configure(root, index):
+    '''
+    Write the minion configuration, returns the configuration directory
+    '''
+    conf_dir = os.path.join(root, 'conf')
+    if not os.path.isdir(conf_dir):
+        os.makedirs(conf_dir)
+    with open(os.path.join(conf_dir, 'minion'), 'w+') as fp_:
+        fp_.write('root_dir: {0}\n'.format(root))
+        fp_.write('file_client: local\n')
+        fp_.write('virtual_index: {0}\n'.format(index))
+    return conf_dir
+
+
+def run(conf_dir, runs, clear=None):
+    '''
+    Return the average wall clock time of salt-call test.ping
+    '''
+    total = 0
+    for _ in range(runs):
+        if clear and os.path.isdir(clear):
+            shutil.rmtree(clear)
+        start = time.time()
+        subprocess.check_call(
+            [sys.executable, SALT_CALL, '-c', conf_dir, '--local',
+             '--log-level', 'quiet', 'test.ping'],
+            stdout=open(os.devnull, 'w'))
+        total += time.time() - start
+    return total / runs
+
+
+def main():
+    '''
+    Run the benchmark
+    '''
+    args = parse()
+    index_dir = os.path.join(
+            args.root, 'var', 'cache', 'salt', 'minion', 'loader')
+    conf_dir = configure(args.root, False)
+    print 'salt-call --local test.ping, average of {0} runs'.format(args.runs)
+    print '    no index    {0:8.3f}s'.format(run(conf_dir, args.runs))
+    conf_dir = configure(args.root, True)
+    print '    cold index  {0:8.3f}s'.format(run(conf_dir, args.runs, index_dir))
+    print '    warm index  {0:8.3f}s'.format(run(conf_dir, args.runs))
+
+
+if __name__ == '__main__':
+    main()
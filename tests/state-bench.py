@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python
+'''
+Benchmark the requisite resolution of the state runtime.
+
+A synthetic highstate of test.succeed_without_changes states is run through
+State.call_high with test=True. Every state requires the states before it
+in its sls file, states have an sls requisite on the previous sls file and
+a glob requisite, so the run time is spent resolving requisites. The states
+can also be called by a number of state workers.
+
+    python tests/state-bench.py -c 5000 -r 10 -w 0
+'''
+# Import python libs
+import time
+import shutil
+import tempfile
+import argparse
+
+# Import salt libs
+import salt.config
+import salt.state
+
+
+def parse():
+    '''
+    Parse the command line
+    '''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c',
+                        dest='chunks',
+                        type=int,
+                        default=5000,
+                        help='The number of states in the highstate')
+    parser.add_argument('-s',
+                        dest='sls',
+                        type=int,
+                        default=100,
+                        help='The number of sls files the states are in')
+    parser.add_argument('-r',
+                        dest='requires',
+                        type=int,
+                        default=10,
+                        help='The number of states each state requires')
+    parser.add_argument('-w',
+                        dest='workers',
+                        type=int,
+                        default=0,
+                        help='The number of states called at the same time')
+    return parser.parse_args()
+
+
+def build(chunks, sls_count, requires):
+    '''
+    Return the high data
+    '''
+    high = {}
+    per_sls = max(chunks // sls_count, 1)
+    for num in range(chunks):
+        sls = num // per_sls
+        first = sls * per_sls
+        require = [{'test': 'sls{0}_state{1}'.format(sls, req)}
+                   for req in range(max(first, num - requires), num)]
+        if sls and num == first:
+            require.append({'sls': 'sls{0}'.format(sls - 1)})
+            require.append({'test': 'sls{0}_*'.format(sls - 1)})
+        high['sls{0}_state{1}'.format(sls, num)] = {
+            'test': ['succeed_without_changes', {'require': require}],
+            '__sls__': 'sls{0}'.format(sls),
+            '__env__': 'base'}
+    return high
+
+
+def main():
+    '''
+    Run the benchmark
+    '''
+    args = parse()
+    root = tempfile.mkdtemp()
+    try:
+        opts = salt.config.minion_config(None)
+        opts['root_dir'] = root
+        opts['cachedir'] = root
+        opts['file_client'] = 'local'
+        opts['file_roots'] = {'base': [root]}
+        opts['pillar_roots'] = {'base': [root]}
+        opts['grains'] = {}
+        opts['test'] = True
+        opts['state_events'] = False
+        opts['state_workers'] = args.workers
+        state = salt.state.State(opts)
+        high = build(args.chunks, args.sls, args.requires)
+        start = time.time()
+        ret = state.call_high(high)
+        elapsed = time.time() - start
+        if not isinstance(ret, dict):
+            print(ret)
+            return
+        print('{0} states run in {1:.2f}s, {2} failed'.format(
+            len(ret),
+            elapsed,
+            len([1 for run in ret.values() if run['result'] is False])))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
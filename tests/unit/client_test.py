@@ -3,10 +3,13 @@
     :codeauthor: :email:`Mike Place <mp@saltstack.com>`
 '''
 
+# Import python libs
+import time
+
 # Import Salt Testing libs
 from salttesting import TestCase, skipIf
 from salttesting.helpers import ensure_in_syspath
-from salttesting.mock import patch, NO_MOCK, NO_MOCK_REASON
+from salttesting.mock import patch, MagicMock, NO_MOCK, NO_MOCK_REASON
 ensure_in_syspath('../')
 
 # Import Salt libs
@@ -72,6 +75,118 @@ class LocalClientTestCase(TestCase,
                                   self.client.pub,
                                   'non_existant_group', 'test.ping', expr_form='nodegroup')
 
+    def test_job_progress(self):
+        progress = client.JobProgress('1234', ['m1', 'm2'])
+        self.assertFalse(progress.done)
+        self.assertTrue(progress.add_return('m1'))
+        self.assertFalse(progress.add_return('m1'))
+        # A syndic minion returning before it was announced
+        progress.add_return('s1')
+        progress.add_minions(['s1', 'm1'])
+        self.assertEqual(progress.outstanding, set(['m2']))
+        progress.add_return('m2')
+        self.assertTrue(progress.done)
+        counters = progress.counters()
+        self.assertEqual(
+            (counters['expected'], counters['returned'],
+             counters['outstanding'], counters['unexpected']),
+            (3, 3, 0, 0))
+
+    def test_get_iter_returns(self):
+        local = self.client
+        events = [{'tag': 'salt/job/1234/ret/m1', 'id': 'm1', 'return': True},
+                  {'tag': 'salt/job/1234/ret/m2', 'id': 'm2', 'return': False}]
+        progress = []
+
+        def get_event(wait, tag, **kwargs):
+            self.assertTrue(0 < wait <= 5)
+            progress.append(local.job_progress('1234')['outstanding'])
+            return events.pop(0)
+
+        returners = {'{0}.get_load'.format(local.opts['master_job_cache']):
+                     lambda jid: {'fun': 'test.ping'}}
+        with patch.object(local, 'returners', returners):
+            with patch.object(local.event, 'get_event', get_event):
+                ret = list(local.get_iter_returns('1234', ['m1', 'm2'], 5))
+        self.assertEqual(ret, [{'m1': {'ret': True}}, {'m2': {'ret': False}}])
+        self.assertEqual(progress, [2, 1])
+        self.assertEqual(local.job_progress('1234'), {})
+
+    def test_get_iter_returns_find_job(self):
+        local = self.client
+        events = [{'tag': 'salt/job/1234/ret/m1', 'id': 'm1', 'return': True}]
+        returners = {'{0}.get_load'.format(local.opts['master_job_cache']):
+                     lambda jid: {'fun': 'test.ping'}}
+        gather = MagicMock(return_value={})
+
+        def get_event(wait, tag, **kwargs):
+            if events:
+                return events.pop(0)
+            time.sleep(wait)
+
+        with patch.object(local, 'returners', returners):
+            with patch.object(local.event, 'get_event', get_event):
+                with patch.object(local, 'gather_job_info', gather):
+                    ret = list(local.get_iter_returns(
+                        '1234', ['m1', 'm2', 'm3'], 0.1, expect_minions=True))
+        # A single find_job is sent to the minions which did not return
+        gather.assert_called_once_with('1234', ['m2', 'm3'], 'list', set(['m2', 'm3']))
+        self.assertEqual(ret, [{'m1': {'ret': True}},
+                               {'m2': {'failed': True}},
+                               {'m3': {'failed': True}}])
+
+    def test_get_iter_returns_during_find_job(self):
+        '''
+        A return which came in while find_job ran is still collected
+        '''
+        local = self.client
+        pending = []
+        returners = {'{0}.get_load'.format(local.opts['master_job_cache']):
+                     lambda jid: {'fun': 'test.ping'}}
+
+        def get_event(wait, tag, **kwargs):
+            if pending:
+                return pending.pop(0)
+            time.sleep(min(wait, 0.05))
+
+        def gather(jid, tgt, tgt_type, minions, **kwargs):
+            # m2 returns while find_job is collected, its return is pending
+            pending.append({'tag': 'salt/job/1234/ret/m2', 'id': 'm2',
+                            'return': True})
+            return {}
+
+        with patch.object(local, 'returners', returners):
+            with patch.object(local.event, 'get_event', get_event):
+                with patch.object(local, 'gather_job_info', gather):
+                    ret = list(local.get_iter_returns(
+                        '1234', ['m2'], 0.1, expect_minions=True))
+        self.assertEqual(ret, [{'m2': {'ret': True}}])
+
+    def test_get_returns_pending(self):
+        '''
+        The pending returns are collected past the deadline
+        '''
+        local = self.client
+        events = [{'tag': 'salt/job/1234/new'},
+                  {'tag': 'salt/job/1234/ret/m1', 'id': 'm1', 'return': 1}]
+        returners = {'{0}.get_load'.format(local.opts['master_job_cache']):
+                     lambda jid: {'fun': 'test.ping'}}
+
+        def get_event(wait, tag, **kwargs):
+            self.assertTrue(wait >= 1)
+            if not events:
+                return None
+            raw = events.pop(0)
+            if 'return' not in raw:
+                # The deadline passes, the return is already pending
+                time.sleep(0.2)
+            return raw
+
+        with patch.object(local, 'returners', returners):
+            with patch.object(local.event, 'get_event', get_event):
+                ret = local.get_returns('1234', ['m1', 'm2'], 0.1)
+        self.assertEqual(ret, {'m1': 1})
+
 
 if __name__ == '__main__':
     from integration import run_tests
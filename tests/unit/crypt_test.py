@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+'''
+    tests.unit.crypt_test
+    ~~~~~~~~~~~~~~~~~~~~~
+'''
+
+# Import Salt Testing libs
+from salttesting import TestCase, skipIf
+from salttesting.helpers import ensure_in_syspath
+ensure_in_syspath('../')
+
+# Import Salt libs
+from salt import crypt
+from salt.exceptions import AuthenticationError
+
+HAS_AES = hasattr(crypt, 'AES')
+
+
+class CompareDigestTestCase(TestCase):
+    def test_compare_digest(self):
+        self.assertTrue(crypt.compare_digest('abc', 'abc'))
+        self.assertFalse(crypt.compare_digest('abc', 'abd'))
+        self.assertFalse(crypt.compare_digest('abc', 'ab'))
+
+
+@skipIf(not HAS_AES, 'M2Crypto and PyCrypto are required')
+class CrypticleTestCase(TestCase):
+    def setUp(self):
+        self.crypticle = crypt.Crypticle(
+                {'serial': 'msgpack'},
+                crypt.Crypticle.generate_key_string())
+
+    def test_encrypt_decrypt(self):
+        for size in (0, 1, 15, 16, 17, 4096):
+            data = 'x' * size
+            self.assertEqual(
+                self.crypticle.decrypt(self.crypticle.encrypt(data)), data)
+
+    def test_dumps_loads(self):
+        load = {'fun': 'test.echo', 'arg': ['x' * 100]}
+        self.assertEqual(self.crypticle.loads(self.crypticle.dumps(load)), load)
+
+    def test_tampered(self):
+        data = self.crypticle.encrypt('secret')
+        tampered = data[:-1] + chr(ord(data[-1]) ^ 1)
+        self.assertRaises(AuthenticationError, self.crypticle.decrypt, tampered)
+        self.assertRaises(AuthenticationError, self.crypticle.decrypt, data[:20])
+
+
+if __name__ == '__main__':
+    from integration import run_tests
+    run_tests(CompareDigestTestCase, CrypticleTestCase, needs_daemon=False)
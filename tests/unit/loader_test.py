@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+'''
+    tests.unit.loader_test
+    ~~~~~~~~~~~~~~~~~~~~~~
+'''
+
+# Import python libs
+import os
+import copy
+import shutil
+import tempfile
+import time
+
+# Import Salt Testing libs
+from salttesting import TestCase
+from salttesting.helpers import ensure_in_syspath
+ensure_in_syspath('../')
+
+# Import Salt libs
+import salt.config
+import salt.loader
+import salt.payload
+import salt.utils
+
+
+class VirtualIndexTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.opts = copy.deepcopy(salt.config.DEFAULT_MINION_OPTS)
+        self.opts['cachedir'] = self.tmp_dir
+        self.opts['conf_file'] = None
+        self.opts['extension_modules'] = os.path.join(self.tmp_dir, 'extmods')
+        self.opts['grains'] = salt.loader.grains(self.opts)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_minion_mods(self):
+        '''
+        The same functions are loaded with and without the index
+        '''
+        expected = sorted(salt.loader.minion_mods(self.opts))
+        self.opts['virtual_index'] = True
+        cold = sorted(salt.loader.minion_mods(self.opts))
+        self.assertTrue(os.listdir(os.path.join(self.tmp_dir, 'loader')))
+        warm = sorted(salt.loader.minion_mods(self.opts))
+        self.assertEqual(expected, cold)
+        self.assertEqual(expected, warm)
+
+    def test_lookup(self):
+        '''
+        Stale entries are not trusted
+        '''
+        index = salt.loader.VirtualIndex(
+                self.opts, 'module', ['/nonexistent'], {})
+        path = os.path.join(self.tmp_dir, 'mod.py')
+        with open(path, 'w+') as fp_:
+            fp_.write('')
+        self.assertEqual(index.lookup(path), (False, None))
+        index.record(path, 'virt')
+        self.assertEqual(index.lookup(path), (True, 'virt'))
+        self.assertEqual(index.providers('virt', [path]), [path])
+        self.assertEqual(index.providers('other', [path]), [])
+        self.assertEqual(index.providers('virt', [path, '/nonexistent']), None)
+        index.save()
+
+        index = salt.loader.VirtualIndex(
+                self.opts, 'module', ['/nonexistent'], {})
+        self.assertEqual(index.lookup(path), (True, 'virt'))
+        mtime = os.path.getmtime(path)
+        os.utime(path, (mtime + 10, mtime + 10))
+        self.assertEqual(index.lookup(path), (False, None))
+
+        # A change in the grains drops the index
+        index = salt.loader.VirtualIndex(
+                self.opts, 'module', ['/nonexistent'], {'os': 'other'})
+        self.assertEqual(index.entries, {})
+
+    def test_lazy_returners(self):
+        '''
+        Returners are found by their virtual name and missing ones are cached
+        '''
+        self.opts['virtual_index'] = True
+        functions = salt.loader.minion_mods(self.opts)
+        # Build the index
+        salt.loader.returners(self.opts, functions).load_all()
+
+        returners = salt.loader.returners(self.opts, functions)
+        self.assertIn('carbon.returner', returners)
+        self.assertFalse(returners.loaded)
+        self.assertNotIn('nonexistent.returner', returners)
+        self.assertFalse(returners.loaded)
+        self.assertIn('nonexistent', returners.missing)
+
+
+class GrainsEngineTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.opts = copy.deepcopy(salt.config.DEFAULT_MINION_OPTS)
+        self.opts['cachedir'] = self.tmp_dir
+        self.opts['extension_modules'] = os.path.join(self.tmp_dir, 'extmods')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_settings(self):
+        self.opts['grains_cache_expiration'] = 10
+        self.opts['grains_provider_ttl'] = {'core': 100, 'core.hostname': 1}
+        self.opts['grains_provider_timeout'] = {'core.hostname': 2}
+        engine = salt.loader.GrainsEngine(self.opts, {})
+        self.assertEqual(engine.ttl('core.hostname'), 1)
+        self.assertEqual(engine.ttl('core.os_data'), 100)
+        self.assertEqual(engine.ttl('custom.grains'), 10)
+        self.assertEqual(engine.timeout('core.hostname'), 2)
+        self.assertEqual(engine.timeout('core.os_data'), 0)
+
+    def test_run_threads(self):
+        def slow():
+            time.sleep(0.5)
+            return {'slow': True, 'shared': 'slow'}
+
+        def fail():
+            raise ValueError()
+
+        funcs = {'core.fast': lambda: {'fast': True, 'shared': 'core'},
+                 'custom.fast': lambda: {'shared': 'custom'},
+                 'custom.fail': fail,
+                 'custom.hang': lambda: time.sleep(10),
+                 'custom.slow': slow}
+        self.opts['grains_threads'] = 2
+        self.opts['grains_provider_timeout'] = {'custom.hang': 0.2}
+        engine = salt.loader.GrainsEngine(self.opts, funcs)
+        start = time.time()
+        ret = engine.run(list(funcs))
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual(sorted(ret), ['core.fast', 'custom.fast', 'custom.slow'])
+        self.assertGreaterEqual(engine.timing['custom.slow'], 0.5)
+        grains = salt.loader.GrainsEngine.merge(
+            dict((key, {'data': data}) for key, data in ret.items()))
+        self.assertEqual(grains, {'fast': True, 'slow': True, 'shared': 'slow'})
+
+        funcs['core.fail'] = fail
+        self.assertRaises(ValueError, engine.run, list(funcs))
+
+    def test_gen_grains_cache(self):
+        self.opts['grains_cache'] = True
+        self.opts['grains_threads'] = 4
+        self.opts['grains_provider_ttl'] = {'core.hostname': 0}
+        grains = salt.loader.grains(self.opts)
+        self.assertIn('os', grains)
+        self.assertIn('id', grains)
+
+        cfn = os.path.join(self.tmp_dir, 'grains_providers.cache.p')
+        serial = salt.payload.Serial(self.opts)
+        with salt.utils.fopen(cfn, 'rb') as fp_:
+            before = serial.load(fp_)
+        self.assertIn('core.os_data', before)
+
+        # Only the expired provider is run again
+        time.sleep(0.01)
+        self.assertEqual(sorted(salt.loader.grains(self.opts)), sorted(grains))
+        with salt.utils.fopen(cfn, 'rb') as fp_:
+            after = serial.load(fp_)
+        self.assertEqual(after['core.os_data'], before['core.os_data'])
+        self.assertGreater(after['core.hostname']['time'],
+                           before['core.hostname']['time'])
+
+
+if __name__ == '__main__':
+    from integration import run_tests
+    run_tests(VirtualIndexTestCase, GrainsEngineTestCase, needs_daemon=False)
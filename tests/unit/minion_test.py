@@ -50,6 +50,30 @@ class MinionTestCase(TestCase):
                 result = False
         self.assertTrue(result)
 
+    def test_compound_match(self):
+        opts = {'id': 'web1.example.com',
+                'grains': {'os': 'Ubuntu', 'ipv4': ['10.0.0.1']},
+                'pillar': {'role': 'web'}}
+        matcher = minion.Matcher(opts, {})
+        for tgt, expected in (
+                ('web*', True),
+                ('G@os:Ubuntu and web*', True),
+                ('G@os:Ubuntu and not web*', False),
+                ('db* or ( I@role:web and S@10.0.0.0/8 )', True),
+                ('not G@os:CentOS', False),
+                ('X@foo', False),
+                ('G@os:Ubuntu and', False),
+                ('', False)):
+            self.assertEqual(matcher.compound_match(tgt), expected, tgt)
+            # Again from the compiled target cache
+            self.assertEqual(matcher.compound_match(tgt), expected, tgt)
+        self.assertIn('G@os:Ubuntu and web*', minion._COMPOUND_CACHE)
+
+        # Matchers are only run when their result is needed
+        with patch.object(matcher, 'grain_match') as grain_match:
+            self.assertTrue(matcher.compound_match('web* or G@os:Ubuntu'))
+            self.assertFalse(grain_match.called)
+
 
 if __name__ == '__main__':
     from integration import run_tests
@@ -7,7 +7,10 @@
     ~~~~~~~~~~~~~~~~~~~~~~
 '''
 
+import os
+import shutil
 import tempfile
+import time
 
 # Import Salt Testing libs
 from salttesting import skipIf, TestCase
@@ -128,6 +131,195 @@ class PillarTestCase(TestCase):
         pillar = salt.pillar.Pillar(opts, grains, 'mocked-minion', 'base')
         self.assertEqual(pillar.compile_pillar()['ssh'], 'foo')
 
+    @patch('salt.pillar.salt.fileclient.get_file_client', autospec=True)
+    @patch('salt.pillar.salt.minion.Matcher', autospec=True)
+    def test_top_cache(self, Matcher, get_file_client):
+        opts = {
+            'renderer': 'yaml',
+            'state_top': '',
+            'pillar_roots': [],
+            'extension_modules': '',
+            'environment': 'base',
+            'file_roots': [],
+            'pillar_top_cache': True,
+        }
+        self._setup_test_topfile_mocks(Matcher, get_file_client, 1, 2)
+        salt.pillar._TOP_CACHE.clear()
+        with patch('salt.pillar.compile_template',
+                   wraps=salt.pillar.compile_template) as compile_template:
+            for id_ in ('minion1', 'minion2'):
+                pillar = salt.pillar.Pillar(opts, {}, id_, 'base')
+                self.assertEqual(pillar.compile_pillar()['ssh'], 'bar')
+            top_renders = [call for call in compile_template.call_args_list
+                           if call[0][0] == self.top_file.name]
+            self.assertEqual(len(top_renders), 1)
+
+            # A change of the source renders the top file again
+            self.top_file.write('\n')
+            self.top_file.flush()
+            pillar = salt.pillar.Pillar(opts, {}, 'minion1', 'base')
+            self.assertEqual(pillar.compile_pillar()['ssh'], 'bar')
+            top_renders = [call for call in compile_template.call_args_list
+                           if call[0][0] == self.top_file.name]
+            self.assertEqual(len(top_renders), 2)
+
+        # Templated top files are not cached
+        self.top_file.write('# {{ grains }}\n')
+        self.top_file.flush()
+        pillar = salt.pillar.Pillar(opts, {}, 'minion1', 'base')
+        with patch('salt.pillar.compile_template',
+                   MagicMock(return_value={})) as compile_template:
+            pillar.get_tops()
+            pillar.get_tops()
+            self.assertEqual(compile_template.call_count, 2)
+
+    @patch('salt.pillar.salt.fileclient.get_file_client', autospec=True)
+    def test_render_cache(self, get_file_client):
+        opts = {
+            'renderer': 'yaml_jinja',
+            'state_top': '',
+            'pillar_roots': {'base': []},
+            'file_roots': {'base': []},
+            'extension_modules': '',
+            'environment': 'base',
+            'pillar_render_cache': True,
+        }
+        sls_file = tempfile.NamedTemporaryFile()
+        sls_file.write('''
+{% if grains['os'] == 'Ubuntu' %}
+pkg: apache2
+{% else %}
+pkg: httpd
+{% endif %}
+{% if 'role' in grains %}
+role: {{ grains.role }}
+{% endif %}
+''')
+        sls_file.flush()
+        client = get_file_client.return_value
+        client.get_state.return_value = {'dest': sls_file.name}
+        salt.pillar._SLS_CACHE.clear()
+        stats = salt.pillar.render_cache_stats()
+
+        def render(grains):
+            pillar = salt.pillar.Pillar(opts, grains, 'minion', 'base')
+            return pillar.render_pillar({'base': ['web']})[0]
+
+        self.assertEqual(render({'os': 'Ubuntu', 'kernel': 'Linux'}),
+                         {'pkg': 'apache2'})
+        self.assertEqual(render({'os': 'Ubuntu', 'kernel': 'Darwin'}),
+                         {'pkg': 'apache2'})
+        self.assertEqual(render({'os': 'CentOS'}), {'pkg': 'httpd'})
+        self.assertEqual(render({'os': 'Ubuntu', 'role': 'web'}),
+                         {'pkg': 'apache2', 'role': 'web'})
+        new = salt.pillar.render_cache_stats()
+        self.assertEqual(new['hits'] - stats['hits'], 1)
+        self.assertEqual(new['misses'] - stats['misses'], 3)
+
+        # Templates using the whole grains are not cached
+        sls_file.seek(0)
+        sls_file.truncate()
+        sls_file.write('count: {{ grains|length }}\n')
+        sls_file.flush()
+        self.assertEqual(render({'os': 'Ubuntu'}), {'count': 1})
+        self.assertEqual(render({'os': 'Ubuntu', 'role': 'web'}),
+                         {'count': 2})
+        self.assertEqual(salt.pillar.render_cache_stats()['hits'],
+                         new['hits'])
+
+    @patch('salt.pillar.salt.fileclient.get_file_client', autospec=True)
+    def test_ext_pillar_concurrent(self, get_file_client):
+        opts = {
+            'renderer': 'yaml',
+            'state_top': '',
+            'pillar_roots': {},
+            'file_roots': {},
+            'extension_modules': '',
+            'ext_pillar': [{'first': {'key': 'first'}},
+                           {'hang': {}},
+                           {'fail': {}},
+                           {'second': {'key': 'second'}}],
+            'ext_pillar_threads': 4,
+            'ext_pillar_interface_timeout': {'hang': 0.2},
+            'ext_pillar_interface_ttl': {'first': 60},
+        }
+        calls = []
+
+        def ext(minion_id, pillar, key):
+            calls.append(key)
+            time.sleep(0.1)
+            return {'shared': key, key: minion_id}
+
+        def hang(minion_id, pillar):
+            time.sleep(10)
+
+        def fail(minion_id, pillar):
+            raise ValueError()
+
+        salt.pillar._EXT_PILLAR_CACHE.clear()
+        for id_ in ('minion1', 'minion1', 'minion2'):
+            pillar = salt.pillar.Pillar(opts, {}, id_, 'base')
+            pillar.ext_pillars = {'first': ext,
+                                  'second': ext,
+                                  'hang': hang,
+                                  'fail': fail}
+            start = time.time()
+            ret = pillar.ext_pillar({'sls': True}, {})
+            self.assertLess(time.time() - start, 2)
+            self.assertEqual(ret, {'sls': True,
+                                   'shared': 'second',
+                                   'first': id_,
+                                   'second': id_})
+        # The first interface is only run once for each minion
+        self.assertEqual(sorted(calls), ['first', 'first',
+                                         'second', 'second', 'second'])
+
+    @patch('salt.pillar.salt.transport.Channel.factory')
+    def test_compact_master_opts(self, factory):
+        master_dir = tempfile.mkdtemp()
+        minion_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, master_dir)
+        self.addCleanup(shutil.rmtree, minion_dir)
+        master_opts = {'cachedir': master_dir, 'serial': 'msgpack'}
+
+        def mopts(id_):
+            return {'id': id_,
+                    'environment': None,
+                    'file_roots': {'base': ['/srv/salt']},
+                    'worker_threads': 5}
+
+        data = salt.pillar.compact_master_opts(
+            master_opts, {'foo': 'bar', 'master': mopts('minion1')})
+        ref = data['master']
+        self.assertEqual(sorted(ref), ['__master_opts__', 'environment', 'id'])
+        self.assertEqual(ref['id'], 'minion1')
+        other = salt.pillar.compact_master_opts(
+            master_opts, {'master': mopts('minion2')})['master']
+        self.assertEqual(other['__master_opts__'], ref['__master_opts__'])
+        self.assertEqual(
+            salt.pillar.get_master_opts(master_opts, ref['__master_opts__']),
+            {'file_roots': {'base': ['/srv/salt']}, 'worker_threads': 5})
+        self.assertFalse(salt.pillar.get_master_opts(master_opts, '../x'))
+        # Byte strings which are not UTF-8 can't be hashed, no reference
+        raw = dict(mopts('minion3'), motd='\xff\xfe')
+        self.assertEqual(salt.pillar.compact_master_opts(
+            master_opts, {'master': dict(raw)})['master'], raw)
+
+        # The minion asks the master once and caches the opts
+        channel = factory.return_value
+        channel.send.side_effect = lambda load, **kwargs: \
+            salt.pillar.get_master_opts(master_opts, load['opts_hash'])
+        remote = salt.pillar.RemotePillar(
+            {'cachedir': minion_dir, 'serial': 'msgpack'},
+            {}, 'minion1', 'base')
+        for _ in range(2):
+            ret = remote.expand_master_opts(
+                {'foo': 'bar', 'master': dict(ref)})
+            self.assertEqual(ret, {'foo': 'bar', 'master': mopts('minion1')})
+        self.assertEqual(channel.send.call_count, 1)
+        self.assertEqual(
+            len(os.listdir(os.path.join(minion_dir, 'pillar_opts'))), 1)
+
     def _setup_test_topfile_mocks(self, Matcher, get_file_client,
             nodegroup_order, glob_order):
         # Write a simple topfile and two pillar state files
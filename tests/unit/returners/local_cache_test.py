@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+'''
+    tests.unit.returners.local_cache_test
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+'''
+
+# Import python libs
+import os
+import shutil
+import tempfile
+
+# Import Salt Testing libs
+from salttesting import TestCase
+from salttesting.helpers import ensure_in_syspath
+
+ensure_in_syspath('../../')
+
+# Import salt libs
+import salt.utils
+from salt.returners import local_cache
+
+
+class LocalCacheCleanOldJobsTestCase(TestCase):
+    '''
+    Test the expiry buckets used to reap the local job cache
+    '''
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        local_cache.__opts__ = {'cachedir': self.tmp,
+                                'hash_type': 'md5',
+                                'serial': 'msgpack',
+                                'keep_jobs': 24,
+                                'keep_jobs_reap_limit': 0}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _old_job(self, jid):
+        jid_dir = local_cache._jid_dir(jid)
+        os.makedirs(jid_dir)
+        with salt.utils.fopen(os.path.join(jid_dir, 'jid'), 'w+') as fn_:
+            fn_.write(jid)
+        return jid_dir
+
+    def test_seed_walk(self):
+        old = self._old_job('20010101000000000000')
+        new = local_cache._jid_dir(local_cache.prep_jid())
+        ret = local_cache.clean_old_jobs()
+        self.assertEqual(ret['deleted'], 1)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+        self.assertTrue(os.path.isfile(os.path.join(
+            local_cache._expiry_dir(), local_cache.EXPIRY_SEEDED)))
+
+    def test_buckets(self):
+        new = local_cache._jid_dir(local_cache.prep_jid())
+        local_cache.clean_old_jobs()
+        old = [self._old_job('2001010100000000000{0}'.format(num))
+               for num in range(3)]
+        for num in range(3):
+            local_cache._add_expiry('2001010100000000000{0}'.format(num))
+
+        local_cache.__opts__['keep_jobs_reap_limit'] = 2
+        ret = local_cache.clean_old_jobs()
+        self.assertEqual(ret['deleted'], 2)
+        self.assertTrue(ret['pending'])
+        self.assertEqual(len([x for x in old if os.path.exists(x)]), 1)
+
+        ret = local_cache.clean_old_jobs()
+        self.assertEqual(ret['deleted'], 1)
+        self.assertFalse(ret['pending'])
+        self.assertFalse(any(os.path.exists(x) for x in old))
+        self.assertTrue(os.path.exists(new))
+        self.assertFalse(os.path.exists(
+            os.path.join(local_cache._expiry_dir(), '2001010100')))
+
+
+if __name__ == '__main__':
+    from integration import run_tests
+    run_tests(LocalCacheCleanOldJobsTestCase, needs_daemon=False)
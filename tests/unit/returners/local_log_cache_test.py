@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+'''
+    tests.unit.returners.local_log_cache_test
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+'''
+
+# Import python libs
+import os
+import shutil
+import tempfile
+
+# Import Salt Testing libs
+from salttesting import TestCase
+from salttesting.helpers import ensure_in_syspath
+
+ensure_in_syspath('../../')
+
+# Import salt libs
+from salt.returners import local_log_cache
+
+
+class LocalLogCacheTestCase(TestCase):
+    '''
+    Test the append-only local job cache
+    '''
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        local_log_cache.__opts__ = {'cachedir': self.tmp,
+                                    'pki_dir': self.tmp,
+                                    'transport': 'zeromq',
+                                    'serial': 'msgpack',
+                                    'keep_jobs': 24}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_job_lifecycle(self):
+        jid = local_log_cache.prep_jid()
+        load = {'fun': 'test.ping', 'arg': [], 'tgt': '*', 'jid': jid}
+        local_log_cache.save_load(jid, load)
+        local_log_cache.returner({'jid': jid, 'id': 'web1', 'return': True})
+        local_log_cache.returner({'jid': jid, 'id': 'web2', 'return': True,
+                                  'out': 'nested'})
+        # A replayed return does not replace the first one
+        local_log_cache.returner({'jid': jid, 'id': 'web1', 'return': False})
+
+        self.assertEqual(local_log_cache.get_load(jid)['fun'], 'test.ping')
+        self.assertEqual(local_log_cache.get_jid(jid),
+                         {'web1': {'return': True},
+                          'web2': {'return': True, 'out': 'nested'}})
+        jids = local_log_cache.get_jids()
+        self.assertEqual(jids.keys(), [jid])
+        self.assertEqual(jids[jid]['Function'], 'test.ping')
+        # Everything about the job lives in one log and one index file
+        bucket = os.path.join(self.tmp, 'jobs_log', jid[:10])
+        self.assertEqual(sorted(os.listdir(bucket)),
+                         ['{0}.log'.format(jid), 'index.log'])
+
+    def test_unknown_jid(self):
+        self.assertFalse(local_log_cache.returner(
+            {'jid': '20140101000000000000', 'id': 'web1', 'return': True}))
+        self.assertEqual(local_log_cache.get_jid('20140101000000000000'), {})
+
+    def test_nocache(self):
+        jid = local_log_cache.prep_jid(nocache=True)
+        local_log_cache.returner({'jid': jid, 'id': 'web1', 'return': True})
+        self.assertEqual(local_log_cache.get_jid(jid), {})
+
+    def test_clean_old_jobs(self):
+        jid = local_log_cache.prep_jid()
+        old = os.path.join(self.tmp, 'jobs_log', '2001010100')
+        os.makedirs(old)
+        local_log_cache.clean_old_jobs()
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(
+            os.path.join(self.tmp, 'jobs_log', jid[:10])))
+
+    def test_clean_old_jobs_limit(self):
+        '''
+        At most keep_jobs_reap_limit jobs are removed per run, oldest first
+        '''
+        local_log_cache.__opts__['keep_jobs_reap_limit'] = 3
+        for bucket, count in (('2001010100', 2), ('2001010101', 2)):
+            b_path = os.path.join(self.tmp, 'jobs_log', bucket)
+            os.makedirs(b_path)
+            for num in range(count):
+                open(os.path.join(
+                    b_path, '{0}000000000{1}.log'.format(bucket, num)),
+                    'w').close()
+        ret = local_log_cache.clean_old_jobs()
+        self.assertEqual((ret['deleted'], ret['pending']), (3, True))
+        self.assertEqual(
+            os.listdir(os.path.join(self.tmp, 'jobs_log')), ['2001010101'])
+        ret = local_log_cache.clean_old_jobs()
+        self.assertEqual((ret['deleted'], ret['pending']), (1, False))
+        self.assertEqual(os.listdir(os.path.join(self.tmp, 'jobs_log')), [])
+
+
+if __name__ == '__main__':
+    from integration import run_tests
+    run_tests(LocalLogCacheTestCase, needs_daemon=False)
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+'''
+    tests.unit.state_test
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Test the requisite index, the parallel calls, the compile cache and the
+    file prefetch of the state runtime
+'''
+
+# Import python libs
+import os
+import shutil
+import fnmatch
+import tempfile
+
+# Import Salt Testing libs
+from salttesting import TestCase
+from salttesting.helpers import ensure_in_syspath
+from salttesting.mock import MagicMock, patch
+ensure_in_syspath('../')
+
+# Import salt libs
+import salt.config
+import salt.fileclient
+import salt.fileserver
+import salt.transport
+from salt.state import HighState, RequisiteIndex, State, file_refs
+
+CHUNKS = [
+    {'state': 'pkg', 'name': 'nginx', '__id__': 'nginx', '__sls__': 'web'},
+    {'state': 'service', 'name': 'nginx', '__id__': 'nginx',
+     '__sls__': 'web'},
+    {'state': 'file', 'name': '/etc/nginx/nginx.conf', '__id__': 'web',
+     '__sls__': 'web'},
+    {'state': 'file', 'name': '/etc/nginx/sites.conf', '__id__': 'sites',
+     '__sls__': 'web.sites'},
+    {'state': 'cmd', 'name': 'reload', '__id__': 'reload',
+     '__sls__': 'web.sites'},
+]
+
+
+def _scan(chunks, req_key, req_val):
+    '''
+    Find the chunks of a requisite the way the state runtime did before the
+    index
+    '''
+    ret = []
+    for chunk in chunks:
+        if (fnmatch.fnmatch(chunk['name'], req_val) or
+                fnmatch.fnmatch(chunk['__id__'], req_val)):
+            if chunk['state'] == req_key:
+                ret.append(chunk)
+        elif req_key == 'sls':
+            if fnmatch.fnmatch(chunk['__sls__'], req_val):
+                ret.append(chunk)
+    return ret
+
+
+class RequisiteIndexTestCase(TestCase):
+    def test_find(self):
+        index = RequisiteIndex(CHUNKS)
+        for req_key, req_val in (('pkg', 'nginx'),
+                                 ('service', 'nginx'),
+                                 ('file', 'web'),
+                                 ('file', '/etc/nginx/*'),
+                                 ('file', '/etc/nginx/[ns]*.conf'),
+                                 ('cmd', 'nginx'),
+                                 ('sls', 'web'),
+                                 ('sls', 'web.*'),
+                                 ('sls', 'web*'),
+                                 ('sls', 'missing'),
+                                 ('pkg', 'ngin?')):
+            self.assertEqual(index.find(req_key, req_val),
+                             _scan(CHUNKS, req_key, req_val))
+
+    def test_sls_skips_named_chunks(self):
+        '''
+        An sls requisite does not find the chunks whose name or id is the
+        name of the sls
+        '''
+        index = RequisiteIndex(CHUNKS)
+        self.assertEqual(index.find('sls', 'web'), [CHUNKS[0], CHUNKS[1]])
+
+
+class StateWorkersTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.opts = salt.config.minion_config(None)
+        self.opts['root_dir'] = self.tmp_dir
+        self.opts['cachedir'] = self.tmp_dir
+        self.opts['file_client'] = 'local'
+        self.opts['file_roots'] = {'base': [self.tmp_dir]}
+        self.opts['pillar_roots'] = {'base': [self.tmp_dir]}
+        self.opts['grains'] = {}
+        self.opts['test'] = True
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def _high(self):
+        high = {}
+
+        def add(id_, fun, **kwargs):
+            high[id_] = {
+                'test': [fun] + [{key: val} for key, val in kwargs.items()],
+                '__sls__': id_.split('_')[0],
+                '__env__': 'base'}
+
+        for num in range(10):
+            add('one_{0}'.format(num), 'succeed_without_changes')
+            add('two_{0}'.format(num), 'succeed_without_changes',
+                require=[{'test': 'one_{0}'.format(num)}])
+        add('three_bad', 'fail_without_changes', require=[{'sls': 'two'}])
+        add('three_after', 'succeed_without_changes',
+            require=[{'test': 'three_bad'}])
+        add('three_onfail', 'succeed_without_changes',
+            onfail=[{'test': 'three_bad'}])
+        add('three_changes', 'succeed_with_changes')
+        add('three_onchanges', 'succeed_without_changes',
+            onchanges=[{'test': 'three_changes'}])
+        add('three_watch', 'succeed_without_changes',
+            watch=[{'test': 'three_changes'}])
+        add('three_missing', 'succeed_without_changes',
+            require=[{'test': 'missing'}])
+        add('three_prereq', 'succeed_without_changes',
+            prereq=[{'test': 'zz_changes'}])
+        add('zz_changes', 'succeed_with_changes')
+        return high
+
+    def _run(self, workers):
+        self.opts['state_workers'] = workers
+        ret = State(self.opts).call_high(self._high())
+        return dict((tag, (run['result'], run['comment'], run['__run_num__']))
+                    for tag, run in ret.items())
+
+    def test_workers(self):
+        '''
+        Calling the states in parallel returns the same results, in the same
+        order, as calling them one after another
+        '''
+        if not hasattr(os, 'fork'):
+            self.skipTest('The state workers need os.fork')
+        self.assertEqual(self._run(4), self._run(0))
+
+
+class CompileCacheTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.roots = os.path.join(self.tmp_dir, 'roots')
+        os.makedirs(self.roots)
+        self.opts = salt.config.minion_config(None)
+        self.opts['root_dir'] = self.tmp_dir
+        self.opts['cachedir'] = self.tmp_dir
+        self.opts['file_client'] = 'local'
+        self.opts['file_roots'] = {'base': [self.roots]}
+        self.opts['pillar_roots'] = {'base': [self.roots]}
+        self.opts['grains'] = {'os': 'Debian'}
+        self.opts['test'] = True
+        self.opts['pillar_opts'] = False
+        self.opts['autoload_dynamic_modules'] = False
+        self.opts['state_compile_cache'] = True
+        self._write('top.sls', "base:\n  '*':\n    - web\n")
+        self._write('web.sls', "{% from 'map.jinja' import comment %}\n"
+                               "web:\n  test.succeed_without_changes:\n"
+                               "    - name: {{ comment }}\n")
+        self._write('map.jinja', "{% set comment = 'one' %}\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def _write(self, name, data):
+        with open(os.path.join(self.roots, name), 'w') as fp_:
+            fp_.write(data)
+
+    def _run(self, compiled=False):
+        highstate = HighState(self.opts)
+        if compiled:
+            highstate.render_highstate = None
+        ret = highstate.call_highstate()
+        return [run['name'] for run in ret.values()]
+
+    def test_compile_cache(self):
+        '''
+        The compiled chunks run until a file imported by a template changes
+        '''
+        self.assertEqual(self._run(), ['one'])
+        self.assertEqual(self._run(compiled=True), ['one'])
+        self.opts['grains']['os'] = 'Arch'
+        self.assertEqual(self._run(), ['one'])
+        self._write('map.jinja', "{% set comment = 'two' %}\n")
+        self.assertEqual(self._run(), ['two'])
+        self.assertEqual(self._run(compiled=True), ['two'])
+
+    def test_compile_cache_bytes(self):
+        '''
+        Grains holding non UTF-8 byte strings disable the cache
+        '''
+        self.opts['grains']['serial'] = '\xff\xfe'
+        self.assertEqual(self._run(), ['one'])
+        self.assertFalse(os.path.exists(
+            os.path.join(self.tmp_dir, 'highstate.compiled.p')))
+        self.assertEqual(self._run(), ['one'])
+
+
+class FileserverChannel(object):
+    '''
+    Send the file client requests to a local fileserver
+    '''
+    auth = True
+
+    def __init__(self, opts):
+        self.fileserver = salt.fileserver.Fileserver(opts)
+        self.cmds = []
+
+    def send(self, load):
+        self.cmds.append(load['cmd'])
+        load = dict(load)
+        return getattr(self.fileserver, load.pop('cmd')[1:])(load)
+
+
+class PrefetchTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.roots = os.path.join(self.tmp_dir, 'roots')
+        os.makedirs(self.roots)
+        for name in ('a.txt', 'b.txt'):
+            with open(os.path.join(self.roots, name), 'w') as fp_:
+                fp_.write(name)
+        self.opts = salt.config.minion_config(None)
+        self.opts['root_dir'] = self.tmp_dir
+        self.opts['cachedir'] = os.path.join(self.tmp_dir, 'minion')
+        self.opts['file_client'] = 'local'
+        self.opts['file_roots'] = {'base': [self.roots]}
+        self.opts['pillar_roots'] = {'base': [self.roots]}
+        self.opts['grains'] = {}
+        self.opts['state_prefetch_files'] = 2
+        master_opts = salt.config.master_config(None)
+        master_opts['cachedir'] = os.path.join(self.tmp_dir, 'master')
+        master_opts['file_roots'] = {'base': [self.roots]}
+        self.channel = FileserverChannel(master_opts)
+        self.chunks = [
+            {'state': 'file', 'fun': 'managed', '__env__': 'base',
+             'name': '/tmp/a', 'source': 'salt://a.txt'},
+            {'state': 'file', 'fun': 'managed', '__env__': 'base',
+             'name': '/tmp/b', 'source': ['salt://b.txt', 'salt://c.txt']},
+            {'state': 'file', 'fun': 'recurse', '__env__': 'base',
+             'name': '/tmp/d', 'source': 'salt://d?saltenv=dev'}]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_file_refs(self):
+        self.assertEqual(
+            file_refs(self.chunks),
+            {'base': set(['salt://a.txt', 'salt://b.txt', 'salt://c.txt'])})
+
+    def test_prefetch(self):
+        '''
+        The files are hashed in one request, and then fetched from the cache
+        without asking the master
+        '''
+        state = State(self.opts)
+        state.opts['file_client'] = 'remote'
+        with patch('salt.transport.Channel.factory',
+                   return_value=self.channel):
+            hashes = state.prefetch_files(self.chunks)
+            self.assertEqual(sorted(hashes),
+                             [('base', 'salt://a.txt'),
+                              ('base', 'salt://b.txt')])
+            self.assertEqual(sorted(self.channel.cmds),
+                             ['_file_hashes'] + ['_serve_file'] * 4)
+
+            del self.channel.cmds[:]
+            client = salt.fileclient.get_file_client(state.opts)
+            with salt.fileclient.known_hashes(hashes):
+                dest = client.cache_file('salt://a.txt')
+            self.assertEqual(self.channel.cmds, [])
+            with open(dest) as fp_:
+                self.assertEqual(fp_.read(), 'a.txt')
+
+            # The file client of the cp module is reused, the connections of
+            # the fetch threads are dropped
+            with patch('salt.fileclient.get_file_client',
+                       side_effect=AssertionError), \
+                    patch('salt.transport.ZeroMQChannel.clear_thread_sreqs') \
+                    as clear:
+                state.prefetch_files(self.chunks)
+            self.assertEqual(len(clear.call_args[0][0]), 2)
+
+    def test_clear_thread_sreqs(self):
+        sreq_cache = {('tcp://master', os.getpid(), 'MainThread'): MagicMock(),
+                      ('tcp://master', os.getpid(), 'Thread-1'): MagicMock(),
+                      ('tcp://master', 1, 'Thread-1'): MagicMock()}
+        sreq = sreq_cache[('tcp://master', os.getpid(), 'Thread-1')]
+        with patch.dict(salt.transport.ZeroMQChannel.sreq_cache, sreq_cache,
+                        clear=True):
+            salt.transport.ZeroMQChannel.clear_thread_sreqs(['Thread-1'])
+            self.assertEqual(
+                sorted(salt.transport.ZeroMQChannel.sreq_cache),
+                [('tcp://master', 1, 'Thread-1'),
+                 ('tcp://master', os.getpid(), 'MainThread')])
+        sreq.destroy.assert_called_once_with()
+
+    def test_manifest(self):
+        '''
+        The files of a directory are listed and hashed in one request, the
+        files already in the cache are not hashed again on the master
+        '''
+        os.makedirs(os.path.join(self.roots, 'dir'))
+        for name in ('c.txt', 'd.txt'):
+            with open(os.path.join(self.roots, 'dir', name), 'w') as fp_:
+                fp_.write(name)
+        manifest = self.channel.fileserver.file_manifest(
+            {'saltenv': 'base', 'paths': ['a.txt', 'missing.txt']})
+        self.assertEqual(list(manifest), ['a.txt'])
+        self.assertEqual(manifest['a.txt']['size'], 5)
+        with patch('salt.transport.Channel.factory',
+                   return_value=self.channel):
+            client = salt.fileclient.RemoteClient(self.opts)
+            self.assertEqual(len(client.cache_dir('salt://dir')), 2)
+            self.assertEqual(sorted(self.channel.cmds),
+                             ['_file_manifest'] + ['_serve_file'] * 4)
+            del self.channel.cmds[:]
+            self.assertEqual(len(client.cache_dir('salt://dir')), 2)
+            self.assertEqual(self.channel.cmds, ['_file_manifest'])
+
+        # The local files are only located, not hashed
+        client = salt.fileclient.LocalClient(self.opts)
+        with patch.object(client, 'hash_file', side_effect=AssertionError):
+            self.assertEqual(
+                sorted(client.cache_dir('salt://dir')),
+                [os.path.join(self.roots, 'dir', name)
+                 for name in ('c.txt', 'd.txt')])
+        # Unless the manifest is asked for, e.g. by cp.file_manifest
+        manifest = client.file_manifest('base', 'dir', lazy=False)
+        self.assertEqual(sorted(manifest), ['dir/c.txt', 'dir/d.txt'])
+        self.assertEqual(manifest['dir/c.txt']['hash_type'], 'md5')
+        self.assertIn('hsum', manifest['dir/c.txt'])
+        self.assertIn('size', manifest['dir/c.txt'])
+        self.assertIn('mode', manifest['dir/c.txt'])
+
+
+if __name__ == '__main__':
+    from integration import run_tests
+    run_tests([RequisiteIndexTestCase, StateWorkersTestCase,
+               CompileCacheTestCase, PrefetchTestCase],
+              needs_daemon=False)
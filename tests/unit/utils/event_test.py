@@ -285,6 +285,54 @@ class TestSaltEvent(TestCase):
                 self.assertGotEvent(evt, {'data': '{0}'.format(i)}, 'Event {0}'.format(i))
 
 
+class SubscriptionRegistryTestCase(TestCase):
+    def _evt(self, tag, data=None):
+        return {'tag': tag, 'data': data}
+
+    def test_route_to_prefixes(self):
+        reg = event.SubscriptionRegistry()
+        reg.retain(['salt/job/1', 'salt/job/1/ret'])
+        self.assertTrue(reg.route(self._evt('salt/job/1/ret/minion', 1)))
+        self.assertFalse(reg.route(self._evt('salt/job/2/ret/minion', 2)))
+        self.assertTrue(reg.route(self._evt('salt/job/1/new', 3)))
+        # An event queued for two prefixes is only consumed once
+        self.assertEqual(reg.pop('salt/job/1/ret')['data'], 1)
+        self.assertEqual(reg.pop('salt/job/1')['data'], 3)
+        self.assertIsNone(reg.pop('salt/job/1'))
+        self.assertIsNone(reg.pop('salt/job/2'))
+
+    def test_subscribe_backfill(self):
+        reg = event.SubscriptionRegistry()
+        reg.retain([''])
+        reg.route(self._evt('salt/job/1/ret/a', 1))
+        reg.route(self._evt('salt/auth', 2))
+        reg.route(self._evt('salt/job/1/ret/b', 3))
+        reg.retain(['', 'salt/job/1'])
+        self.assertEqual(reg.pop('salt/job/1')['data'], 1)
+        self.assertEqual(reg.pop('')['data'], 2)
+        self.assertEqual(reg.pop('salt/job/1')['data'], 3)
+        self.assertIsNone(reg.pop(''))
+
+    def test_retain_drops_unrelated(self):
+        reg = event.SubscriptionRegistry()
+        reg.retain(['salt/job/1', 'salt/job/2'])
+        reg.route(self._evt('salt/job/2/ret/a'))
+        reg.retain(['salt/job/1'])
+        self.assertEqual(reg.prefixes, set(['salt/job/1']))
+        self.assertEqual(reg.root.children.keys(), ['s'])
+        reg.retain(['salt/job/2'])
+        self.assertIsNone(reg.pop('salt/job/2'))
+
+    def test_bounded_queue(self):
+        reg = event.SubscriptionRegistry(maxlen=3)
+        reg.retain(['salt'])
+        for num in range(5):
+            reg.route(self._evt('salt/{0}'.format(num), num))
+        self.assertEqual([reg.pop('salt')['data'] for _ in range(3)],
+                         [2, 3, 4])
+        self.assertIsNone(reg.pop('salt'))
+
+
 if __name__ == '__main__':
     from integration import run_tests
-    run_tests(TestSaltEvent, needs_daemon=False)
+    run_tests(TestSaltEvent, SubscriptionRegistryTestCase, needs_daemon=False)
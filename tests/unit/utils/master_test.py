@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+'''
+    tests.unit.utils.master_test
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Test the pillar compile pool
+'''
+
+# Import python libs
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+# Import Salt Testing libs
+from salttesting import TestCase
+from salttesting.helpers import ensure_in_syspath
+ensure_in_syspath('../../')
+
+# Import salt libs
+import salt.payload
+import salt.pillar
+from salt.utils import master
+
+# Import third party libs
+import zmq
+
+
+class PillarPoolTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.opts = {'sock_dir': self.tmp_dir,
+                     'serial': 'msgpack',
+                     'loop_interval': 60,
+                     'pillar_queue_depth': 1}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_queue(self):
+        pool = master.PillarPool(self.opts)
+        self.assertTrue(pool.submit('c1', 'r1', now=0))
+        self.assertFalse(pool.submit('c2', 'r2', now=0))
+        self.assertEqual(list(pool.dispatch(now=1)), [])
+
+        pool.ready('w1')
+        self.assertEqual(list(pool.dispatch(now=2)), [('w1', 'c1', 'r1')])
+        self.assertTrue(pool.submit('c3', 'r3', now=2))
+        # The minions which do not understand the busy answer always wait
+        self.assertTrue(pool.submit('c4', 'r4', now=2, busy_ok=False))
+        self.assertEqual(pool.done('w1', now=5), 'c1')
+        self.assertEqual(list(pool.dispatch(now=6)), [('w1', 'c3', 'r3')])
+
+        stats = pool.stats()
+        self.assertEqual(stats['workers'], 1)
+        self.assertEqual(stats['active'], 1)
+        self.assertEqual(stats['queued'], 1)
+        self.assertEqual(stats['completed'], 1)
+        self.assertEqual(stats['rejected'], 1)
+        self.assertEqual(stats['wait_max'], 4)
+        self.assertEqual(stats['wait_avg'], 3)
+        self.assertEqual(stats['compile_avg'], 3)
+
+    def test_lost_worker(self):
+        '''
+        The request of a worker which died or started over is failed
+        '''
+        pool = master.PillarPool(self.opts)
+        proc = subprocess.Popen(['true'])
+        self.addCleanup(proc.wait)
+        pool.ready('w1', pid=os.getpid())
+        pool.ready('w2', pid=proc.pid)
+        pool.submit('c1', 'r1', now=0)
+        pool.submit('c2', 'r2', now=0, busy_ok=False)
+        self.assertEqual(list(pool.dispatch(now=0)),
+                         [('w1', 'c1', 'r1'), ('w2', 'c2', 'r2')])
+
+        # w2 exited and was not reaped, it is a zombie
+        time.sleep(0.5)
+        self.assertEqual(pool.reap(), ['c2'])
+        # w1 hit an error and connects again
+        self.assertEqual(pool.ready('w3', pid=os.getpid()), ['c1'])
+        self.assertEqual(pool.done('w1'), None)
+
+        stats = pool.stats()
+        self.assertEqual(stats['workers'], 1)
+        self.assertEqual(stats['active'], 0)
+        self.assertEqual(stats['failed'], 2)
+
+    def test_pool(self):
+        '''
+        Requests are compiled by the workers, or rejected when the queue is
+        full and the minion understands the busy answer
+        '''
+        serial = salt.payload.Serial(self.opts)
+        pool = master.PillarPool(self.opts)
+        pool.start()
+        self.addCleanup(pool.terminate)
+
+        release = threading.Event()
+
+        def worker():
+            context = zmq.Context()
+            socket = context.socket(zmq.REQ)
+            socket.connect('ipc://' + pool.worker_sock)
+            socket.send(master.PILLAR_READY)
+            client, empty, package = socket.recv_multipart()
+            release.wait()
+            load = serial.loads(package)
+            socket.send_multipart(
+                [client, empty, serial.dumps({'pillar': load['id']})])
+            socket.close()
+
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+
+        rets = {}
+
+        def request(id_, busy_ok=True):
+            rets[id_] = master.PillarPoolCli(self.opts).compile(
+                {'id': id_, 'busy_ok': busy_ok})
+
+        # One request is compiled, one waits and the third one is rejected
+        self.opts['pillar_pool_timeout'] = 5
+        time.sleep(0.5)
+        clients = []
+        for id_ in ('minion1', 'minion2'):
+            clients.append(threading.Thread(target=request, args=(id_,)))
+            clients[-1].daemon = True
+            clients[-1].start()
+            time.sleep(0.5)
+        request('minion3')
+        self.assertEqual(rets['minion3'], {salt.pillar.PILLAR_BUSY: True})
+        # An older minion waits, the MWorker compiles it when the time is up
+        self.opts['pillar_pool_timeout'] = 1
+        request('minion4', busy_ok=False)
+        self.assertIsNone(rets['minion4'])
+
+        release.set()
+        thread.join(5)
+        clients[0].join(5)
+        self.assertEqual(rets['minion1'], {'pillar': 'minion1'})
+
+
+if __name__ == '__main__':
+    from integration import run_tests
+    run_tests(PillarPoolTestCase, needs_daemon=False)
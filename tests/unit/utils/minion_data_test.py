@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+'''
+    tests.unit.utils.minion_data_test
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Test the minion data cache backends
+'''
+
+# Import python libs
+import os
+import shutil
+import tempfile
+
+# Import Salt Testing libs
+from salttesting import TestCase
+from salttesting.helpers import ensure_in_syspath
+ensure_in_syspath('../../')
+
+# Import salt libs
+import salt.daemons.masterapi
+from salt.utils import minion_data
+
+
+class MinionDataStoreTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.opts = {'cachedir': self.tmp_dir,
+                     'serial': 'msgpack',
+                     'minion_data_cache_batch_size': 2,
+                     'minion_data_cache_batch_interval': 60}
+        self.grains = {'os': 'Debian', 'ipv4': ['10.0.0.1']}
+        self.pillar = {'role': {'name': 'web'}}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def _check_reads(self, store):
+        store.store('minion1', self.grains, self.pillar)
+        store.store('minion2', {'os': 'Arch'}, None)
+        self.assertEqual(store.ids(), set(['minion1', 'minion2']))
+        self.assertEqual(store.grains(['minion1', 'minion3']),
+                         {'minion1': self.grains})
+        self.assertEqual(store.pillar(),
+                         {'minion1': self.pillar, 'minion2': None})
+        self.assertEqual(store.get('os'),
+                         {'minion1': 'Debian', 'minion2': 'Arch'})
+        self.assertEqual(store.get('role:name', 'pillar', ['minion1']),
+                         {'minion1': 'web'})
+        self.assertEqual(store.fetch(['minion1']),
+                         {'minion1': {'grains': self.grains,
+                                      'pillar': self.pillar}})
+        store.remove('minion2')
+        self.assertEqual(store.ids(), set(['minion1']))
+        store.store('minion3', {}, {})
+        store.prune(['minion3'])
+        self.assertEqual(store.ids(), set(['minion3']))
+
+    def _check_mine(self, store):
+        store.mine_update('minion1', {'network.ip_addrs': ['10.0.0.1'],
+                                      'test.ping': True})
+        store.mine_update('minion2', {'network.ip_addrs': ['10.0.0.2']})
+        self.assertEqual(store.mine_get('network.ip_addrs'),
+                         {'minion1': ['10.0.0.1'], 'minion2': ['10.0.0.2']})
+        self.assertEqual(store.mine_get('network.ip_addrs', ['minion2']),
+                         {'minion2': ['10.0.0.2']})
+        store.mine_update('minion1', {'grains.items': {}}, clear=True)
+        self.assertEqual(store.mine_fetch(['minion1']),
+                         {'minion1': {'grains.items': {}}})
+        store.mine_delete('minion2', 'network.ip_addrs')
+        self.assertEqual(store.mine_get('network.ip_addrs'), {})
+        store.mine_update('minion2', {'test.ping': True})
+        store.mine_flush('minion1')
+        store.mine_flush('minion3')
+        self.assertEqual(store.mine_fetch(),
+                         {'minion2': {'test.ping': True}})
+
+    def test_files(self):
+        self._check_reads(minion_data.FileStore(self.opts))
+        self._check_mine(minion_data.FileStore(self.opts))
+
+    def test_sqlite(self):
+        self._check_reads(minion_data.SQLiteStore(self.opts))
+        self._check_mine(minion_data.SQLiteStore(self.opts))
+
+    def test_sqlite_batch(self):
+        '''
+        Writes are committed once the batch is full, or when the store is read
+        '''
+        store = minion_data.SQLiteStore(self.opts)
+        other = minion_data.SQLiteStore(self.opts)
+        store.store('minion1', self.grains, self.pillar)
+        self.assertEqual(other.ids(), set())
+        store.store('minion2', self.grains, self.pillar)
+        self.assertEqual(other.ids(), set(['minion1', 'minion2']))
+        store.store('minion3', self.grains, self.pillar)
+        self.assertEqual(store.ids(), set(['minion1', 'minion2', 'minion3']))
+
+    def test_sqlite_import(self):
+        '''
+        The data.p and mine.p files are imported into a new database
+        '''
+        files = minion_data.FileStore(self.opts)
+        files.store('minion1', self.grains, self.pillar)
+        files.mine_update('minion1', {'test.ping': True})
+        store = minion_data.SQLiteStore(self.opts)
+        self.assertEqual(store.grains(), {'minion1': self.grains})
+        self.assertEqual(store.mine_get('test.ping'), {'minion1': True})
+        self.assertTrue(
+            os.path.isfile(os.path.join(self.tmp_dir, minion_data.SQLITE_DB)))
+
+    def test_mine_get_list(self):
+        '''
+        The mine.get returns of a list target are memoized
+        '''
+        pki_dir = os.path.join(self.tmp_dir, 'pki')
+        os.makedirs(os.path.join(pki_dir, 'minions'))
+        for id_ in ('minion1', 'minion2'):
+            open(os.path.join(pki_dir, 'minions', id_), 'w').close()
+        self.opts.update({'pki_dir': pki_dir,
+                          'transport': 'zeromq',
+                          'mine_get_cache_ttl': 60,
+                          'minion_data_cache_backend': 'files'})
+        minion_data.store(self.opts).mine_update(
+            'minion1', {'test.ping': True})
+        funcs = object.__new__(salt.daemons.masterapi.RemoteFuncs)
+        funcs.opts = self.opts
+        load = {'id': 'minion1', 'tgt': ['minion1', 'minion2'],
+                'expr_form': 'list', 'fun': 'test.ping'}
+        self.assertEqual(funcs._mine_get(load), {'minion1': True})
+        self.assertEqual(funcs._mine_get(load), {'minion1': True})
+
+
+if __name__ == '__main__':
+    from integration import run_tests
+    run_tests(MinionDataStoreTestCase, needs_daemon=False)
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+'''
+    tests.unit.utils.minions_test
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Test the minion targeting helpers
+'''
+
+# Import python libs
+import os
+import shutil
+import tempfile
+
+# Import Salt Testing libs
+from salttesting import TestCase
+from salttesting.helpers import ensure_in_syspath
+ensure_in_syspath('../../')
+
+# Import salt libs
+import salt.payload
+import salt.utils
+import salt.utils.minions
+
+MINIONS = {
+    'web1': {'grains': {'os': 'Ubuntu',
+                        'roles': ['web', 'db'],
+                        'ipv4': ['10.0.0.1', '127.0.0.1'],
+                        'hw': {'cpus': 4}},
+             'pillar': {'role': 'web', 'users': [{'name': 'bob'}]}},
+    'web2': {'grains': {'os': 'ubuntu',
+                        'roles': ['web'],
+                        'ipv4': ['10.0.0.2'],
+                        'hw': {'cpus': 8}},
+             'pillar': {'role': 'web:front'}},
+    'db1': {'grains': {'os': 'CentOS',
+                       'roles': ['db'],
+                       'ipv4': ['10.1.0.1'],
+                       'hw': {'cpus': 4}},
+            'pillar': {'role': 'db'}},
+}
+
+
+class MinionDataIndexTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.opts = {'cachedir': self.tmp,
+                     'pki_dir': self.tmp,
+                     'transport': 'zeromq',
+                     'minion_data_cache': True,
+                     'minion_data_index': True,
+                     'serial': 'msgpack'}
+        serial = salt.payload.Serial(self.opts)
+        os.makedirs(os.path.join(self.tmp, 'minions'))
+        for id_, data in MINIONS.items():
+            os.makedirs(os.path.join(self.tmp, 'minions', id_))
+            with salt.utils.fopen(os.path.join(self.tmp, 'minions', id_, 'data.p'), 'w+b') as fp_:
+                fp_.write(serial.dumps(data))
+        # A minion with an accepted key but no cached data yet
+        os.makedirs(os.path.join(self.tmp, 'minions', 'new1'))
+        salt.utils.minions._MINION_DATA_INDEXES.clear()
+
+    def tearDown(self):
+        salt.utils.minions._MINION_DATA_INDEXES.clear()
+        shutil.rmtree(self.tmp)
+
+    def _both(self, expr_form, expr):
+        indexed = salt.utils.minions.CkMinions(self.opts)
+        scan_opts = dict(self.opts, minion_data_index=False)
+        scanned = salt.utils.minions.CkMinions(scan_opts)
+        ret = sorted(indexed.check_minions(expr, expr_form))
+        self.assertEqual(ret, sorted(scanned.check_minions(expr, expr_form)))
+        return ret
+
+    def test_grain_match(self):
+        self.assertEqual(self._both('grain', 'os:Ubuntu'),
+                         ['new1', 'web1', 'web2'])
+        self.assertEqual(self._both('grain', 'os:cent*'), ['db1', 'new1'])
+        self.assertEqual(self._both('grain', 'roles:db'), ['db1', 'new1', 'web1'])
+        self.assertEqual(self._both('grain', 'hw:cpus:8'), ['new1', 'web2'])
+        self.assertEqual(self._both('grain', 'hw:*'),
+                         ['db1', 'new1', 'web1', 'web2'])
+        self.assertEqual(self._both('grain', 'nope:x'), ['new1'])
+
+    def test_grain_pcre_match(self):
+        self.assertEqual(self._both('grain_pcre', 'os:(ubuntu|centos)$'),
+                         ['db1', 'new1', 'web1', 'web2'])
+
+    def test_pillar_match(self):
+        self.assertEqual(self._both('pillar', 'role:web'), ['new1', 'web1'])
+        self.assertEqual(self._both('pillar', 'role:web:front'),
+                         ['new1', 'web2'])
+        self.assertEqual(self._both('pillar', 'users:name:bob'),
+                         ['new1', 'web1'])
+
+    def test_ipcidr_match(self):
+        self.assertEqual(self._both('ipcidr', '10.0.0.0/24'),
+                         ['new1', 'web1', 'web2'])
+        self.assertEqual(self._both('ipcidr', '10.1.0.1'), ['db1', 'new1'])
+
+    def test_update(self):
+        index = salt.utils.minions.minion_data_index(self.opts)
+        self.assertEqual(index.match('grains', 'os:Ubuntu'),
+                         set(['web1', 'web2']))
+        index.update('web2', {'os': 'Debian'}, {})
+        self.assertEqual(index.match('grains', 'os:Ubuntu'), set(['web1']))
+        self.assertEqual(index.match('grains', 'os:debian'), set(['web2']))
+        index.remove('web2')
+        self.assertNotIn('web2', index.values['grains'][('os',)].get('debian', ()))
+
+    def test_compound_match(self):
+        for index in (True, False):
+            opts = dict(self.opts, minion_data_index=index)
+            ckminions = salt.utils.minions.CkMinions(opts)
+
+            def _check(expr):
+                return sorted(ckminions.check_minions(expr, 'compound'))
+
+            self.assertEqual(_check('G@os:Ubuntu and G@roles:db'),
+                             ['new1', 'web1'])
+            self.assertEqual(_check('G@os:Ubuntu and not L@web1,new1'),
+                             ['web2'])
+            self.assertEqual(_check('web* not G@roles:db'), ['web2'])
+            self.assertEqual(_check('( I@role:db or E@web1 ) and S@10.0.0.0/8'),
+                             ['db1', 'new1', 'web1'])
+            self.assertEqual(_check('db* or G@hw:cpus:8 and not web2'),
+                             ['db1', 'new1'])
+            self.assertEqual(_check('not web1'), [])
+            self.assertEqual(_check('web1 and ( web2'), [])
+            self.assertEqual(_check('X@foo'), [])
+
+    def test_compound_reads_data_once(self):
+        opts = dict(self.opts, minion_data_index=False)
+        ckminions = salt.utils.minions.CkMinions(opts)
+        reads = []
+        orig = ckminions._read_minion_data
+
+        def _read(minion_id):
+            reads.append(minion_id)
+            return orig(minion_id)
+
+        ckminions._read_minion_data = _read
+        self.assertEqual(
+            sorted(ckminions.check_minions(
+                'G@os:Ubuntu and G@hw:cpus:4 and not L@web2', 'compound')),
+            ['new1', 'web1'])
+        self.assertEqual(sorted(reads), ['db1', 'new1', 'web1'])
+
+
+if __name__ == '__main__':
+    from integration import run_tests
+    run_tests(MinionDataIndexTestCase, needs_daemon=False)